@@ -0,0 +1,238 @@
+# Headless batch plant segmentation: runs vision.main.segment_plant() over
+# directories of photos in a process pool and writes area, perimeter,
+# bounding box and aspect ratio per photo to the iot-manager datastore
+# (plant_shapes table, see iot-manager/datastore/plants.py).
+#
+# Decoding a 5 MP JPEG costs more than the segmentation itself. Photos are
+# decoded at a reduced scale (libjpeg scales by 1/2, 1/4 or 1/8 while
+# decoding) just big enough for the working width, resized to it and only
+# the ROI is thresholded. Metrics are scaled back to pixels of the full
+# resolution photo, so results at different working widths compare. Each
+# pool process runs OpenCV single threaded, the pool is the parallelism.
+# Rows are written by the parent in batches, SQLite has a single writer.
+# https://docs.opencv.org/4.x/d8/d6a/group__imgcodecs__flags.html
+#
+# ROI is x,y,w,h as fractions of the frame (0.25,0,0.5,1) or as pixels of
+# the full resolution photo (640,0,1280,1944).
+#
+# set PYTHONPATH to iot-manager, see iot-manager/README.md. Pool processes
+# only import its jpeg.py helpers, the datastore is imported by the parent
+# to write the results.
+# cd copilot
+# python -m vision.batch ../iot-manager/photos/store --roi 0.25,0,0.5,1 --width 640
+
+import argparse
+import os
+import time
+from multiprocessing import Pool
+from pathlib import Path
+
+from vision.main import segment_plant
+
+WORKING_WIDTH = 640
+EXTENSIONS = ('.jpg', '.jpeg')
+# thumbnails and previews written by datastore.photos next to each photo
+DERIVED = ('_thumbnail', '_preview')
+BATCH_SIZE = 100
+
+
+def parse_roi(value):
+    """'x,y,w,h' -> tuple of 4 floats, None for the whole frame."""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = value.split(',')
+    roi = tuple(float(v) for v in value)
+    if len(roi) != 4 or roi[2] <= 0 or roi[3] <= 0:
+        raise ValueError(f'roi must be x,y,w,h with w and h > 0: {value}')
+    return roi
+
+
+def roi_pixels(roi, width, height):
+    # ROI in full resolution pixels, clipped to the frame
+    if roi is None:
+        return 0, 0, width, height
+    x, y, w, h = roi
+    if max(roi) <= 1:
+        x, y, w, h = x * width, y * height, w * width, h * height
+    x0, y0 = max(0, round(x)), max(0, round(y))
+    x1, y1 = min(width, round(x + w)), min(height, round(y + h))
+    if x1 <= x0 or y1 <= y0:
+        raise ValueError(f'roi {roi} is outside the {width}x{height} frame')
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def load_working(filepath, working_width=WORKING_WIDTH):
+    """
+    The photo at working_width, decoded at reduced scale where possible.
+
+    Returns:
+        tuple: (BGR image, (full width, full height))
+    """
+    import cv2
+    from jpeg import jpeg_size, reduced_flag
+
+    size = jpeg_size(filepath)
+    flag = reduced_flag(size[0], working_width) if size and working_width else cv2.IMREAD_COLOR
+    image = cv2.imread(str(filepath), flag)
+    if image is None:
+        raise IOError(f'cannot decode {filepath}')
+    height, width = image.shape[:2]
+    if size is None:
+        size = (width, height)
+    if working_width and width > working_width:
+        image = cv2.resize(image, (working_width, round(height * working_width / width)), interpolation=cv2.INTER_AREA)
+    return image, size
+
+
+def analyse_photo(filepath, roi=None, working_width=WORKING_WIDTH, min_area=None):
+    """
+    Segment one photo, runs in the pool.
+
+    Args:
+        roi: see parse_roi()
+        working_width (int): width the photo is segmented at, 0 for full size
+        min_area (float): smallest plant in full resolution pixels,
+            defaults to vision.main.MIN_AREA
+
+    Returns:
+        dict: filepath, ts, area, perimeter, x, y, width, height,
+            aspect_ratio, roi and working_width, area 0 and no box if no
+            plant was found
+    """
+    from vision.main import MIN_AREA
+
+    image, (full_width, full_height) = load_working(filepath, working_width)
+    scale = full_width / image.shape[1] # full resolution pixels per working pixel
+    rx, ry, rw, rh = roi_pixels(parse_roi(roi), full_width, full_height)
+    x0, y0 = int(rx / scale), int(ry / scale)
+    x1, y1 = max(x0 + 1, round((rx + rw) / scale)), max(y0 + 1, round((ry + rh) / scale))
+    min_area = MIN_AREA if min_area is None else min_area
+    metrics, _ = segment_plant(image[y0:y1, x0:x1], min_area=min_area / scale ** 2)
+
+    result = {
+        "filepath": str(filepath),
+        # file modification time stands in for the capture time of photos outside the store
+        "ts": int(os.path.getmtime(filepath) * 1000),
+        "roi": f'{rx},{ry},{rw},{rh}',
+        "working_width": image.shape[1],
+        "area": 0.0, "perimeter": 0.0,
+        "x": None, "y": None, "width": None, "height": None, "aspect_ratio": None,
+    }
+    if metrics:
+        result.update(
+            area=metrics['area'] * scale ** 2,
+            perimeter=metrics['perimeter'] * scale,
+            x=round((x0 + metrics['x']) * scale),
+            y=round((y0 + metrics['y']) * scale),
+            width=round(metrics['width'] * scale),
+            height=round(metrics['height'] * scale),
+            aspect_ratio=metrics['aspect_ratio'],
+        )
+    return result
+
+
+def _analyse(args):
+    filepath, kwargs = args
+    try:
+        return analyse_photo(filepath, **kwargs), None
+    except Exception as e:
+        return None, f'{filepath}: {e}'
+
+
+def _init_worker():
+    import cv2
+    cv2.setNumThreads(1)
+
+
+def find_photos(paths):
+    """JPEGs in the given files and directories, recursively, without derived images."""
+    photos = []
+    for path in paths:
+        path = Path(path)
+        files = [path] if path.is_file() else sorted(p for p in path.rglob('*') if p.is_file())
+        for f in files:
+            if f.suffix.lower() in EXTENSIONS and not f.stem.endswith(DERIVED):
+                photos.append(f.resolve())
+    return photos
+
+
+def run_batch(photos, roi=None, working_width=WORKING_WIDTH, workers=None, zone=None, device_path=None,
+              record=None, batch_size=BATCH_SIZE, log_every=500):
+    """
+    Segment photos in a pool.
+
+    Args:
+        photos (list): file paths
+        zone (str): zone of photos without a Photo row
+        device_path (str): camera of photos without a Photo row
+        record: called with each batch of results, e.g. datastore.plants.record_shapes
+
+    Returns:
+        dict: processed, errors, seconds and images_per_s
+    """
+    kwargs = {"roi": parse_roi(roi), "working_width": working_width}
+    processed = errors = 0
+    batch = []
+    start = time.perf_counter()
+
+    def flush():
+        if batch and record is not None:
+            record(batch)
+        batch.clear()
+
+    with Pool(workers, initializer=_init_worker) as pool:
+        # unordered with chunks: workers never wait on a slow photo, and few round trips
+        chunksize = max(1, min(16, len(photos) // (4 * (workers or os.cpu_count() or 1))))
+        for result, error in pool.imap_unordered(_analyse, [(str(p), kwargs) for p in photos], chunksize):
+            if error is not None:
+                errors += 1
+                print(f'error {error}')
+                continue
+            result.update(zone=zone, device_path=device_path)
+            batch.append(result)
+            processed += 1
+            if len(batch) >= batch_size:
+                flush()
+            if log_every and processed % log_every == 0:
+                print(f'{processed}/{len(photos)} photos, {processed / (time.perf_counter() - start):.1f} images/s')
+        flush()
+
+    seconds = time.perf_counter() - start
+    return {
+        "processed": processed,
+        "errors": errors,
+        "seconds": seconds,
+        "images_per_s": processed / seconds if seconds else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Segment plants in directories of photos and record their shape in the datastore')
+    parser.add_argument('paths', nargs='+', help='JPEG files or directories, searched recursively')
+    parser.add_argument('--roi', type=str, help='x,y,w,h as fractions of the frame or full resolution pixels (default: whole frame)')
+    parser.add_argument('--width', type=int, default=WORKING_WIDTH, help=f'Working width in pixels, 0 for full size (default: {WORKING_WIDTH})')
+    parser.add_argument('--workers', type=int, help='Pool processes (default: CPU count)')
+    parser.add_argument('--zone', type=str, help='Zone of photos that are not in the photo store')
+    parser.add_argument('--device-path', type=str, help='Camera of photos that are not in the photo store')
+    parser.add_argument('--force', action='store_true', help='Analyse photos that already have a row again')
+    parser.add_argument('--dry-run', action='store_true', help='Only report the rate, write nothing')
+    args = parser.parse_args()
+
+    photos = find_photos(args.paths)
+    record = None
+    if not args.dry_run:
+        from datastore import plants
+        plants.setup()
+        if not args.force:
+            done = plants.analysed(photos)
+            photos = [p for p in photos if str(p) not in done]
+        record = plants.record_shapes
+
+    stats = run_batch(photos, roi=args.roi, working_width=args.width, workers=args.workers,
+                      zone=args.zone, device_path=args.device_path, record=record)
+    print(f"{stats['processed']} photos in {stats['seconds']:.2f}s ({stats['images_per_s']:.1f} images/s), {stats['errors']} errors")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# Size and scan time of a season of readings in SQLite versus the Parquet
+# archive: one sensor over the whole season, and all sensors of one metric.
+# Bytes touched by the archive scan are the compressed column chunks of the
+# row groups whose statistics match, from the Parquet footers.
+#
+# cd iot-manager
+# python -m benchmarks.bench_archive --days 90 --sensors 10 --interval 60
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import pyarrow.parquet as pq
+
+from datastore import Base, query_readings
+from datastore.archive import export_closed_days, query_history, scan_history
+from datastore.bulk import load_chunks
+from datastore.db import create_sqlite_engine
+from tests.mock.sensors import generate_chunks
+
+
+def timed(name, fn):
+    start = time.perf_counter()
+    result = fn()
+    print(f'{name:40} {len(result):9d} rows {time.perf_counter() - start:7.3f}s')
+    return result
+
+
+def bytes_touched(root, sensor_id, columns):
+    touched = 0
+    for path in Path(root).rglob('*.parquet'):
+        metadata = pq.ParquetFile(path).metadata
+        for g in range(metadata.num_row_groups):
+            group = metadata.row_group(g)
+            names = [group.column(c).path_in_schema for c in range(group.num_columns)]
+            stats = group.column(names.index('sensor_id')).statistics
+            if stats is not None and stats.has_min_max and not (stats.min <= sensor_id <= stats.max):
+                continue
+            touched += sum(group.column(names.index(c)).total_compressed_size for c in columns)
+    return touched
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare SQLite and Parquet archive scans')
+    parser.add_argument('--days', type=int, default=90, help='Days of history (default: 90)')
+    parser.add_argument('--sensors', type=int, default=10, help='Sensors, each with temp and humidity (default: 10)')
+    parser.add_argument('--interval', type=int, default=60, help='Seconds between readings (default: 60)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path_db = Path(directory, 'season.db')
+        root = Path(directory, 'archive')
+        engine = create_sqlite_engine(path_db)
+        Base.metadata.create_all(engine)
+        sensors = [f'soil_temp_{i}' for i in range(args.sensors)]
+        start = 1735689600000 # 2025-01-01
+        end = start + args.days * 24 * 60 * 60 * 1000 - 1
+        load_chunks(engine, generate_chunks(
+            sensors, ['temp', 'humidity'], start_date='2025-01-01 00:00:00', num_days=args.days,
+            interval_seconds=args.interval, seed=1,
+        ), drop_indexes=True, rollups=False)
+
+        report = export_closed_days(engine=engine, root=root, now=end + 1, zones={})
+        db_bytes = path_db.stat().st_size
+        archive_bytes = sum(p.stat().st_size for p in root.rglob('*.parquet'))
+        print(f"archived {report['rows']} rows of {report['days']} days in {report['seconds']:.1f}s")
+        print(f'sqlite {db_bytes / 2**20:.1f} MiB, archive {archive_bytes / 2**20:.1f} MiB')
+
+        timed('sqlite one sensor, season', lambda: query_readings(sensors[0], 'temp', start, end, bind=engine))
+        timed('archive one sensor, season', lambda: query_history(sensors[0], 'temp', start, end, bind=engine, root=root))
+        touched = bytes_touched(root, sensors[0], ['ts', 'value'])
+        print(f'archive bytes touched {touched / 2**20:.2f} MiB, {100 * touched / db_bytes:.1f}% of the sqlite file')
+
+        timed('sqlite all sensors temp, season', lambda: scan_history(start, end, metrics=['temp'], bind=engine, root=Path(directory, 'empty')))
+        timed('archive all sensors temp, season', lambda: scan_history(start, end, metrics=['temp'], bind=engine, root=root))
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
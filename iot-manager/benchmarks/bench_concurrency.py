@@ -0,0 +1,131 @@
+# N reader processes and 1 writer process hitting the same SQLite file, like
+# the Flask server, RQ workers and loaders do. Reports p50/p99 latency per
+# operation and lock errors for the 'default' and 'production' profiles in
+# datastore/db.py.
+#
+# cd iot-manager
+# python -m benchmarks.bench_concurrency --readers 4 --seconds 10
+
+import argparse
+import multiprocessing
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+
+from datastore import Base, Reading, to_reading_rows
+from datastore.db import create_sqlite_engine
+
+SENSORS = ['soil_temp', 'soil_moisture', 'air_temp_humidity', 'water_level']
+
+
+def seed(path, profile, rows):
+    engine = create_sqlite_engine(path, profile)
+    Base.metadata.create_all(engine)
+    minute = 60 * 1000
+    with engine.begin() as conn:
+        conn.execute(Reading.__table__.insert(), [
+            {"sensor_id": SENSORS[i % len(SENSORS)], "metric": "value", "ts": i * minute, "value": float(i)}
+            for i in range(rows)
+        ])
+    engine.dispose()
+
+
+def run_writer(path, profile, seconds, rows_per_commit, results):
+    engine = create_sqlite_engine(path, profile)
+    latencies, errors = [], 0
+    ts = 10 ** 12
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        rows = []
+        for _ in range(rows_per_commit):
+            ts += 1000
+            rows.extend(to_reading_rows(random.choice(SENSORS), {"value": random.random()}, ts=ts))
+        start = time.perf_counter()
+        try:
+            with engine.begin() as conn:
+                conn.execute(Reading.__table__.insert(), rows)
+        except OperationalError:
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+    results.put(('writer', latencies, errors))
+
+
+def run_reader(path, profile, seconds, seed_rows, results):
+    engine = create_sqlite_engine(path, profile, readonly=True)
+    latencies, errors = [], 0
+    minute = 60 * 1000
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        start_ts = random.randrange(seed_rows) * minute
+        stmt = (
+            select(Reading.ts, Reading.value)
+            .where(Reading.sensor_id == random.choice(SENSORS))
+            .where(Reading.metric == 'value')
+            .where(Reading.ts.between(start_ts, start_ts + 24 * 60 * minute))
+        )
+        start = time.perf_counter()
+        try:
+            with engine.connect() as conn:
+                conn.execute(stmt).all()
+        except OperationalError:
+            errors += 1
+        latencies.append(time.perf_counter() - start)
+    results.put(('reader', latencies, errors))
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return float('nan')
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def bench(profile, args, directory):
+    path = Path(directory, f'{profile}.db')
+    seed(path, profile, args.seed_rows)
+
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=run_writer, args=(path, profile, args.seconds, args.rows_per_commit, results))]
+    processes += [
+        multiprocessing.Process(target=run_reader, args=(path, profile, args.seconds, args.seed_rows, results))
+        for _ in range(args.readers)
+    ]
+    for p in processes:
+        p.start()
+    collected = {'reader': ([], 0), 'writer': ([], 0)}
+    for _ in processes:
+        role, latencies, errors = results.get()
+        previous, previous_errors = collected[role]
+        collected[role] = (previous + latencies, previous_errors + errors)
+    for p in processes:
+        p.join()
+
+    for role, (latencies, errors) in collected.items():
+        print(
+            f'{profile:>10} {role:>6}: {len(latencies):>7} ops '
+            f'p50 {percentile(latencies, 50) * 1000:8.2f} ms '
+            f'p99 {percentile(latencies, 99) * 1000:8.2f} ms '
+            f'max {max(latencies, default=0) * 1000:8.2f} ms '
+            f'errors {errors}'
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark concurrent readers and a writer on one SQLite file')
+    parser.add_argument('--readers', type=int, default=4, help='Reader processes (default: 4)')
+    parser.add_argument('--seconds', type=float, default=10, help='Duration per profile (default: 10)')
+    parser.add_argument('--seed-rows', type=int, default=100000, help='Readings loaded before the run (default: 100000)')
+    parser.add_argument('--rows-per-commit', type=int, default=10, help='Readings per write transaction (default: 10)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for profile in ('default', 'production'):
+            bench(profile, args, directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# Time to schedule a 30 day protocol with one enqueue_at() + save_meta() per
+# metadata key per job (the previous scheduler.schedule_action path) versus
+# scheduler.schedule_actions() on a single Redis pipeline.
+#
+# needs a running redis-server, jobs created here are deleted afterwards
+# cd iot-manager
+# python -m benchmarks.bench_enqueue --days 30
+
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from rq.registry import ScheduledJobRegistry
+
+import services.queues as queues
+from services import scheduler
+
+
+def noop(metadata):
+    return metadata
+
+
+def build_protocol(days, sensor_interval_m):
+    # lights on/off daily, photos every 12h, sensor sweeps every sensor_interval_m
+    start = datetime.now() + timedelta(days=1)
+    actions = []
+    for d in range(days):
+        day = start + timedelta(days=d)
+        for action_datetime in (day, day + timedelta(hours=12)):
+            actions.append((action_datetime, noop, {"type": "light_cwww", "on_datetime": action_datetime.isoformat()}))
+            actions.append((action_datetime, noop, {"type": "camera", "on_datetime": action_datetime.isoformat()}))
+        for m in range(0, 24 * 60, sensor_interval_m):
+            action_datetime = day + timedelta(minutes=m)
+            actions.append((action_datetime, noop, {"type": "sensors", "on_datetime": action_datetime.isoformat()}))
+    return actions
+
+
+def schedule_per_job(actions):
+    jobs = []
+    for action_datetime, action, metadata in actions:
+        q = scheduler.get_queue(metadata)
+        job = q.enqueue_at(action_datetime, action, metadata)
+        for key in metadata:
+            job.meta[key] = metadata[key]
+            job.save_meta()
+        jobs.append(job)
+    return jobs
+
+
+def cleanup(jobs):
+    with queues.r.pipeline() as pipe:
+        for job in jobs:
+            pipe.zrem(ScheduledJobRegistry(queue=scheduler.get_queue(job.meta)).key, job.id)
+            pipe.delete(job.key)
+        pipe.execute()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark per-job vs pipelined protocol scheduling')
+    parser.add_argument('--days', type=int, default=30, help='Protocol horizon in days (default: 30)')
+    parser.add_argument('--sensor-interval', type=int, default=30, help='Minutes between sensor sweeps (default: 30)')
+    args = parser.parse_args()
+
+    actions = build_protocol(args.days, args.sensor_interval)
+
+    start = time.perf_counter()
+    jobs = schedule_per_job(actions)
+    per_job = time.perf_counter() - start
+    cleanup(jobs)
+    print(f'per-job enqueue_at + save_meta: {len(actions)} jobs in {per_job:.3f}s')
+
+    start = time.perf_counter()
+    jobs = scheduler.schedule_actions(actions)
+    pipelined = time.perf_counter() - start
+    cleanup(jobs)
+    print(f'pipelined schedule_actions:     {len(actions)} jobs in {pipelined:.3f}s')
+
+    print(f'speedup: {per_job / pipelined:.1f}x')
+
+
+if __name__ == "__main__":
+    main()
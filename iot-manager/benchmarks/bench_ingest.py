@@ -0,0 +1,69 @@
+# Compare ingestion throughput of the per-row commit path in
+# datastore.add_sensor_reading against the BufferedWriter bulk insert path.
+#
+# cd iot-manager
+# python -m benchmarks.bench_ingest --rows 2000
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy import create_engine, func, select
+
+import datastore
+from datastore import Base, Reading, BufferedWriter, to_reading_rows, update_rollups
+
+
+def make_engine(directory, name):
+    engine = create_engine(f'sqlite:///{Path(directory, name)}')
+    Base.metadata.create_all(engine)
+    return engine
+
+
+def count_rows(engine):
+    with engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(Reading.__table__)).scalar()
+
+
+def bench_per_row(engine, rows):
+    datastore.db.engine = engine
+    start = time.perf_counter()
+    for i in range(rows):
+        datastore.add_sensor_reading('soil_temp', {'temp_c': 20 + i % 5})
+    return time.perf_counter() - start
+
+
+def bench_buffered(engine, rows, max_rows):
+    writer = BufferedWriter(engine, Reading.__table__, max_rows=max_rows, max_age_s=1.0, on_flush=update_rollups).start()
+    start = time.perf_counter()
+    for i in range(rows):
+        writer.add_many(to_reading_rows('soil_temp', {'temp_c': 20 + i % 5}))
+    writer.close()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark per-row vs buffered sensor reading ingestion')
+    parser.add_argument('--rows', type=int, default=2000, help='Readings to insert per path (default: 2000)')
+    parser.add_argument('--batch', type=int, default=500, help='BufferedWriter max_rows (default: 500)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = make_engine(directory, 'per_row.db')
+        elapsed = bench_per_row(engine, args.rows)
+        assert count_rows(engine) == args.rows
+        per_row = args.rows / elapsed
+        print(f'per-row commit: {args.rows} rows in {elapsed:.3f}s -> {per_row:,.0f} rows/s')
+
+        engine = make_engine(directory, 'buffered.db')
+        elapsed = bench_buffered(engine, args.rows, args.batch)
+        assert count_rows(engine) == args.rows
+        buffered = args.rows / elapsed
+        print(f'buffered (batch {args.batch}): {args.rows} rows in {elapsed:.3f}s -> {buffered:,.0f} rows/s')
+
+        print(f'speedup: {buffered / per_row:.1f}x')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+# Peak Python memory of reading a long range at once with query_readings()
+# versus streaming it with iter_readings().
+#
+# cd iot-manager
+# python -m benchmarks.bench_iter --rows 1000000
+
+import argparse
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from datastore import Base, Reading, query_readings, iter_readings
+from datastore.db import create_sqlite_engine
+
+
+def seed(engine, rows, batch=100000):
+    Base.metadata.create_all(engine)
+    for offset in range(0, rows, batch):
+        with engine.begin() as conn:
+            conn.execute(Reading.__table__.insert(), [
+                {"sensor_id": "soil_temp", "metric": "temp_c", "ts": i * 1000, "value": 20.0 + i % 10}
+                for i in range(offset, min(offset + batch, rows))
+            ])
+
+
+def measure(label, fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    count = fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f'{label:>28}: {count} rows in {elapsed:.2f}s, peak {peak / 1024 / 1024:.1f} MiB')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare memory of full range reads and streamed reads')
+    parser.add_argument('--rows', type=int, default=1000000, help='Readings in the range (default: 1000000)')
+    parser.add_argument('--chunk', type=int, default=5000, help='iter_readings chunk size (default: 5000)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_sqlite_engine(Path(directory, 'iter.db'))
+        seed(engine, args.rows)
+        end = args.rows * 1000
+
+        measure('query_readings', lambda: len(query_readings('soil_temp', 'temp_c', 0, end, bind=engine)))
+        measure(f'iter_readings chunk={args.chunk}', lambda: sum(
+            len(c) for c in iter_readings('soil_temp', 'temp_c', 0, end, chunk=args.chunk, bind=engine)
+        ))
+        measure('iter_readings numpy', lambda: sum(
+            len(ts) for ts, _ in iter_readings('soil_temp', 'temp_c', 0, end, chunk=args.chunk, as_numpy=True, bind=engine)
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# Drive the sweep -> datastore pipeline with simulated sensors: a thousand
+# virtual sensors with read latency and failures, every sweep written to a
+# temporary database with add_sensor_readings().
+#
+# cd iot-manager
+# python -m benchmarks.bench_simulator --sensors 1000 --sweeps 5
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import devices
+from datastore import Base, add_sensor_readings
+from datastore.db import create_sqlite_engine
+from devices.simulator import Simulator, make_virtual_sensors
+from devices.sweep import sweep
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the sensor pipeline with simulated devices')
+    parser.add_argument('--sensors', type=int, default=1000, help='Virtual sensors (default: 1000)')
+    parser.add_argument('--sweeps', type=int, default=5, help='Sweeps to run (default: 5)')
+    parser.add_argument('--workers', type=int, default=64, help='Sweep threads (default: 64)')
+    parser.add_argument('--buses', type=int, default=None, help='Share this many buses instead of one pin per sensor')
+    parser.add_argument('--latency', type=float, default=0.05, help='Mean read latency in seconds (default: 0.05)')
+    parser.add_argument('--failure-rate', type=float, default=0.01, help='Read failure probability (default: 0.01)')
+    args = parser.parse_args()
+
+    simulator = devices.use_backend(Simulator(
+        latency_s=args.latency, latency_jitter_s=args.latency / 2, failure_rate=args.failure_rate, seed=1,
+    ))
+    sensors = make_virtual_sensors(args.sensors, buses=args.buses)
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_sqlite_engine(Path(directory, 'simulator.db'))
+        Base.metadata.create_all(engine)
+
+        for i in range(args.sweeps):
+            report = sweep(sensors, max_workers=args.workers)
+            start = time.perf_counter()
+            rows = add_sensor_readings(report['readings'], bind=engine)
+            write_s = time.perf_counter() - start
+            print(
+                f'sweep {i}: {len(report["readings"])} readings, {len(report["errors"])} errors, '
+                f'read {report["seconds"]:.2f}s, wrote {rows} rows in {write_s:.3f}s ({rows / write_s:.0f} rows/s)'
+            )
+
+        serial_s = sum(report['timings'].values())
+        print(f'last sweep serial read time would be {serial_s:.1f}s, simulator {simulator.stats()}')
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
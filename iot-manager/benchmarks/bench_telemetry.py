@@ -0,0 +1,73 @@
+# Bytes per reading and encode/decode throughput of the binary telemetry
+# records (devices/telemetry.py) against the JSON dicts with now_str()
+# timestamps used so far. Decoding includes turning the timestamp into epoch
+# ms, which the datastore does for every JSON reading.
+#
+# cd iot-manager
+# python -m benchmarks.bench_telemetry --readings 100000
+
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from devices import telemetry
+from utils import to_epoch_ms
+
+
+def make_readings(count, seed=0):
+    rng = random.Random(seed)
+    sensors = list(telemetry.SCHEMA.items())
+    start = datetime(2025, 4, 1, tzinfo=timezone.utc)
+    readings = []
+    for i in range(count):
+        sensor, (_, metrics) = sensors[i % len(sensors)]
+        ts = start + timedelta(seconds=i)
+        values = [round(rng.uniform(0, 100), 2) for _ in metrics]
+        readings.append((sensor, metrics, ts, values))
+    return readings
+
+
+def timed(f):
+    start = time.perf_counter()
+    result = f()
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark binary telemetry records against JSON')
+    parser.add_argument('--readings', type=int, default=100000, help='Readings to encode and decode (default: 100000)')
+    args = parser.parse_args()
+
+    readings = make_readings(args.readings)
+
+    json_payloads, json_encode_s = timed(lambda: [
+        json.dumps(dict(zip(metrics, values), ts=ts.strftime('%Y-%m-%d:%H:%M:%S.%fZ'))).encode()
+        for _, metrics, ts, values in readings
+    ])
+    _, json_decode_s = timed(lambda: [
+        (lambda d: (to_epoch_ms(d.pop('ts')), d))(json.loads(p)) for p in json_payloads
+    ])
+
+    records = [(sensor, int(ts.timestamp() * 1000), values) for sensor, _, ts, values in readings]
+    binary_payloads, binary_encode_s = timed(lambda: [telemetry.encode(*record) for record in records])
+    _, binary_decode_s = timed(lambda: [telemetry.decode(p) for p in binary_payloads])
+    batch, batch_encode_s = timed(lambda: telemetry.encode_batch(records))
+    _, batch_decode_s = timed(lambda: telemetry.decode_batch(batch))
+
+    n = len(readings)
+    rows = [
+        ('json', sum(map(len, json_payloads)), json_encode_s, json_decode_s),
+        ('binary', sum(map(len, binary_payloads)), binary_encode_s, binary_decode_s),
+        ('binary batch', len(batch), batch_encode_s, batch_decode_s),
+    ]
+    for name, size, encode_s, decode_s in rows:
+        print(
+            f'{name:12} {size / n:6.1f} bytes/reading '
+            f'encode {n / encode_s:10.0f}/s decode {n / decode_s:10.0f}/s'
+        )
+
+
+if __name__ == "__main__":
+    main()
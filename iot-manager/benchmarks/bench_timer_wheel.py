@@ -0,0 +1,90 @@
+# Firing jitter and CPU cost of scheduler.TimerWheel versus one
+# threading.Timer per callback. RQ's scheduler is not measured here, it
+# polls the scheduled registry once a second so its jitter is up to 1s.
+#
+# cd iot-manager
+# python -m benchmarks.bench_timer_wheel --timers 2000 --span-ms 2000
+
+import argparse
+import random
+import resource
+import threading
+import time
+
+import numpy as np
+
+from services.scheduler import TimerWheel
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def report(name, lateness, cpu, wall):
+    lateness = np.array(lateness) * 1000
+    print(
+        f'{name:16} fired={len(lateness):6d} '
+        f'late p50={np.percentile(lateness, 50):6.3f}ms p99={np.percentile(lateness, 99):6.3f}ms '
+        f'max={lateness.max():7.3f}ms cpu={cpu:6.3f}s ({100 * cpu / wall:5.1f}% of {wall:.2f}s)'
+    )
+
+
+def run(name, call_later, delays):
+    lateness = []
+    lock = threading.Lock()
+    done = threading.Event()
+    remaining = [len(delays)]
+
+    def callback(deadline):
+        late = time.monotonic() - deadline
+        with lock:
+            lateness.append(late)
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                done.set()
+
+    cpu = cpu_seconds()
+    wall = time.monotonic()
+    for delay in delays:
+        call_later(delay, callback, time.monotonic() + delay)
+    done.wait()
+    report(name, lateness, cpu_seconds() - cpu, time.monotonic() - wall)
+
+
+def thread_timer(delay, callback, *args):
+    timer = threading.Timer(delay, callback, args)
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+def idle_cpu(wheel, seconds):
+    # one far away timer pending, the thread only wakes on level 0 wraps
+    timer = wheel.call_later(seconds * 10, print)
+    cpu = cpu_seconds()
+    time.sleep(seconds)
+    timer.cancel()
+    print(f'{"wheel idle":16} cpu={cpu_seconds() - cpu:.4f}s over {seconds}s with one pending timer')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure timer jitter and CPU overhead')
+    parser.add_argument('--timers', type=int, default=2000, help='Callbacks to schedule (default: 2000)')
+    parser.add_argument('--span-ms', type=int, default=2000, help='Delays are uniform in 0..span (default: 2000)')
+    parser.add_argument('--tick-ms', type=float, default=1.0, help='Wheel resolution (default: 1.0)')
+    args = parser.parse_args()
+
+    random.seed(1)
+    delays = [random.uniform(0, args.span_ms / 1000) for _ in range(args.timers)]
+
+    wheel = TimerWheel(args.tick_ms).start()
+    run('timer wheel', wheel.call_later, delays)
+    idle_cpu(wheel, 2)
+    wheel.stop()
+
+    run('threading.Timer', thread_timer, delays)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+# Cost per reading of the trigger engine as the number of rules grows. Every
+# rule watches its own sensor, the readings come from a fixed set of sensors,
+# so with the (sensor, metric) index the time per reading should stay flat.
+# Rules do not fire (no queues needed), state is kept in memory.
+#
+# cd iot-manager
+# python -m benchmarks.bench_triggers --rules 10 1000 100000
+
+import argparse
+import random
+import time
+
+from services.triggers import MemoryState, TriggerEngine, TriggerRule
+
+
+def build_engine(count):
+    rules = [
+        TriggerRule(f'bench.water_pump.{i}', f'soil_moisture_{i}', 'moisture', 'lt', 10.0, 'water_pump', hysteresis=5)
+        for i in range(count)
+    ]
+    return TriggerEngine(rules, state=MemoryState(), fire=lambda rule, row: None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark trigger evaluation against the rule count')
+    parser.add_argument('--rules', type=int, nargs='+', default=[10, 1000, 100000], help='Rule counts to compare')
+    parser.add_argument('--sensors', type=int, default=50, help='Sensors the readings come from (default: 50)')
+    parser.add_argument('--readings', type=int, default=200000, help='Readings evaluated per rule count')
+    parser.add_argument('--batch', type=int, default=50, help='Readings per evaluate_rows() call, one sweep')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    rows = [
+        {"sensor_id": f'soil_moisture_{rng.randrange(args.sensors)}', "metric": 'moisture', "ts": i, "value": rng.uniform(20, 60)}
+        for i in range(args.readings)
+    ]
+    batches = [rows[i:i + args.batch] for i in range(0, len(rows), args.batch)]
+
+    for count in args.rules:
+        engine = build_engine(count)
+        start = time.perf_counter()
+        for batch in batches:
+            engine.evaluate_rows(batch)
+        seconds = time.perf_counter() - start
+        print(f'rules={count:7d} {1e6 * seconds / len(rows):6.2f}us/reading {len(rows) / seconds:10.0f} readings/s')
+
+
+if __name__ == "__main__":
+    main()
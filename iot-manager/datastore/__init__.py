@@ -0,0 +1,268 @@
+from sqlalchemy import select, tuple_
+
+import math
+
+from utils import logger, to_epoch_ms
+from datastore import db
+from datastore.db import path_db, engine, read_engine, Session
+from datastore.models import Base, SensorReading, Reading, Photo, PlantShape, Meta, Rollup1m, Rollup1h, Rollup1d
+from datastore.writer import BufferedWriter
+from datastore.rollups import update_rollups, rebuild_rollups, query_series
+
+__all__ = [
+    'db', 'path_db', 'engine', 'read_engine', 'Session',
+    'Base', 'SensorReading', 'Reading', 'Photo', 'PlantShape', 'Meta', 'Rollup1m', 'Rollup1h', 'Rollup1d',
+    'BufferedWriter', 'update_rollups', 'rebuild_rollups', 'query_series',
+    'setup', 'init', 'start_buffered_writer', 'stop_buffered_writer', 'flush',
+    'add_listener', 'remove_listener', 'notify', 'flatten_values', 'to_reading_rows',
+    'add_sensor_reading', 'add_sensor_readings', 'query_readings', 'query_readings_page', 'iter_readings',
+]
+
+connection = None
+# set by start_buffered_writer(), add_sensor_reading() commits per row otherwise
+writer = None
+# called with the Reading rows of every ingested reading, see add_listener()
+listeners = []
+
+
+def setup():
+    # engine = create_engine('sqlite:///data/sensordata.db')
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        # only takes effect on a new database, see datastore/retention.py
+        conn.exec_driver_sql('PRAGMA auto_vacuum = INCREMENTAL')
+    Base.metadata.create_all(db.engine)
+
+
+def init():
+    global connection
+    # engine = create_engine('sqlite:///data/sensordata.db')
+    # a reader, holding the only writer connection would block every write
+    connection = db.read_engine.connect()
+
+
+def start_buffered_writer(**kwargs):
+    """
+    Route add_sensor_reading() through a BufferedWriter so readings are
+    written in batches. Keyword arguments are passed to BufferedWriter.
+    """
+    global writer
+    if writer is None:
+        kwargs.setdefault('on_flush', update_rollups)
+        writer = BufferedWriter(db.engine, Reading.__table__, **kwargs).start()
+    return writer
+
+
+def stop_buffered_writer():
+    global writer
+    if writer is not None:
+        writer.close()
+        writer = None
+
+
+def flush():
+    if writer is None:
+        return 0
+    return writer.flush()
+
+
+def add_listener(listener):
+    """
+    Call listener(rows) with the Reading row dicts of every reading ingested
+    in this process, e.g. datastore.ring.store().write_rows. Listeners run
+    on the ingesting thread and must be quick.
+    """
+    if listener not in listeners:
+        listeners.append(listener)
+    return listener
+
+
+def remove_listener(listener):
+    if listener in listeners:
+        listeners.remove(listener)
+
+
+def notify(rows):
+    for listener in listeners:
+        try:
+            listener(rows)
+        except Exception as e:
+            logger.error(f'datastore listener {listener} failed: {e}')
+
+
+def flatten_values(raw_data, prefix=''):
+    # {"temp_c": 20, "values": [0, 1]} -> [("temp_c", 20.0), ("values.0", 0.0), ("values.1", 1.0)]
+    values = []
+    if isinstance(raw_data, dict):
+        items = raw_data.items()
+    elif isinstance(raw_data, (list, tuple)):
+        items = enumerate(raw_data)
+    else:
+        items = [('value', raw_data)]
+
+    for key, value in items:
+        metric = f'{prefix}{key}'
+        if isinstance(value, bool):
+            values.append((metric, float(value)))
+        elif isinstance(value, (int, float)):
+            # NaN and inf are no readings, and NaN would be stored as NULL
+            if math.isfinite(value):
+                values.append((metric, float(value)))
+        elif isinstance(value, (dict, list, tuple)):
+            values.extend(flatten_values(value, prefix=f'{metric}.'))
+    return values
+
+
+def to_reading_rows(sensor_id, raw_data, ts=None):
+    """
+    Flatten a reading dict into Reading rows, one per numeric value.
+
+    Args:
+        sensor_id (str): sensor the values belong to, e.g. 'soil_temp'
+        raw_data (dict): reading as returned by Sensor.measure()
+        ts: reading time; defaults to raw_data['ts'] and then to now
+
+    Returns:
+        list: dicts with sensor_id, metric, ts and value
+    """
+    if ts is None and isinstance(raw_data, dict):
+        ts = raw_data.get('ts')
+        raw_data = {k: v for k, v in raw_data.items() if k != 'ts'}
+    # stamp the rows when the reading is taken, not when a buffer is flushed
+    ts = to_epoch_ms(ts)
+
+    return [
+        {"sensor_id": sensor_id, "metric": metric, "ts": ts, "value": value}
+        for metric, value in flatten_values(raw_data)
+    ]
+
+
+def add_sensor_reading(sensor_type, raw_data):
+    rows = to_reading_rows(sensor_type, raw_data)
+    if not rows:
+        return
+    notify(rows)
+
+    if writer is not None:
+        writer.add_many(rows)
+        return
+
+    with db.engine.begin() as conn:
+        conn.execute(Reading.__table__.insert(), rows)
+        update_rollups(conn, rows)
+
+
+def add_sensor_readings(readings, bind=None):
+    """
+    Persist several readings, e.g. one sensor sweep, as a single batched
+    write: one transaction and one executemany instead of one per sensor.
+
+    Args:
+        readings (list): (sensor_type, raw_data) tuples
+        bind: engine to write to, defaults to datastore.engine
+
+    Returns:
+        int: rows written or queued
+    """
+    rows = []
+    for sensor_type, raw_data in readings:
+        rows.extend(to_reading_rows(sensor_type, raw_data))
+    if not rows:
+        return 0
+    notify(rows)
+
+    if writer is not None and bind is None:
+        writer.add_many(rows)
+        return len(rows)
+
+    with (bind or db.engine).begin() as conn:
+        conn.execute(Reading.__table__.insert(), rows)
+        update_rollups(conn, rows)
+    return len(rows)
+
+
+def query_readings(sensor_id, metric, start, end, bind=None):
+    """
+    Values of one sensor metric between start and end (inclusive), oldest
+    first. Served by ix_readings_sensor_metric_ts.
+
+    Returns:
+        list: (ts, value) tuples, ts in epoch milliseconds
+    """
+    stmt = (
+        select(Reading.ts, Reading.value)
+        .where(Reading.sensor_id == sensor_id)
+        .where(Reading.metric == metric)
+        .where(Reading.ts.between(to_epoch_ms(start), to_epoch_ms(end)))
+        .order_by(Reading.ts)
+    )
+    with (bind or db.read_engine).connect() as conn:
+        return [tuple(row) for row in conn.execute(stmt)]
+
+
+def query_readings_page(sensor_id, metric, start, end, after=None, limit=1000, bind=None):
+    """
+    One page of readings ordered by (ts, id), for walking long ranges without
+    holding a cursor or the whole result open.
+
+    Args:
+        after (tuple): (ts, id) of the last row of the previous page
+        limit (int): rows per page
+
+    Returns:
+        list: (ts, value, id) tuples, empty once the range is exhausted
+    """
+    stmt = (
+        select(Reading.ts, Reading.value, Reading.id)
+        .where(Reading.sensor_id == sensor_id)
+        .where(Reading.metric == metric)
+        .where(Reading.ts.between(to_epoch_ms(start), to_epoch_ms(end)))
+        .order_by(Reading.ts, Reading.id)
+        .limit(limit)
+    )
+    if after is not None:
+        # keyset pagination, the index already orders by (ts, rowid)
+        stmt = stmt.where(tuple_(Reading.ts, Reading.id) > tuple_(*after))
+    with (bind or db.read_engine).connect() as conn:
+        return [tuple(row) for row in conn.execute(stmt)]
+
+
+def iter_readings(sensor_id, metric, start, end, chunk=1000, as_numpy=False, bind=None):
+    """
+    Stream the readings of one sensor metric between start and end in chunks
+    of at most `chunk` rows, oldest first. Each chunk is its own short read,
+    so memory stays flat however long the range is and the writer is never
+    held up by a long-lived read transaction.
+
+    Args:
+        sensor_id (str): sensor, e.g. 'soil_temp'
+        metric (str): metric, e.g. 'temp_c'
+        start: datetime, now_str() string or epoch ms
+        end: datetime, now_str() string or epoch ms
+        chunk (int): rows per chunk
+        as_numpy (bool): yield (ts, values) NumPy arrays instead of tuples
+        bind: engine to query, defaults to datastore.read_engine
+
+    Yields:
+        list of (ts, value) tuples, or (int64 array, float64 array) with as_numpy
+    """
+    if as_numpy:
+        import numpy as np
+
+    start_ms = to_epoch_ms(start)
+    end_ms = to_epoch_ms(end)
+    after = None
+    while True:
+        page = query_readings_page(sensor_id, metric, start_ms, end_ms, after=after, limit=chunk, bind=bind)
+        if not page:
+            return
+        after = (page[-1][0], page[-1][2])
+
+        if as_numpy:
+            ts = np.fromiter((row[0] for row in page), dtype=np.int64, count=len(page))
+            values = np.fromiter((row[1] for row in page), dtype=np.float64, count=len(page))
+            yield ts, values
+        else:
+            yield [(row[0], row[1]) for row in page]
+
+        if len(page) < chunk:
+            return
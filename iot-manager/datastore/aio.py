@@ -0,0 +1,138 @@
+# asyncio facade over the datastore for event loop code such as the ESPHome
+# API client in services/esphome_api_test.py.
+#
+# SQLite calls block, so nothing here touches the database on the event loop.
+# Readings go into an asyncio.Queue; a drain task hands them in batches to a
+# BufferedWriter on a worker thread, and range queries run page by page on a
+# thread pool. Datastore listeners (triggers, stats, ring) may block on Redis
+# or files too, they are called on the same worker thread once a batch has
+# been queued.
+#
+# store = AsyncStore()
+# await store.start()
+# await store.add('esphome_soil_moisture', {'moisture': 41.5})
+# async for ts, value in store.iter_readings('esphome_soil_moisture', 'moisture', start, end):
+#     ...
+# await store.close()
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from datastore import db, notify, to_reading_rows, query_readings, query_readings_page
+from datastore.models import Reading
+from datastore.rollups import update_rollups, query_series
+from datastore.writer import BufferedWriter
+from utils import logger
+
+
+class AsyncStore:
+    """
+    Non-blocking datastore API for asyncio code.
+
+    Args:
+        engine: writer engine, defaults to datastore.engine
+        read_engine: reader engine, defaults to datastore.read_engine
+        max_queue (int): readings buffered on the loop before add() waits
+        max_rows (int): BufferedWriter flush size
+        max_age_s (float): BufferedWriter flush age
+    """
+    def __init__(self, engine=None, read_engine=None, max_queue=10000, max_rows=500, max_age_s=1.0):
+        self.read_engine = read_engine or db.read_engine
+        self.writer = BufferedWriter(
+            engine or db.engine, Reading.__table__,
+            max_rows=max_rows, max_age_s=max_age_s, max_queue=max_queue, on_flush=update_rollups,
+        )
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        # one thread feeds the writer, the others serve queries
+        self._write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='datastore-aio-write')
+        self._read_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='datastore-aio-read')
+        self._drain_task = None
+
+    async def start(self):
+        self.writer.start()
+        self._drain_task = asyncio.get_running_loop().create_task(self._drain())
+        return self
+
+    async def add(self, sensor_id, raw_data, ts=None):
+        """Queue a reading, waits only when max_queue readings are pending."""
+        await self._queue.put(to_reading_rows(sensor_id, raw_data, ts=ts))
+
+    def add_nowait(self, sensor_id, raw_data, ts=None):
+        """
+        Queue a reading from a plain callback running on the loop, e.g.
+        aioesphomeapi's subscribe_states. Raises asyncio.QueueFull when full.
+        """
+        self._queue.put_nowait(to_reading_rows(sensor_id, raw_data, ts=ts))
+
+    async def flush(self):
+        """Wait until every queued reading is committed."""
+        await self._queue.join()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._write_executor, self.writer.flush)
+
+    async def close(self):
+        await self.flush()
+        if self._drain_task is not None:
+            self._drain_task.cancel()
+            try:
+                await self._drain_task
+            except asyncio.CancelledError:
+                pass
+            self._drain_task = None
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._write_executor, self.writer.close)
+        self._write_executor.shutdown()
+        self._read_executor.shutdown()
+
+    async def _drain(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._queue.get()
+            taken = 1
+            while taken < self.writer.max_rows:
+                try:
+                    batch.extend(self._queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+                taken += 1
+            try:
+                # BufferedWriter.add and the listeners block, keep them off the loop
+                await loop.run_in_executor(self._write_executor, self._write, batch)
+            except Exception as e:
+                logger.error(f'AsyncStore failed to queue {len(batch)} readings: {e}')
+            finally:
+                for _ in range(taken):
+                    self._queue.task_done()
+
+    def _write(self, rows):
+        # on the write thread, listeners only see rows that were accepted
+        notify(rows)
+        self.writer.add_many(rows)
+
+    async def query_readings(self, sensor_id, metric, start, end):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._read_executor, lambda: query_readings(sensor_id, metric, start, end, bind=self.read_engine)
+        )
+
+    async def query_series(self, sensor_id, metric, start, end, max_points=500):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._read_executor,
+            lambda: query_series(sensor_id, metric, start, end, max_points=max_points, bind=self.read_engine),
+        )
+
+    async def iter_readings(self, sensor_id, metric, start, end, chunk=1000):
+        """Async iterator of (ts, value), fetched one page at a time off the loop."""
+        loop = asyncio.get_running_loop()
+        after = None
+        while True:
+            page = await loop.run_in_executor(
+                self._read_executor,
+                lambda: query_readings_page(sensor_id, metric, start, end, after=after, limit=chunk, bind=self.read_engine),
+            )
+            for ts, value, _ in page:
+                yield ts, value
+            if len(page) < chunk:
+                return
+            after = (page[-1][0], page[-1][2])
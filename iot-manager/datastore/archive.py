@@ -0,0 +1,353 @@
+# Columnar archive of closed days of readings, needs pyarrow.
+#
+# Every day that is over is exported once, per zone, to a zstd compressed
+# Parquet file sorted by sensor_id, metric and ts:
+#
+#   data/archive/date=2025-04-01/zone=1/readings.parquet
+#
+# The day directory is written under a temporary name and renamed when all
+# zones are done, so a day is either fully archived or not at all. Days are
+# archived in order, the end of the last archived day is the watermark:
+# queries read the archive before it and SQLite after it, so rows still in
+# SQLite for archived days are never counted twice and retention can delete
+# them at any time.
+#
+# Archive scans only open the date partitions in range and skip row groups by
+# their sensor_id/metric/ts statistics, and only read the columns asked for.
+# https://arrow.apache.org/docs/python/dataset.html
+
+import json
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pandas as pd
+from sqlalchemy import func, select
+
+from datastore import db, query_readings, query_readings_page
+from datastore.models import Reading
+from utils import base_dir, load_yaml, logger, to_epoch_ms
+
+path_archive = Path(*[base_dir, 'data', 'archive'])
+path_config_devices = Path(*[base_dir, 'config', 'devices.yaml'])
+
+DAY_MS = 24 * 60 * 60 * 1000
+DEFAULT_ZONE = '0'
+
+
+def _pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError('the readings archive needs pyarrow, pip install pyarrow') from e
+    return pa, ds, pq
+
+
+def load_zones(path_config=path_config_devices):
+    """sensor type -> zone id from the placements section of devices.yaml"""
+    zones = {}
+    try:
+        placements = load_yaml(path_config).get('placements') or {}
+    except FileNotFoundError:
+        return zones
+    for zone in placements.get('zones') or []:
+        for sensor in (zone.get('devices') or {}).get('sensors') or []:
+            zones[sensor['type']] = str(zone['id'])
+    return zones
+
+
+def zone_of(sensor_id, zones):
+    # sensor ids are the sensor type, optionally with a suffix, e.g. soil_temp_2
+    if sensor_id in zones:
+        return zones[sensor_id]
+    for sensor_type, zone in zones.items():
+        if sensor_id.startswith(f'{sensor_type}_'):
+            return zone
+    return DEFAULT_ZONE
+
+
+def day_str(day_ms):
+    return datetime.fromtimestamp(day_ms / 1000, timezone.utc).strftime('%Y-%m-%d')
+
+
+def day_ms(day):
+    return int(datetime.strptime(day, '%Y-%m-%d').replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def archived_days(root=path_archive):
+    root = Path(root)
+    if not root.exists():
+        return []
+    return sorted(p.name[len('date='):] for p in root.iterdir() if p.is_dir() and p.name.startswith('date='))
+
+
+def watermark(root=path_archive):
+    """Epoch ms up to which readings are served from the archive, None if empty."""
+    days = archived_days(root)
+    if not days:
+        return None
+    return day_ms(days[-1]) + DAY_MS
+
+
+def load_state(root=path_archive):
+    try:
+        with open(Path(root) / '_state.json') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_state(state, root=path_archive):
+    # atomic, a reader sees the old or the new state
+    fd, tmp = tempfile.mkstemp(dir=root, prefix='.state-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, Path(root) / '_state.json')
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def schema():
+    pa, _, _ = _pyarrow()
+    return pa.schema([
+        ('sensor_id', pa.dictionary(pa.int32(), pa.string())),
+        ('metric', pa.dictionary(pa.int32(), pa.string())),
+        ('ts', pa.int64()),
+        ('value', pa.float64()),
+    ])
+
+
+def export_day(day_start, engine=None, root=path_archive, zones=None, row_group_size=131072, chunk=50000, through_id=None):
+    """
+    Write the readings of one UTC day to root/date=<day>/zone=<zone>/readings.parquet.
+
+    Args:
+        through_id (int): only rows up to this readings id, later rows are
+            left to export_late_rows()
+
+    Returns:
+        int: rows archived
+    """
+    pa, _, pq = _pyarrow()
+    engine = engine or db.read_engine
+    zones = load_zones() if zones is None else zones
+    root = Path(root)
+    day = day_str(day_start)
+    day_end = day_start + DAY_MS - 1
+    tmp = root / f'.tmp-date={day}'
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+
+    with engine.connect() as conn:
+        series = conn.execute(
+            select(Reading.sensor_id, Reading.metric).distinct()
+            .where(Reading.ts.between(day_start, day_end))
+            .order_by(Reading.sensor_id, Reading.metric)
+        ).all()
+
+    writers = {}
+    rows = 0
+    try:
+        for sensor_id, metric in series:
+            zone = zone_of(sensor_id, zones)
+            if zone not in writers:
+                (tmp / f'zone={zone}').mkdir()
+                writers[zone] = pq.ParquetWriter(
+                    tmp / f'zone={zone}' / 'readings.parquet', schema(), compression='zstd',
+                )
+            batches = []
+            after = None
+            while True:
+                page = query_readings_page(sensor_id, metric, day_start, day_end, after=after, limit=chunk, bind=engine)
+                if not page:
+                    break
+                after = (page[-1][0], page[-1][2])
+                last_page = len(page) < chunk
+                if through_id is not None:
+                    page = [row for row in page if row[2] <= through_id]
+                if page:
+                    ts = [row[0] for row in page]
+                    batches.append(pa.table({
+                        'sensor_id': pa.array([sensor_id] * len(ts)).dictionary_encode(),
+                        'metric': pa.array([metric] * len(ts)).dictionary_encode(),
+                        'ts': pa.array(ts, pa.int64()),
+                        'value': pa.array([row[1] for row in page], pa.float64()),
+                    }, schema=schema()))
+                    rows += len(ts)
+                if last_page:
+                    break
+            if batches:
+                writers[zone].write_table(pa.concat_tables(batches), row_group_size=row_group_size)
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    # the rename publishes the whole day at once
+    os.replace(tmp, root / f'date={day}')
+    return rows
+
+
+def export_late_rows(after_id, through_id, before, engine=None, root=path_archive, zones=None):
+    """
+    Append the rows with after_id < id <= through_id of days before the
+    watermark `before` to their day's partition.
+
+    Returns:
+        int: rows archived
+    """
+    pa, _, pq = _pyarrow()
+    engine = engine or db.read_engine
+    zones = load_zones() if zones is None else zones
+    stmt = (
+        select(Reading.sensor_id, Reading.metric, Reading.ts, Reading.value)
+        .where(Reading.id > after_id).where(Reading.id <= through_id).where(Reading.ts < before)
+    )
+    with engine.connect() as conn:
+        frame = pd.DataFrame(conn.execute(stmt).all(), columns=['sensor_id', 'metric', 'ts', 'value'])
+    if frame.empty:
+        return 0
+
+    frame['day'] = frame['ts'] - frame['ts'] % DAY_MS
+    frame['zone'] = frame['sensor_id'].map(lambda sensor_id: zone_of(sensor_id, zones))
+    for (day, zone), rows in frame.groupby(['day', 'zone']):
+        directory = Path(root) / f'date={day_str(day)}' / f'zone={zone}'
+        directory.mkdir(parents=True, exist_ok=True)
+        rows = rows.sort_values(['sensor_id', 'metric', 'ts'])
+        table = pa.table({
+            'sensor_id': pa.array(rows['sensor_id'].tolist()).dictionary_encode(),
+            'metric': pa.array(rows['metric'].tolist()).dictionary_encode(),
+            'ts': pa.array(rows['ts'].tolist(), pa.int64()),
+            'value': pa.array(rows['value'].tolist(), pa.float64()),
+        }, schema=schema())
+        # named by after_id: a run interrupted before saving its state is
+        # redone with the same after_id and overwrites its files
+        path = directory / f'readings-after-{after_id}.parquet'
+        tmp = directory / f'.readings-after-{after_id}.parquet'
+        pq.write_table(table, tmp, compression='zstd')
+        os.replace(tmp, path)
+    return len(frame)
+
+
+def export_closed_days(engine=None, root=path_archive, now=None, zones=None):
+    """
+    Archive every day after the watermark that is over, oldest first, and
+    the rows that arrived for archived days since the last run.
+
+    Returns:
+        dict: days and rows archived, late rows, seconds
+    """
+    engine = engine or db.read_engine
+    start = time.perf_counter()
+    today = to_epoch_ms(now)
+    today -= today % DAY_MS
+
+    with engine.connect() as conn:
+        # rows written from here on are left to the next run
+        through_id = conn.execute(select(func.max(Reading.id))).scalar()
+    if through_id is None:
+        return {"days": 0, "rows": 0, "late_rows": 0, "seconds": 0.0}
+
+    late_rows = 0
+    next_day = watermark(root)
+    if next_day is None:
+        with engine.connect() as conn:
+            first = conn.execute(select(Reading.ts).order_by(Reading.ts).limit(1)).scalar()
+        next_day = first - first % DAY_MS
+    else:
+        after_id = load_state(root).get('last_id')
+        # archives written before the state existed start tracking from now
+        if after_id is not None and after_id < through_id:
+            late_rows = export_late_rows(after_id, through_id, next_day, engine=engine, root=root, zones=zones)
+
+    days, rows = 0, 0
+    while next_day < today:
+        # days without readings are archived as empty directories so the watermark moves on
+        rows += export_day(next_day, engine=engine, root=root, zones=zones, through_id=through_id)
+        days += 1
+        next_day += DAY_MS
+
+    Path(root).mkdir(parents=True, exist_ok=True)
+    save_state({"last_id": through_id}, root)
+    report = {"days": days, "rows": rows, "late_rows": late_rows, "seconds": time.perf_counter() - start}
+    logger.info(f'export_closed_days {report}')
+    return report
+
+
+def _date_filter(ds, start_ms, end_ms):
+    # partition pruning, ISO dates compare as strings
+    return (ds.field('date') >= day_str(start_ms - start_ms % DAY_MS)) & (ds.field('date') <= day_str(end_ms))
+
+
+def dataset(root=path_archive):
+    pa, ds, _ = _pyarrow()
+    partitioning = ds.partitioning(pa.schema([('date', pa.string()), ('zone', pa.string())]), flavor='hive')
+    return ds.dataset(root, format='parquet', partitioning=partitioning, schema=schema().append(
+        pa.field('date', pa.string())).append(pa.field('zone', pa.string())))
+
+
+def query_history(sensor_id, metric, start, end, bind=None, root=path_archive):
+    """
+    query_readings() over the archive and SQLite: (ts, value) tuples between
+    start and end (inclusive), oldest first.
+    """
+    start_ms, end_ms = to_epoch_ms(start), to_epoch_ms(end)
+    cold_end = watermark(root)
+    result = []
+    if cold_end is not None and start_ms < cold_end:
+        _, ds, _ = _pyarrow()
+        last = min(end_ms, cold_end - 1)
+        table = dataset(root).to_table(
+            columns=['ts', 'value'],
+            filter=_date_filter(ds, start_ms, last)
+            & (ds.field('sensor_id') == sensor_id) & (ds.field('metric') == metric)
+            & (ds.field('ts') >= start_ms) & (ds.field('ts') <= last),
+        ).sort_by('ts')
+        result = list(zip(table.column('ts').to_pylist(), table.column('value').to_pylist()))
+        start_ms = cold_end
+    if start_ms <= end_ms:
+        result.extend(query_readings(sensor_id, metric, start_ms, end_ms, bind=bind))
+    return result
+
+
+def scan_history(start, end, sensor_ids=None, metrics=None, bind=None, root=path_archive):
+    """
+    Readings of many sensors between start and end (inclusive) as one
+    DataFrame with sensor_id, metric, ts and value, for analytics over long
+    ranges. Not sorted.
+    """
+    start_ms, end_ms = to_epoch_ms(start), to_epoch_ms(end)
+    cold_end = watermark(root)
+    frames = []
+    if cold_end is not None and start_ms < cold_end:
+        _, ds, _ = _pyarrow()
+        last = min(end_ms, cold_end - 1)
+        expression = _date_filter(ds, start_ms, last) & (ds.field('ts') >= start_ms) & (ds.field('ts') <= last)
+        if sensor_ids is not None:
+            expression &= ds.field('sensor_id').isin(list(sensor_ids))
+        if metrics is not None:
+            expression &= ds.field('metric').isin(list(metrics))
+        table = dataset(root).to_table(columns=['sensor_id', 'metric', 'ts', 'value'], filter=expression)
+        frame = table.to_pandas()
+        frame['sensor_id'] = frame['sensor_id'].astype(str)
+        frame['metric'] = frame['metric'].astype(str)
+        frames.append(frame)
+        start_ms = cold_end
+    if start_ms <= end_ms:
+        stmt = select(Reading.sensor_id, Reading.metric, Reading.ts, Reading.value).where(Reading.ts.between(start_ms, end_ms))
+        if sensor_ids is not None:
+            stmt = stmt.where(Reading.sensor_id.in_(list(sensor_ids)))
+        if metrics is not None:
+            stmt = stmt.where(Reading.metric.in_(list(metrics)))
+        with (bind or db.read_engine).connect() as conn:
+            frames.append(pd.DataFrame(conn.execute(stmt).all(), columns=['sensor_id', 'metric', 'ts', 'value']))
+    frames = [f for f in frames if len(f)]
+    if not frames:
+        return pd.DataFrame(columns=['sensor_id', 'metric', 'ts', 'value'])
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,195 @@
+# Bulk import of history (CSV files or DataFrames) into the readings table.
+#
+# Rows go in with the driver's executemany, one transaction per chunk, as
+# plain tuples instead of ORM objects or df.to_sql. For large loads the
+# readings indexes are dropped first and rebuilt once at the end, which is
+# much cheaper than updating the B-trees row by row. Each chunk is folded
+# into the rollups in its own transaction, aggregated per bucket with pandas
+# and merged with the same upsert as update_rollups(). Buckets of days past
+# the raw retention keep their history, a backfill only adds to them.
+#
+# Accepts long CSVs (sensor_id, metric, ts, value, e.g. from
+# tests/mock/sensors.py --sensors) and wide CSVs with one column per metric
+# (e.g. tests/data/temperature_sensor_data.csv) given --sensor-id.
+#
+# cd iot-manager
+# python -m datastore.bulk tests/data/temperature_sensor_data.csv --sensor-id soil_temp --ts-column timestamp_ms
+
+import argparse
+import os
+import time
+from contextlib import contextmanager, nullcontext
+
+import pandas as pd
+
+from datastore import Base, Reading, path_db
+from datastore.rollups import RESOLUTIONS, upsert_statement
+from datastore.db import create_sqlite_engine, load_profile
+from utils import logger
+
+INSERT_READINGS = 'INSERT INTO readings (sensor_id, metric, ts, value) VALUES (?, ?, ?, ?)'
+LONG_COLUMNS = ['sensor_id', 'metric', 'ts', 'value']
+
+# loads at least this big drop and rebuild the indexes
+DROP_INDEXES_ROWS = 1000000
+DROP_INDEXES_BYTES = 64 * 1024 * 1024 # CSV size, about 1.5M rows
+
+
+@contextmanager
+def indexes_dropped(engine, table=Reading.__table__):
+    """Drop the secondary indexes of table, recreate them on exit."""
+    with engine.begin() as conn:
+        for index in table.indexes:
+            index.drop(conn, checkfirst=True)
+    try:
+        yield
+    finally:
+        start = time.perf_counter()
+        with engine.begin() as conn:
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+        logger.info(f'bulk: rebuilt {len(table.indexes)} indexes in {time.perf_counter() - start:.2f}s')
+
+
+def to_long(df, sensor_id=None, ts_column='ts'):
+    """
+    Normalize a chunk to sensor_id, metric, ts (epoch ms) and value columns.
+    Wide chunks (one column per metric) need sensor_id.
+    """
+    if not set(LONG_COLUMNS) <= set(df.columns):
+        if sensor_id is None:
+            raise ValueError(f'columns {list(df.columns)} are not {LONG_COLUMNS}, give a sensor_id for wide data')
+        metrics = [c for c in df.columns if c != ts_column and pd.api.types.is_numeric_dtype(df[c])]
+        df = df.melt(id_vars=[ts_column], value_vars=metrics, var_name='metric', value_name='value')
+        df = df.rename(columns={ts_column: 'ts'})
+        df['sensor_id'] = sensor_id
+
+    ts = df['ts']
+    if not pd.api.types.is_integer_dtype(ts):
+        if pd.api.types.is_numeric_dtype(ts):
+            ts = ts.astype('int64')
+        else:
+            # datetimes or strings, naive times are UTC like utils.to_epoch_ms
+            ts = pd.to_datetime(ts, utc=True).astype('datetime64[ms, UTC]').astype('int64')
+    return pd.DataFrame({
+        'sensor_id': df['sensor_id'].astype(str),
+        'metric': df['metric'].astype(str),
+        'ts': ts,
+        'value': df['value'].astype('float64'),
+    }).dropna(subset=['value'])
+
+
+def rollup_records(df, step_ms):
+    # rollups.aggregate() for a DataFrame chunk
+    buckets = df.assign(bucket=df['ts'] - df['ts'] % step_ms).groupby(['sensor_id', 'metric', 'bucket'], sort=False)
+    return buckets['value'].agg(['count', 'sum', 'min', 'max']).reset_index().to_dict('records')
+
+
+def insert_chunk(engine, df, rollups=True):
+    """
+    Insert a long chunk and merge it into the rollups in one transaction.
+
+    Returns:
+        tuple: (rows, seconds spent on rollups)
+    """
+    records = list(zip(df['sensor_id'].tolist(), df['metric'].tolist(), df['ts'].tolist(), df['value'].tolist()))
+    rollup_seconds = 0.0
+    with engine.begin() as conn:
+        conn.exec_driver_sql(INSERT_READINGS, records)
+        if rollups:
+            start = time.perf_counter()
+            for step_ms, model in RESOLUTIONS.values():
+                conn.execute(upsert_statement(model), rollup_records(df, step_ms))
+            rollup_seconds = time.perf_counter() - start
+    return len(records), rollup_seconds
+
+
+def load_chunks(engine, chunks, sensor_id=None, ts_column='ts', drop_indexes=False, rollups=True):
+    """
+    Insert DataFrame chunks into readings.
+
+    Args:
+        engine: writer engine
+        chunks: iterable of DataFrames, long or wide, see to_long()
+        sensor_id (str): sensor of wide chunks
+        ts_column (str): time column of wide chunks
+        drop_indexes (bool): drop the readings indexes during the load
+        rollups (bool): merge the loaded rows into the rollups
+
+    Returns:
+        dict: rows, seconds, rows_per_s and the seconds spent inserting, on indexes and on rollups
+    """
+    Base.metadata.create_all(engine)
+    start = time.perf_counter()
+    rows = 0
+    rollup_seconds = 0.0
+
+    with (indexes_dropped(engine) if drop_indexes else nullcontext()):
+        for chunk in chunks:
+            df = to_long(chunk, sensor_id=sensor_id, ts_column=ts_column)
+            if df.empty:
+                continue
+            inserted, seconds = insert_chunk(engine, df, rollups=rollups)
+            rows += inserted
+            rollup_seconds += seconds
+            logger.info(f'bulk: {rows} rows loaded')
+        loaded = time.perf_counter()
+    done = time.perf_counter()
+
+    seconds = done - start
+    report = {
+        "rows": rows,
+        "seconds": seconds,
+        "rows_per_s": rows / seconds if seconds > 0 else 0.0,
+        # rollups are merged per chunk, within the insert time
+        "insert_seconds": loaded - start,
+        "index_seconds": done - loaded,
+        "rollup_seconds": rollup_seconds,
+    }
+    logger.info(f'bulk: {report}')
+    return report
+
+
+def load_dataframe(engine, df, chunk_rows=50000, **kwargs):
+    """load_chunks() for one in-memory DataFrame, see load_chunks() for kwargs."""
+    kwargs.setdefault('drop_indexes', len(df) >= DROP_INDEXES_ROWS)
+    chunks = (df.iloc[i:i + chunk_rows] for i in range(0, len(df), chunk_rows))
+    return load_chunks(engine, chunks, **kwargs)
+
+
+def load_csv(engine, path, chunk_rows=50000, **kwargs):
+    """load_chunks() streaming a CSV file, see load_chunks() for kwargs."""
+    return load_chunks(engine, pd.read_csv(path, chunksize=chunk_rows), **kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk load CSV history into the readings table')
+    parser.add_argument('csv', nargs='+', help='CSV files, long (sensor_id,metric,ts,value) or wide with --sensor-id')
+    parser.add_argument('--db', type=str, default=str(path_db), help=f'SQLite database (default: {path_db})')
+    parser.add_argument('--sensor-id', type=str, help='Sensor of wide CSVs, metrics are the numeric columns')
+    parser.add_argument('--ts-column', type=str, default='ts', help='Time column of wide CSVs (default: ts)')
+    parser.add_argument('--chunk', type=int, default=50000, help='Rows per transaction (default: 50000)')
+    indexes = parser.add_mutually_exclusive_group()
+    indexes.add_argument('--drop-indexes', dest='drop_indexes', action='store_true', default=None,
+                         help='Drop and rebuild the readings indexes (default: for CSVs over 64 MiB)')
+    indexes.add_argument('--keep-indexes', dest='drop_indexes', action='store_false', help='Keep the indexes during the load')
+    parser.add_argument('--no-rollups', action='store_true', help='Do not merge the loaded rows into the rollups')
+    args = parser.parse_args()
+
+    engine = create_sqlite_engine(args.db, load_profile())
+    for path in args.csv:
+        drop_indexes = args.drop_indexes
+        if drop_indexes is None:
+            drop_indexes = os.path.getsize(path) >= DROP_INDEXES_BYTES
+        report = load_csv(
+            engine, path, chunk_rows=args.chunk, sensor_id=args.sensor_id, ts_column=args.ts_column,
+            drop_indexes=drop_indexes, rollups=not args.no_rollups,
+        )
+        print(
+            f"{path}: {report['rows']} rows in {report['seconds']:.2f}s ({report['rows_per_s']:.0f} rows/s), "
+            f"indexes {report['index_seconds']:.2f}s, rollups {report['rollup_seconds']:.2f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import os
+from pathlib import Path
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from utils import base_dir, load_yaml
+
+# https://docs.sqlalchemy.org/en/20/core/engines.html
+# https://docs.sqlalchemy.org/en/20/dialects/sqlite.html#serializable-isolation-savepoints-transactional-ddl
+# https://www.sqlite.org/wal.html
+
+path_db = Path(*[base_dir, 'data', 'sensordata.db'])
+path_config_datastore = Path(*[base_dir, 'config', 'datastore.yaml'])
+
+# pragmas applied to every new connection
+PROFILES = {
+    # pysqlite defaults: rollback journal, synchronous=FULL, 5s lock timeout
+    'default': {},
+    # the Flask server, RQ workers and loaders all open the same file. WAL lets
+    # readers run while one writer commits, synchronous=NORMAL only fsyncs on
+    # checkpoint (safe in WAL mode, may lose the last commits on power loss)
+    'production': {
+        # must come before journal_mode, only applies to a new database
+        'auto_vacuum': 'INCREMENTAL',
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 10000, # ms to wait for a lock before "database is locked"
+        'cache_size': -16384, # negative is KiB, 16 MiB page cache per connection
+        'mmap_size': 128 * 1024 * 1024, # read pages through mmap instead of read()
+        'temp_store': 'MEMORY',
+        'journal_size_limit': 64 * 1024 * 1024, # truncate the WAL after checkpoints
+        'wal_autocheckpoint': 1000,
+    },
+}
+
+
+def load_datastore_config(path_config=path_config_datastore):
+    """The datastore section of config/datastore.yaml, empty if there is none."""
+    try:
+        return load_yaml(path_config)['datastore'] or {}
+    except (FileNotFoundError, KeyError, TypeError):
+        return {}
+
+
+def load_profile(path_config=path_config_datastore):
+    return load_datastore_config(path_config).get('engine_profile', 'production')
+
+
+def apply_pragmas(dbapi_connection, pragmas):
+    cursor = dbapi_connection.cursor()
+    for name, value in pragmas.items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+    cursor.close()
+
+
+def create_sqlite_engine(path, profile='production', readonly=False, pool_size=4):
+    """
+    Create an engine for a SQLite file tuned by one of PROFILES.
+
+    Writers get a single pooled connection per process and take the write lock
+    up front with BEGIN IMMEDIATE, so two writers never deadlock upgrading a
+    read lock and SQLite's busy_timeout handles the wait. Readers get a pool
+    of query_only connections that never block on the writer in WAL mode.
+
+    Args:
+        path: database file
+        profile (str): key of PROFILES
+        readonly (bool): create a reader engine instead of the writer engine
+        pool_size (int): connections kept by a reader engine
+
+    Returns:
+        Engine
+    """
+    pragmas = dict(PROFILES[profile])
+    if readonly:
+        pragmas['query_only'] = 1
+
+    engine = create_engine(
+        f'sqlite:///{path}',
+        poolclass=QueuePool,
+        pool_size=pool_size if readonly else 1,
+        max_overflow=pool_size if readonly else 0,
+        pool_timeout=30,
+    )
+
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        apply_pragmas(dbapi_connection, pragmas)
+        if profile != 'default' and not readonly:
+            # let SQLAlchemy emit BEGIN itself, see on_begin
+            dbapi_connection.isolation_level = None
+
+    if profile != 'default' and not readonly:
+        @event.listens_for(engine, 'begin')
+        def on_begin(conn):
+            if conn.get_execution_options().get('isolation_level') == 'AUTOCOMMIT':
+                return
+            conn.exec_driver_sql('BEGIN IMMEDIATE')
+
+    return engine
+
+
+def dispose_after_fork():
+    # RQ runs every job in a forked work horse. connections inherited from the
+    # parent must not be used by the child, start with empty pools instead
+    engine.dispose(close=False)
+    read_engine.dispose(close=False)
+
+
+profile = load_profile()
+engine = create_sqlite_engine(path_db, profile)
+read_engine = create_sqlite_engine(path_db, profile, readonly=True)
+Session = sessionmaker(bind=engine)
+
+os.register_at_fork(after_in_child=dispose_after_fork)
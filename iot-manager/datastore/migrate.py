@@ -0,0 +1,154 @@
+# Convert the legacy sensor_reading table (JSON in raw_data) into the typed
+# readings table. Rows are streamed in chunks keyed on the primary key so
+# memory use does not depend on the size of the database, and every chunk is
+# written in its own transaction together with the last id it copied (the
+# meta table), so running it again, e.g. after an interruption, continues
+# where it stopped instead of copying every reading twice. --resume-from
+# overrides the stored id.
+#
+# --incremental-vacuum converts a database created without auto_vacuum, so
+# datastore/retention.py can release free pages in small steps. It is a full
+# VACUUM: it rewrites the file and holds the write lock throughout, stop the
+# workers first.
+#
+# cd iot-manager
+# python -m datastore.migrate --db data/sensordata.db
+# python -m datastore.migrate --db data/sensordata.db --incremental-vacuum
+
+import argparse
+import json
+import time
+
+from sqlalchemy import create_engine, select, inspect, text
+
+from datastore import Base, Meta, SensorReading, Reading, path_db, to_reading_rows, update_rollups
+from datastore.retention import AUTO_VACUUM_INCREMENTAL
+from utils import logger
+
+
+def convert(row):
+    try:
+        raw_data = json.loads(row.raw_data) if row.raw_data else {}
+    except json.JSONDecodeError:
+        logger.warning(f'migrate: skipping sensor_reading {row.id}, raw_data is not JSON')
+        return []
+
+    ts = None
+    if not (isinstance(raw_data, dict) and 'ts' in raw_data):
+        ts = row.created_at
+    return to_reading_rows(row.sensor_type or 'unknown', raw_data, ts=ts)
+
+
+META_LAST_ID = 'migrate.sensor_reading.last_id'
+
+
+def stored_last_id(conn):
+    value = conn.execute(select(Meta.value).where(Meta.key == META_LAST_ID)).scalar()
+    return int(value) if value is not None else 0
+
+
+def store_last_id(conn, last_id):
+    table = Meta.__table__
+    if conn.execute(table.update().where(table.c.key == META_LAST_ID).values(value=str(last_id))).rowcount == 0:
+        conn.execute(table.insert().values(key=META_LAST_ID, value=str(last_id)))
+
+
+def migrate(engine, chunk_size=5000, resume_from=None, drop_legacy=False):
+    """
+    Copy every sensor_reading row with id > resume_from into readings.
+
+    Args:
+        resume_from (int): defaults to the last id a previous run copied
+
+    Returns:
+        dict: rows read, readings written, last id migrated and elapsed seconds
+    """
+    Base.metadata.create_all(engine)
+    if not inspect(engine).has_table(SensorReading.__tablename__):
+        logger.info('migrate: no sensor_reading table, nothing to do')
+        return {"rows": 0, "readings": 0, "last_id": resume_from or 0, "seconds": 0.0}
+
+    legacy = SensorReading.__table__
+    if resume_from is None:
+        with engine.connect() as conn:
+            resume_from = stored_last_id(conn)
+    last_id = resume_from
+    rows_read = 0
+    readings_written = 0
+    start = time.perf_counter()
+
+    while True:
+        stmt = (
+            select(legacy.c.id, legacy.c.sensor_type, legacy.c.raw_data, legacy.c.created_at)
+            .where(legacy.c.id > last_id)
+            .order_by(legacy.c.id)
+            .limit(chunk_size)
+        )
+        with engine.begin() as conn:
+            chunk = conn.execute(stmt).all()
+            if not chunk:
+                break
+
+            rows = []
+            for row in chunk:
+                rows.extend(convert(row))
+            if rows:
+                conn.execute(Reading.__table__.insert(), rows)
+                update_rollups(conn, rows)
+            store_last_id(conn, chunk[-1].id)
+
+        last_id = chunk[-1].id
+        rows_read += len(chunk)
+        readings_written += len(rows)
+        logger.info(f'migrate: {rows_read} rows migrated, last id {last_id}')
+        print(f'migrated {rows_read} rows ({readings_written} readings), last id {last_id}')
+
+    if drop_legacy:
+        legacy.drop(engine)
+        with engine.connect() as conn:
+            conn.execute(text('VACUUM'))
+
+    return {
+        "rows": rows_read,
+        "readings": readings_written,
+        "last_id": last_id,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def enable_incremental_vacuum(engine):
+    """
+    Switch the database to auto_vacuum=INCREMENTAL, with a full VACUUM if it
+    is not already.
+
+    Returns:
+        bool: True if the database was converted
+    """
+    # VACUUM cannot run inside a transaction
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        if conn.execute(text('PRAGMA auto_vacuum')).scalar() == AUTO_VACUUM_INCREMENTAL:
+            return False
+        logger.warning('migrate: converting database to auto_vacuum=INCREMENTAL with a full VACUUM')
+        conn.execute(text('PRAGMA auto_vacuum = INCREMENTAL'))
+        conn.execute(text('VACUUM'))
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Migrate sensor_reading JSON rows into the typed readings table')
+    parser.add_argument('--db', type=str, default=str(path_db), help=f'SQLite database (default: {path_db})')
+    parser.add_argument('--chunk', type=int, default=5000, help='Rows per transaction (default: 5000)')
+    parser.add_argument('--resume-from', type=int, help='Only migrate sensor_reading ids above this one (default: the last id migrated)')
+    parser.add_argument('--drop-legacy', action='store_true', help='Drop sensor_reading and VACUUM when done')
+    parser.add_argument('--incremental-vacuum', action='store_true', help='Convert to auto_vacuum=INCREMENTAL when done, a full VACUUM')
+    args = parser.parse_args()
+
+    engine = create_engine(f'sqlite:///{args.db}')
+    report = migrate(engine, chunk_size=args.chunk, resume_from=args.resume_from, drop_legacy=args.drop_legacy)
+    print(f"migrated {report['rows']} rows into {report['readings']} readings in {report['seconds']:.2f}s")
+    if args.incremental_vacuum:
+        print('converted to auto_vacuum=INCREMENTAL' if enable_incremental_vacuum(engine) else 'already auto_vacuum=INCREMENTAL')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+from sqlalchemy import Column, Integer, String, DateTime, Sequence, Float, Index
+from sqlalchemy.orm import declarative_base
+from sqlalchemy.sql import func
+
+Base = declarative_base()
+
+# legacy schema: one row per reading with the values as a JSON string.
+# new readings go to Reading, see datastore/migrate.py to convert old rows
+class SensorReading(Base):
+    __tablename__ = "sensor_reading"
+    # Base.metadata,
+    id = Column(Integer, Sequence('sensor_reading_seq'), primary_key=True)
+    sensor_type = Column(String)
+    raw_data = Column(String) # JSON
+    created_at = Column(DateTime, default=func.now())
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+    def __init__(self, sensor_type, raw_data):
+        self.sensor_type = sensor_type
+        self.raw_data = raw_data
+
+
+class Reading(Base):
+    # one numeric value per row, e.g. sensor_id=soil_temp metric=temp_c
+    __tablename__ = "readings"
+    id = Column(Integer, primary_key=True)
+    sensor_id = Column(String, nullable=False)
+    metric = Column(String, nullable=False)
+    ts = Column(Integer, nullable=False) # epoch milliseconds, UTC
+    value = Column(Float, nullable=False)
+
+    __table_args__ = (
+        # range queries: WHERE sensor_id = ? AND metric = ? AND ts BETWEEN ? AND ?
+        Index('ix_readings_sensor_metric_ts', 'sensor_id', 'metric', 'ts'),
+        # retention and archiving scan by time only
+        Index('ix_readings_ts', 'ts'),
+    )
+
+
+class Photo(Base):
+    # one row per captured image, written by datastore.photos once the
+    # thumbnail and preview exist
+    __tablename__ = "photos"
+    # Base.metadata,
+    id = Column(Integer, Sequence('photo_seq'), primary_key=True)
+    filepath = Column(String)
+    resolution = Column(String)
+    zone = Column(String)
+    device_path = Column(String)
+    ts = Column(Integer) # capture time, epoch milliseconds, UTC
+    size_bytes = Column(Integer)
+    sha256 = Column(String) # content hash, names the file in the photo store
+    thumbnail_path = Column(String)
+    preview_path = Column(String)
+    dhash = Column(String) # 64 bit difference hash as 16 hex digits
+    duplicate_of = Column(Integer) # id of a near identical earlier photo of the same camera
+    created_at = Column(DateTime, default=func.now())
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        # listing: WHERE device_path = ? AND ts BETWEEN ? AND ? ORDER BY ts
+        Index('ix_photos_device_ts', 'device_path', 'ts'),
+        # nearest photo of a zone to a time: one seek each side of ts
+        Index('ix_photos_zone_ts', 'zone', 'ts'),
+        Index('ix_photos_ts', 'ts'),
+        # identical frames are stored once, also with concurrent writers
+        Index('ix_photos_sha256', 'sha256', unique=True),
+        Index('ix_photos_filepath', 'filepath'),
+    )
+
+    def __init__(self, filepath, resolution=None, zone=None, device_path=None, **kwargs):
+        super().__init__(filepath=filepath, resolution=resolution, zone=zone, device_path=device_path, **kwargs)
+
+
+class PlantShape(Base):
+    # the plant found in a photo by copilot/vision/batch.py, in pixels of
+    # the full resolution photo, one row per photo
+    __tablename__ = "plant_shapes"
+    id = Column(Integer, primary_key=True)
+    photo_id = Column(Integer) # Photo.id if the photo is in the photo store
+    filepath = Column(String, nullable=False)
+    zone = Column(String)
+    device_path = Column(String)
+    ts = Column(Integer) # capture time, epoch milliseconds, UTC
+    area = Column(Float) # 0 if no plant was found
+    perimeter = Column(Float)
+    x = Column(Integer)
+    y = Column(Integer)
+    width = Column(Integer)
+    height = Column(Integer)
+    aspect_ratio = Column(Float)
+    roi = Column(String) # x,y,w,h analysed, full resolution pixels
+    working_width = Column(Integer) # width the photo was segmented at
+    created_at = Column(DateTime, default=func.now())
+
+    __table_args__ = (
+        # growth of a zone: WHERE zone = ? AND ts BETWEEN ? AND ?
+        Index('ix_plant_shapes_zone_ts', 'zone', 'ts'),
+        # one row per photo, re-analysing replaces it
+        Index('ix_plant_shapes_filepath', 'filepath', unique=True),
+    )
+
+
+class Meta(Base):
+    # datastore bookkeeping as key/value pairs, e.g. the last sensor_reading
+    # id copied by datastore/migrate.py
+    __tablename__ = "meta"
+    key = Column(String, primary_key=True)
+    value = Column(String)
+
+
+class RollupMixin:
+    # min/max/sum/count of Reading.value per sensor metric and time bucket,
+    # kept up to date by datastore.rollups.update_rollups()
+    sensor_id = Column(String, primary_key=True)
+    metric = Column(String, primary_key=True)
+    bucket = Column(Integer, primary_key=True) # epoch milliseconds at the start of the bucket
+    count = Column(Integer, nullable=False)
+    sum = Column(Float, nullable=False)
+    min = Column(Float, nullable=False)
+    max = Column(Float, nullable=False)
+
+    # the primary key is the range index, no need for a separate rowid b-tree
+    __table_args__ = {'sqlite_with_rowid': False}
+
+
+class Rollup1m(RollupMixin, Base):
+    __tablename__ = "rollup_1m"
+
+
+class Rollup1h(RollupMixin, Base):
+    __tablename__ = "rollup_1h"
+
+
+class Rollup1d(RollupMixin, Base):
+    __tablename__ = "rollup_1d"
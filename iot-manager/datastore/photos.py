@@ -0,0 +1,389 @@
+# Photo store and post-capture processing.
+#
+# PhotoStore keeps every photo once, named by the SHA-256 of its bytes, in a
+# directory per UTC day and camera, so no directory grows past a day of one
+# camera's frames and storing a frame that is already there is a no-op. The
+# photos table is the index: camera, zone, ts, hash and size, with (zone, ts)
+# and (device_path, ts) indexes so the nearest photo to a time is two B-tree
+# seeks.
+#
+# After storing, a process pool makes a thumbnail and a preview for listings
+# and a difference hash to spot near identical frames. Decoding a 5 MP JPEG
+# and resizing it is CPU bound and would hold the GIL. JPEGs are decoded at a
+# reduced scale (libjpeg scales by 1/2, 1/4 or 1/8 while decoding) just big
+# enough for the largest derived size, which is several times cheaper than a
+# full decode. Rows are written by the parent process, the only SQLite writer.
+# https://docs.opencv.org/4.x/d8/d6a/group__imgcodecs__flags.html
+#
+# photo_id, path, stored = photo_store().put(jpeg_bytes, device_path='/dev/video1', zone='1')
+# pipeline = PhotoPipeline().start()
+# pipeline.submit(path)
+# photo_store().nearest('2025-04-06:12:00:00.000000Z', zone='1')
+#
+# import existing files (e.g. the old flat photos/ directory) into the store:
+# cd iot-manager
+# python -m datastore.photos photos/*.jpg
+
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from sqlalchemy import inspect, select
+from sqlalchemy.exc import IntegrityError
+
+from datastore import Base, Photo, db
+from jpeg import jpeg_size, reduced_flag
+from utils import base_dir, logger, to_epoch_ms
+
+path_store = Path(*[base_dir, 'photos', 'store'])
+
+# name -> longest side in pixels
+SIZES = {
+    'thumbnail': 320,
+    'preview': 1280,
+}
+JPEG_QUALITY = 85
+# dhashes at most this many bits apart are the same picture
+DUPLICATE_DISTANCE = 4
+
+
+def dhash(image):
+    """64 bit difference hash of a BGR or gray image, as 16 hex digits."""
+    import cv2
+    import numpy as np
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(image, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return f'{int(np.packbits(bits).view(">u8")[0]):016x}'
+
+
+def hamming(a, b):
+    return bin(int(a, 16) ^ int(b, 16)).count('1')
+
+
+def derived_path(filepath, name, root=None):
+    # next to the original unless root is given
+    return Path(root or Path(filepath).parent) / f'{Path(filepath).stem}_{name}.jpg'
+
+
+def process_photo(filepath, root=None, sizes=SIZES):
+    """
+    Write the derived sizes of one JPEG and hash it, runs in the pool.
+
+    Returns:
+        dict: resolution, size_bytes, dhash and <name>_path per size
+    """
+    import cv2
+    size = jpeg_size(filepath)
+    longest = max(sizes.values())
+    flag = reduced_flag(max(size), longest) if size else cv2.IMREAD_COLOR
+    image = cv2.imread(str(filepath), flag)
+    if image is None:
+        raise IOError(f'cannot decode {filepath}')
+    height, width = image.shape[:2]
+    if size is None:
+        size = (width, height)
+
+    result = {
+        "resolution": f'{size[0]}x{size[1]}',
+        "size_bytes": os.path.getsize(filepath),
+    }
+    if root is not None:
+        Path(root).mkdir(parents=True, exist_ok=True)
+    # largest first, each size is resized from the previous one
+    current = image
+    for name, side in sorted(sizes.items(), key=lambda item: -item[1]):
+        scale = side / max(current.shape[:2])
+        if scale < 1:
+            current = cv2.resize(current, (round(current.shape[1] * scale), round(current.shape[0] * scale)), interpolation=cv2.INTER_AREA)
+        path = derived_path(filepath, name, root)
+        cv2.imwrite(str(path), current, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        result[f'{name}_path'] = str(path)
+    result['dhash'] = dhash(current)
+    return result
+
+
+def setup(engine=None):
+    """Create the photos table, adding the columns and indexes older versions lack."""
+    engine = engine or db.engine
+    table = Photo.__table__
+    Base.metadata.create_all(engine, tables=[table])
+    inspector = inspect(engine)
+    existing = {c['name'] for c in inspector.get_columns(table.name)}
+    unique = {i['name']: bool(i['unique']) for i in inspector.get_indexes(table.name)}
+    with engine.begin() as conn:
+        for column in table.columns:
+            if column.name not in existing:
+                # every column added since the first version is nullable
+                conn.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(engine.dialect)}')
+        for index in table.indexes:
+            if index.name in unique and index.unique and not unique[index.name]:
+                # made unique since, e.g. ix_photos_sha256. Rows written by
+                # concurrent put() before that keep the hash on the oldest one
+                index.drop(conn)
+                if index.name == 'ix_photos_sha256':
+                    conn.exec_driver_sql(
+                        f'UPDATE {table.name} SET sha256 = NULL WHERE sha256 IS NOT NULL AND id NOT IN '
+                        f'(SELECT MIN(id) FROM {table.name} WHERE sha256 IS NOT NULL GROUP BY sha256)'
+                    )
+            index.create(conn, checkfirst=True)
+
+
+def record_photo(engine, filepath, result, device_path=None, zone=None, ts=None):
+    """
+    Complete the Photo row of filepath, e.g. written by PhotoStore.put(), with
+    the process_photo() result, or insert one. The photo is marked a duplicate
+    of the camera's previous photo if their hashes match.
+    """
+    table = Photo.__table__
+    with engine.begin() as conn:
+        row = conn.execute(select(Photo.id, Photo.device_path, Photo.ts).where(Photo.filepath == str(filepath)).limit(1)).first()
+        if row is not None:
+            device_path, ts = row.device_path, row.ts
+        else:
+            ts = to_epoch_ms(ts)
+        previous = conn.execute(
+            select(Photo.id, Photo.dhash, Photo.duplicate_of)
+            .where(Photo.device_path == device_path).where(Photo.ts <= ts).where(Photo.dhash.is_not(None))
+            .where(Photo.id != (row.id if row is not None else -1))
+            .order_by(Photo.ts.desc()).limit(1)
+        ).first()
+        duplicate_of = None
+        if previous is not None and hamming(previous.dhash, result['dhash']) <= DUPLICATE_DISTANCE:
+            duplicate_of = previous.duplicate_of or previous.id
+        values = {
+            "resolution": result['resolution'], "size_bytes": result['size_bytes'],
+            "thumbnail_path": result.get('thumbnail_path'), "preview_path": result.get('preview_path'),
+            "dhash": result['dhash'], "duplicate_of": duplicate_of,
+        }
+        if row is not None:
+            conn.execute(table.update().where(table.c.id == row.id).values(**values))
+            return row.id
+        return conn.execute(table.insert().values(
+            filepath=str(filepath), device_path=device_path, zone=zone, ts=ts, **values,
+        )).inserted_primary_key[0]
+
+
+def camera_name(device_path):
+    # '/dev/video1' -> 'video1'
+    return Path(device_path).name if device_path else 'unknown'
+
+
+class PhotoStore:
+    """
+    Content addressed photo files, one directory per UTC day and camera:
+
+        photos/store/2025-04-06/video1/<sha256>.jpg
+
+    indexed by the photos table.
+
+    Args:
+        root: store directory
+        engine: writer engine, defaults to datastore.engine
+    """
+    def __init__(self, root=path_store, engine=None):
+        self.root = Path(root)
+        self.engine = engine or db.engine
+        setup(self.engine)
+
+    def path_for(self, sha256, device_path, ts_ms):
+        day = datetime.fromtimestamp(ts_ms / 1000, timezone.utc).strftime('%Y-%m-%d')
+        return self.root / day / camera_name(device_path) / f'{sha256}.jpg'
+
+    def put(self, data, device_path=None, zone=None, ts=None, resolution=None):
+        """
+        Store JPEG bytes and add their Photo row, unless the same bytes are
+        stored already.
+
+        Returns:
+            tuple: (photo id, file path, True if written, False if it was a duplicate)
+        """
+        sha256 = hashlib.sha256(data).hexdigest()
+        with self.engine.connect() as conn:
+            existing = conn.execute(select(Photo.id, Photo.filepath).where(Photo.sha256 == sha256).limit(1)).first()
+        if existing is not None:
+            return existing.id, existing.filepath, False
+
+        ts = to_epoch_ms(ts)
+        path = self.path_for(sha256, device_path, ts)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix='.photo-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        try:
+            with self.engine.begin() as conn:
+                photo_id = conn.execute(Photo.__table__.insert().values(
+                    filepath=str(path), device_path=device_path, zone=zone, ts=ts,
+                    resolution=resolution, size_bytes=len(data), sha256=sha256,
+                )).inserted_primary_key[0]
+        except IntegrityError:
+            # another writer stored the same bytes between our check and insert
+            existing = self.get(sha256)
+            if existing is None:
+                raise
+            if existing.filepath != str(path):
+                path.unlink(missing_ok=True)
+            return existing.id, existing.filepath, False
+        return photo_id, str(path), True
+
+    def get(self, sha256):
+        with self.engine.connect() as conn:
+            return conn.execute(select(Photo).where(Photo.sha256 == sha256).limit(1)).first()
+
+    def nearest(self, ts, zone=None, device_path=None):
+        """
+        The photo of a zone (or camera) taken closest to ts, None if there is
+        none. Two index seeks, one on each side of ts.
+        """
+        ts = to_epoch_ms(ts)
+        stmt = select(Photo.id, Photo.ts, Photo.filepath, Photo.device_path, Photo.zone, Photo.thumbnail_path, Photo.preview_path)
+        if zone is not None:
+            stmt = stmt.where(Photo.zone == str(zone))
+        if device_path is not None:
+            stmt = stmt.where(Photo.device_path == device_path)
+        with self.engine.connect() as conn:
+            before = conn.execute(stmt.where(Photo.ts <= ts).order_by(Photo.ts.desc()).limit(1)).first()
+            after = conn.execute(stmt.where(Photo.ts > ts).order_by(Photo.ts).limit(1)).first()
+        candidates = [row for row in (before, after) if row is not None]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda row: abs(row.ts - ts))
+
+
+_store = None
+
+
+def photo_store():
+    """The process wide PhotoStore."""
+    global _store
+    if _store is None:
+        _store = PhotoStore()
+    return _store
+
+
+class PhotoPipeline:
+    """
+    Process photos in a pool and record them.
+
+    Args:
+        engine: writer engine, defaults to datastore.engine
+        workers (int): pool processes, defaults to the CPU count
+        root: directory of the derived images, defaults to next to each photo
+        sizes (dict): name -> longest side, see SIZES
+    """
+    def __init__(self, engine=None, workers=None, root=None, sizes=SIZES):
+        self.engine = engine or db.engine
+        self.workers = workers
+        self.root = root
+        self.sizes = sizes
+        self.pool = None
+        self.processed = 0
+        self.errors = 0
+
+    def start(self):
+        setup(self.engine)
+        self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self
+
+    def submit(self, filepath, device_path=None, zone=None, ts=None):
+        """
+        Queue a photo, returns the Future of its process_photo() result. The
+        row is written from the pool's result thread when it completes.
+        """
+        ts = to_epoch_ms(ts)
+        future = self.pool.submit(process_photo, str(filepath), self.root, self.sizes)
+
+        def done(f):
+            try:
+                self.record(filepath, f.result(), device_path, zone, ts)
+            except Exception as e:
+                self.errors += 1
+                logger.error(f'PhotoPipeline {filepath} failed: {e}')
+        future.add_done_callback(done)
+        return future
+
+    def record(self, filepath, result, device_path=None, zone=None, ts=None):
+        photo_id = record_photo(self.engine, filepath, result, device_path, zone, ts)
+        self.processed += 1
+        return photo_id
+
+    def close(self):
+        """Wait for queued photos and stop the pool."""
+        if self.pool is not None:
+            self.pool.shutdown(wait=True)
+            self.pool = None
+
+
+def ingest_photo(filepath, device_path=None, zone=None, ts=None, engine=None, root=None):
+    """Process and record one photo in this process, e.g. from an RQ job."""
+    engine = engine or db.engine
+    setup(engine)
+    with engine.connect() as conn:
+        done = conn.execute(select(Photo.id).where(Photo.filepath == str(filepath)).where(Photo.dhash.is_not(None))).first()
+    if done is not None:
+        # a frame the store already had, processed when it was first stored
+        return done.id
+    return record_photo(engine, filepath, process_photo(filepath, root), device_path, zone, ts)
+
+
+def list_photos(device_path=None, start=None, end=None, limit=100, duplicates=False, bind=None):
+    """
+    Photo rows newest first for listings, only reading indexed columns.
+
+    Returns:
+        list: Photo rows (id, ts, device_path, zone, resolution, filepath, thumbnail_path, preview_path)
+    """
+    stmt = select(
+        Photo.id, Photo.ts, Photo.device_path, Photo.zone, Photo.resolution,
+        Photo.filepath, Photo.thumbnail_path, Photo.preview_path,
+    )
+    if device_path is not None:
+        stmt = stmt.where(Photo.device_path == device_path)
+    if start is not None:
+        stmt = stmt.where(Photo.ts >= to_epoch_ms(start))
+    if end is not None:
+        stmt = stmt.where(Photo.ts <= to_epoch_ms(end))
+    if not duplicates:
+        stmt = stmt.where(Photo.duplicate_of.is_(None))
+    with (bind or db.read_engine).connect() as conn:
+        return conn.execute(stmt.order_by(Photo.ts.desc()).limit(limit)).all()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import photos into the photo store with thumbnails, previews and Photo rows')
+    parser.add_argument('photos', nargs='+', help='JPEG files, left in place')
+    parser.add_argument('--device-path', type=str, help='Camera that took the photos')
+    parser.add_argument('--zone', type=str, help='Zone of the camera')
+    parser.add_argument('--workers', type=int, help='Pool processes (default: CPU count)')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    store = photo_store()
+    pipeline = PhotoPipeline(workers=args.workers).start()
+    skipped = 0
+    for path in args.photos:
+        # file modification time stands in for the capture time
+        with open(path, 'rb') as f:
+            _, stored_path, stored = store.put(f.read(), device_path=args.device_path, zone=args.zone, ts=int(os.path.getmtime(path) * 1000))
+        if stored:
+            pipeline.submit(stored_path)
+        else:
+            skipped += 1
+    pipeline.close()
+    seconds = time.perf_counter() - start
+    print(f'{pipeline.processed} photos in {seconds:.2f}s ({pipeline.processed / seconds:.1f}/s), {skipped} already stored, {pipeline.errors} errors')
+
+
+if __name__ == "__main__":
+    main()
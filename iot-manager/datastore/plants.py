@@ -0,0 +1,99 @@
+# Plant shape per photo, written by the batch segmentation engine in
+# copilot/vision/batch.py: area, perimeter, bounding box and aspect ratio of
+# the largest green contour, in pixels of the full resolution photo.
+#
+# Rows are keyed by filepath, analysing a photo again replaces its row.
+# Photos of the photo store are linked to their Photo row and take its
+# capture time, zone and camera.
+#
+# record_shapes([{"filepath": path, "area": 5120.0, ...}])
+# query_shapes(zone='1', start='2025-04-01:00:00:00.000000Z')
+
+from sqlalchemy import select
+
+from datastore import Base, Photo, PlantShape, db
+from utils import to_epoch_ms
+
+# SQLite allows 999 parameters per statement in older builds
+CHUNK = 500
+
+COLUMNS = ('area', 'perimeter', 'x', 'y', 'width', 'height', 'aspect_ratio', 'roi', 'working_width')
+
+
+def setup(engine=None):
+    Base.metadata.create_all(engine or db.engine, tables=[PlantShape.__table__])
+
+
+def chunks(items, size=CHUNK):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def analysed(filepaths, bind=None):
+    """The filepaths that already have a row."""
+    found = set()
+    with (bind or db.read_engine).connect() as conn:
+        for chunk in chunks([str(f) for f in filepaths]):
+            found.update(conn.execute(select(PlantShape.filepath).where(PlantShape.filepath.in_(chunk))).scalars())
+    return found
+
+
+def record_shapes(results, engine=None):
+    """
+    Write the shapes of a batch of photos in one transaction.
+
+    Args:
+        results (list): dicts with filepath, the COLUMNS and optionally ts,
+            zone and device_path, used for photos without a Photo row
+
+    Returns:
+        int: rows written
+    """
+    if not results:
+        return 0
+    engine = engine or db.engine
+    table = PlantShape.__table__
+    rows = []
+    with engine.begin() as conn:
+        filepaths = [str(r['filepath']) for r in results]
+        photos = {}
+        for chunk in chunks(filepaths):
+            for photo in conn.execute(
+                select(Photo.id, Photo.filepath, Photo.ts, Photo.zone, Photo.device_path).where(Photo.filepath.in_(chunk))
+            ):
+                photos[photo.filepath] = photo
+            conn.execute(table.delete().where(table.c.filepath.in_(chunk)))
+
+        for filepath, result in zip(filepaths, results):
+            row = {column: result.get(column) for column in COLUMNS}
+            photo = photos.get(filepath)
+            if photo is not None:
+                row.update(photo_id=photo.id, ts=photo.ts, zone=photo.zone, device_path=photo.device_path)
+            else:
+                ts = result.get('ts')
+                row.update(
+                    photo_id=None, ts=to_epoch_ms(ts) if ts is not None else None,
+                    zone=result.get('zone'), device_path=result.get('device_path'),
+                )
+            row['filepath'] = filepath
+            rows.append(row)
+        conn.execute(table.insert(), rows)
+    return len(rows)
+
+
+def query_shapes(zone=None, start=None, end=None, bind=None):
+    """
+    Shapes oldest first, e.g. to plot a zone's growth.
+
+    Returns:
+        list: PlantShape rows
+    """
+    stmt = select(PlantShape)
+    if zone is not None:
+        stmt = stmt.where(PlantShape.zone == str(zone))
+    if start is not None:
+        stmt = stmt.where(PlantShape.ts >= to_epoch_ms(start))
+    if end is not None:
+        stmt = stmt.where(PlantShape.ts <= to_epoch_ms(end))
+    with (bind or db.read_engine).connect() as conn:
+        return conn.execute(stmt.order_by(PlantShape.ts)).all()
@@ -0,0 +1,154 @@
+# Retention and compaction for sensordata.db.
+#
+# Old rows are deleted in small batches, one transaction each, so the worker
+# never holds the write lock for long. Freed pages are then handed back to
+# the filesystem with PRAGMA incremental_vacuum, also in bounded steps,
+# instead of a full VACUUM that rewrites the whole file on the SD card.
+# Databases created before the production profile set auto_vacuum are
+# converted once, explicitly, see datastore/migrate.py --incremental-vacuum.
+# Until then free pages are only reused, not released.
+# https://www.sqlite.org/pragma.html#pragma_incremental_vacuum
+
+import time
+
+from sqlalchemy import text
+
+from datastore import db
+from datastore.db import load_datastore_config, path_config_datastore
+from datastore.models import Reading, Rollup1m, Rollup1h, Rollup1d
+from utils import logger, to_epoch_ms
+
+# table -> statement deleting one batch of rows older than :cutoff
+RETAINED_TABLES = {
+    Reading.__tablename__: (
+        'DELETE FROM readings WHERE id IN '
+        '(SELECT id FROM readings WHERE ts < :cutoff LIMIT :batch)'
+    ),
+}
+for _model in (Rollup1m, Rollup1h, Rollup1d):
+    # rollup tables are WITHOUT ROWID, match on the primary key row value
+    RETAINED_TABLES[_model.__tablename__] = (
+        f'DELETE FROM {_model.__tablename__} WHERE (sensor_id, metric, bucket) IN '
+        f'(SELECT sensor_id, metric, bucket FROM {_model.__tablename__} WHERE bucket < :cutoff LIMIT :batch)'
+    )
+
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+def duration_ms(duration):
+    # {d, h, m, s} as used in protocols.yaml, None means keep forever
+    if duration is None:
+        return None
+    seconds = (
+        duration.get('d', 0) * 24 * 60 * 60
+        + duration.get('h', 0) * 60 * 60
+        + duration.get('m', 0) * 60
+        + duration.get('s', 0)
+    )
+    return int(seconds * 1000)
+
+
+def load_policy(path_config=path_config_datastore):
+    """
+    Read the retention section of config/datastore.yaml.
+
+    Returns:
+        dict: with 'retention' (table -> max age in ms or None), 'archive',
+            'batch_size' and 'vacuum_pages'
+    """
+    config = load_datastore_config(path_config)
+    retention = config.get('retention') or {}
+    return {
+        "retention": {table: duration_ms(retention.get(table)) for table in RETAINED_TABLES},
+        "archive": config.get('archive', False),
+        "batch_size": config.get('retention_batch_size', 5000),
+        "vacuum_pages": config.get('vacuum_pages', 1000),
+    }
+
+
+def database_size(conn):
+    page_size = conn.execute(text('PRAGMA page_size')).scalar()
+    page_count = conn.execute(text('PRAGMA page_count')).scalar()
+    return page_size * page_count
+
+
+def delete_expired(engine, table, cutoff, batch_size):
+    statement = text(RETAINED_TABLES[table])
+    deleted = 0
+    while True:
+        with engine.begin() as conn:
+            count = conn.execute(statement, {"cutoff": cutoff, "batch": batch_size}).rowcount
+        deleted += count
+        if count < batch_size:
+            break
+    return deleted
+
+
+def incremental_vacuum(engine, pages):
+    # VACUUM and incremental_vacuum cannot run inside a transaction
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        mode = conn.execute(text('PRAGMA auto_vacuum')).scalar()
+        if mode != AUTO_VACUUM_INCREMENTAL:
+            # converting takes a full VACUUM holding the write lock, never
+            # done here on a schedule
+            logger.warning('retention: auto_vacuum is not INCREMENTAL, free pages are kept. '
+                           'Convert once with python -m datastore.migrate --incremental-vacuum')
+            return
+
+        free = conn.execute(text('PRAGMA freelist_count')).scalar()
+        while free > 0:
+            conn.execute(text(f'PRAGMA incremental_vacuum({int(pages)})'))
+            remaining = conn.execute(text('PRAGMA freelist_count')).scalar()
+            if remaining >= free:
+                break
+            free = remaining
+
+
+def apply_retention(policy=None, engine=None, now=None):
+    """
+    Archive closed days if enabled, delete rows older than the policy
+    allows, then release free pages.
+
+    Args:
+        policy (dict): as returned by load_policy(), defaults to config/datastore.yaml
+        engine: engine to clean up, defaults to datastore.engine
+        now: reference time for the cutoffs, defaults to now
+
+    Returns:
+        dict: rows deleted per table, bytes_reclaimed and seconds
+    """
+    policy = policy or load_policy()
+    engine = engine or db.engine
+    now_ms = to_epoch_ms(now)
+    start = time.perf_counter()
+
+    with engine.connect() as conn:
+        size_before = database_size(conn)
+
+    archived = None
+    if policy.get('archive'):
+        # closed days go to the archive before any of their rows can expire
+        from datastore.archive import export_closed_days
+        archived = export_closed_days(engine=engine)
+
+    deleted = {}
+    for table, max_age_ms in policy['retention'].items():
+        if max_age_ms is None:
+            continue
+        deleted[table] = delete_expired(engine, table, now_ms - max_age_ms, policy['batch_size'])
+
+    incremental_vacuum(engine, policy['vacuum_pages'])
+
+    with engine.connect() as conn:
+        size_after = database_size(conn)
+
+    report = {
+        "archived": archived,
+        "deleted": deleted,
+        "bytes_before": size_before,
+        "bytes_after": size_after,
+        "bytes_reclaimed": size_before - size_after,
+        "seconds": time.perf_counter() - start,
+    }
+    logger.info(f'apply_retention {report}')
+    return report
@@ -0,0 +1,234 @@
+# Shared memory ring buffers with the most recent samples of every sensor
+# metric, so the API, alert checks and monitors can read live values without
+# a SQLite query or talking to the worker that took the reading.
+#
+# One file per (sensor_id, metric) in /dev/shm (tmpfs, never touches the SD
+# card) or data/ring, mapped with mmap by every process that uses it:
+#
+#   header  magic 'IOTR' | version u32 | capacity u32 | pad u32 | seq u64 | head u64
+#   slots   capacity x (ts int64 epoch ms, value float64)
+#
+# Writes use a seqlock: seq is odd while the writer updates slots and head, a
+# reader copies what it needs and retries if seq was odd or changed. Readers
+# never lock and never block the writer. Writers to the same ring serialize
+# with flock, which is uncontended in practice (one sweep at a time).
+# CPython cannot emit memory barriers; the scheme relies on stores to the
+# shared mapping becoming visible in program order, which holds on x86 and
+# in practice on the Pi's ARM cores for these word sized writes.
+# https://en.wikipedia.org/wiki/Seqlock
+#
+# ring.store().write_rows(rows)            # from datastore listeners
+# ring.store().latest('soil_temp', 'temp')  # (ts, value) or None
+
+import fcntl
+import mmap
+import os
+import struct
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from datastore.db import load_datastore_config
+from utils import base_dir
+
+path_ring = Path('/dev/shm/iot-manager-ring') if Path('/dev/shm').is_dir() else Path(*[base_dir, 'data', 'ring'])
+
+MAGIC = b'IOTR'
+VERSION = 1
+HEADER = struct.Struct('<4sIII')
+HEADER_SIZE = 64
+SEQ_OFFSET = 16
+HEAD_OFFSET = 24
+COUNTER = struct.Struct('<Q')
+SLOT = np.dtype([('ts', '<i8'), ('value', '<f8')])
+DEFAULT_CAPACITY = 3600
+READ_RETRIES = 1000
+
+
+class Ring:
+    """
+    Fixed size ring of (ts, value) samples in a shared file.
+
+    Args:
+        path: ring file
+        capacity (int): slots, only used when the file is created
+        create (bool): create the file if it does not exist, otherwise
+            FileNotFoundError is raised
+    """
+    def __init__(self, path, capacity=DEFAULT_CAPACITY, create=False):
+        self.path = Path(path)
+        if create and not self.path.exists():
+            self._create(capacity)
+        self.fd = os.open(self.path, os.O_RDWR)
+        size = os.fstat(self.fd).st_size
+        self.mm = mmap.mmap(self.fd, size)
+        magic, version, self.capacity, _ = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f'{path} is not a ring buffer')
+        self.slots = np.frombuffer(self.mm, dtype=SLOT, count=self.capacity, offset=HEADER_SIZE)
+
+    def _create(self, capacity):
+        # build the file aside and link it in place, two creators never clobber each other
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.path.parent, prefix='.ring-')
+        try:
+            os.ftruncate(fd, HEADER_SIZE + capacity * SLOT.itemsize)
+            os.pwrite(fd, HEADER.pack(MAGIC, VERSION, capacity, 0), 0)
+            os.close(fd)
+            try:
+                os.link(tmp, self.path)
+            except FileExistsError:
+                pass
+        finally:
+            os.unlink(tmp)
+
+    def _counter(self, offset):
+        return COUNTER.unpack_from(self.mm, offset)[0]
+
+    def extend(self, ts, values):
+        """Append samples, oldest first, in one write cycle."""
+        n = len(ts)
+        if n == 0:
+            return
+        if n > self.capacity:
+            ts, values, n = ts[-self.capacity:], values[-self.capacity:], self.capacity
+        fcntl.flock(self.fd, fcntl.LOCK_EX)
+        try:
+            seq = self._counter(SEQ_OFFSET)
+            # odd if a previous writer died mid write, its slots are overwritten anyway
+            seq += seq % 2
+            head = self._counter(HEAD_OFFSET)
+            COUNTER.pack_into(self.mm, SEQ_OFFSET, seq + 1)
+            positions = (head + np.arange(n)) % self.capacity
+            self.slots['ts'][positions] = ts
+            self.slots['value'][positions] = values
+            COUNTER.pack_into(self.mm, HEAD_OFFSET, head + n)
+            COUNTER.pack_into(self.mm, SEQ_OFFSET, seq + 2)
+        finally:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def append(self, ts, value):
+        self.extend([ts], [value])
+
+    def _read(self, copy):
+        for attempt in range(READ_RETRIES):
+            if attempt:
+                # let the writer finish, back off if it keeps writing
+                time.sleep(0 if attempt < 10 else 0.0001)
+            seq = self._counter(SEQ_OFFSET)
+            if seq % 2:
+                continue
+            head = self._counter(HEAD_OFFSET)
+            result = copy(head)
+            if self._counter(SEQ_OFFSET) == seq:
+                return result
+        raise TimeoutError(f'{self.path} kept changing while reading')
+
+    def latest(self):
+        """Most recent (ts, value), None if nothing was written yet."""
+        def copy(head):
+            if head == 0:
+                return None
+            slot = self.slots[(head - 1) % self.capacity]
+            return int(slot['ts']), float(slot['value'])
+        return self._read(copy)
+
+    def window(self, n=None, since=None):
+        """
+        The last n samples (all retained by default), oldest first, optionally
+        only those with ts >= since.
+
+        Returns:
+            tuple: (ts int64 array, values float64 array)
+        """
+        def copy(head):
+            count = min(head, self.capacity if n is None else min(n, self.capacity))
+            positions = (head - count + np.arange(count)) % self.capacity
+            return self.slots[positions].copy()
+        samples = self._read(copy)
+        if since is not None:
+            samples = samples[samples['ts'] >= since]
+        return samples['ts'], samples['value']
+
+    def written(self):
+        """Samples written since the ring was created."""
+        return self._read(lambda head: head)
+
+    def close(self):
+        self.slots = None
+        self.mm.close()
+        os.close(self.fd)
+
+
+def ring_name(sensor_id, metric):
+    # metrics contain dots, e.g. values.0
+    return f'{sensor_id}@{metric}'.replace('/', '_')
+
+
+class RingStore:
+    """
+    The rings of one directory, opened on demand and kept open.
+
+    Args:
+        root: directory of the ring files, defaults to path_ring
+        capacity (int): slots of rings created by write_rows()
+    """
+    def __init__(self, root=None, capacity=DEFAULT_CAPACITY):
+        self.root = Path(root or path_ring)
+        self.capacity = capacity
+        self.rings = {}
+
+    def ring(self, sensor_id, metric, create=False):
+        key = (sensor_id, metric)
+        if key not in self.rings:
+            try:
+                self.rings[key] = Ring(self.root / ring_name(sensor_id, metric), self.capacity, create=create)
+            except FileNotFoundError:
+                return None
+        return self.rings[key]
+
+    def write_rows(self, rows):
+        """Append Reading rows (dicts with sensor_id, metric, ts and value), a datastore listener."""
+        series = {}
+        for row in rows:
+            series.setdefault((row['sensor_id'], row['metric']), []).append((row['ts'], row['value']))
+        for (sensor_id, metric), samples in series.items():
+            samples.sort()
+            self.ring(sensor_id, metric, create=True).extend(
+                [ts for ts, _ in samples], [value for _, value in samples],
+            )
+
+    def latest(self, sensor_id, metric):
+        ring = self.ring(sensor_id, metric)
+        return ring.latest() if ring else None
+
+    def window(self, sensor_id, metric, n=None, since=None):
+        ring = self.ring(sensor_id, metric)
+        if ring is None:
+            return np.empty(0, dtype='int64'), np.empty(0, dtype='float64')
+        return ring.window(n=n, since=since)
+
+    def series(self):
+        """(sensor_id, metric) of every ring in the directory."""
+        if not self.root.exists():
+            return []
+        return sorted(tuple(p.name.split('@', 1)) for p in self.root.iterdir() if '@' in p.name and not p.name.startswith('.'))
+
+    def close(self):
+        for ring in self.rings.values():
+            ring.close()
+        self.rings = {}
+
+
+_store = None
+
+
+def store():
+    """The process wide RingStore, ring_capacity from config/datastore.yaml."""
+    global _store
+    if _store is None:
+        _store = RingStore(capacity=load_datastore_config().get('ring_capacity', DEFAULT_CAPACITY))
+    return _store
@@ -0,0 +1,175 @@
+# Downsampled min/max/mean/count of readings at 1 minute, 1 hour and 1 day.
+#
+# Rollups are updated incrementally in the same transaction as the readings
+# they summarize: each batch is aggregated in memory per bucket and merged
+# into the rollup tables with an upsert, so nothing is ever recomputed from
+# raw readings. Long range charts read rollup buckets instead of raw rows,
+# e.g. 90 days of 1 second data is ~7.8M readings but 90 rows of rollup_1d
+# or 2160 rows of rollup_1h.
+
+from sqlalchemy import select, func
+from sqlalchemy.dialects.sqlite import insert
+
+from datastore import db
+from datastore.models import Reading, Rollup1m, Rollup1h, Rollup1d
+from utils import to_epoch_ms
+
+# finest first
+RESOLUTIONS = {
+    '1m': (60 * 1000, Rollup1m),
+    '1h': (60 * 60 * 1000, Rollup1h),
+    '1d': (24 * 60 * 60 * 1000, Rollup1d),
+}
+
+
+def aggregate(rows, step_ms):
+    """
+    Aggregate reading rows into buckets of step_ms.
+
+    Returns:
+        dict: (sensor_id, metric, bucket) -> [count, sum, min, max]
+    """
+    buckets = {}
+    for row in rows:
+        key = (row['sensor_id'], row['metric'], row['ts'] - row['ts'] % step_ms)
+        value = row['value']
+        agg = buckets.get(key)
+        if agg is None:
+            buckets[key] = [1, value, value, value]
+        else:
+            agg[0] += 1
+            agg[1] += value
+            if value < agg[2]:
+                agg[2] = value
+            if value > agg[3]:
+                agg[3] = value
+    return buckets
+
+
+def upsert_statement(model):
+    table = model.__table__
+    stmt = insert(table)
+    # https://docs.sqlalchemy.org/en/20/dialects/sqlite.html#insert-on-conflict-upsert
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.sensor_id, table.c.metric, table.c.bucket],
+        set_={
+            'count': table.c.count + stmt.excluded['count'],
+            'sum': table.c.sum + stmt.excluded.sum,
+            'min': func.min(table.c.min, stmt.excluded.min),
+            'max': func.max(table.c.max, stmt.excluded.max),
+        },
+    )
+
+
+def update_rollups(conn, rows):
+    """
+    Merge a batch of reading rows into every rollup table. Meant to run inside
+    the transaction that inserts the readings, e.g. as BufferedWriter on_flush.
+    """
+    if not rows:
+        return
+    for step_ms, model in RESOLUTIONS.values():
+        buckets = aggregate(rows, step_ms)
+        conn.execute(upsert_statement(model), [
+            {
+                'sensor_id': sensor_id, 'metric': metric, 'bucket': bucket,
+                'count': agg[0], 'sum': agg[1], 'min': agg[2], 'max': agg[3],
+            }
+            for (sensor_id, metric, bucket), agg in buckets.items()
+        ])
+
+
+def rebuild_rollups(conn, start=None, end=None):
+    """
+    Recompute rollups for whole buckets between start and end. Only needed
+    after readings are written without update_rollups(), e.g. bulk loads or
+    deletes.
+
+    Only the finest resolution is computed from the readings table, every
+    coarser one is merged from the resolution below it (buckets nest), so the
+    raw readings are scanned once instead of once per resolution.
+    """
+    previous = None
+    for step_ms, model in RESOLUTIONS.values():
+        table = model.__table__
+        if previous is None:
+            ts = Reading.ts
+            bucket = (Reading.ts - Reading.ts % step_ms)
+            source = select(
+                Reading.sensor_id, Reading.metric, bucket,
+                func.count(), func.sum(Reading.value), func.min(Reading.value), func.max(Reading.value),
+            )
+            group = (Reading.sensor_id, Reading.metric, bucket)
+        else:
+            ts = previous.c.bucket
+            bucket = (previous.c.bucket - previous.c.bucket % step_ms)
+            source = select(
+                previous.c.sensor_id, previous.c.metric, bucket,
+                func.sum(previous.c.count), func.sum(previous.c.sum), func.min(previous.c.min), func.max(previous.c.max),
+            )
+            group = (previous.c.sensor_id, previous.c.metric, bucket)
+
+        purge = table.delete()
+        if start is not None:
+            start_ms = to_epoch_ms(start)
+            start_ms -= start_ms % step_ms
+            source = source.where(ts >= start_ms)
+            purge = purge.where(table.c.bucket >= start_ms)
+        if end is not None:
+            end_ms = to_epoch_ms(end)
+            end_ms += step_ms - end_ms % step_ms
+            source = source.where(ts < end_ms)
+            purge = purge.where(table.c.bucket < end_ms)
+        source = source.group_by(*group)
+
+        conn.execute(purge)
+        conn.execute(insert(table).from_select(
+            ['sensor_id', 'metric', 'bucket', 'count', 'sum', 'min', 'max'], source
+        ))
+        previous = table
+
+
+def pick_resolution(start_ms, end_ms, max_points):
+    """
+    Finest resolution that returns at most max_points buckets over the range,
+    falling back to daily buckets for very long ranges.
+    """
+    span = max(end_ms - start_ms, 0)
+    for name, (step_ms, _) in RESOLUTIONS.items():
+        if span // step_ms + 1 <= max_points:
+            return name
+    return '1d'
+
+
+def query_series(sensor_id, metric, start, end, max_points=500, resolution=None, bind=None):
+    """
+    Downsampled series of one sensor metric between start and end.
+
+    Args:
+        sensor_id (str): sensor, e.g. 'soil_temp'
+        metric (str): metric, e.g. 'temp_c'
+        start: datetime, now_str() string or epoch ms
+        end: datetime, now_str() string or epoch ms
+        max_points (int): point budget used to pick the resolution
+        resolution (str): force '1m', '1h' or '1d' instead of picking one
+        bind: engine to query, defaults to datastore.read_engine
+
+    Returns:
+        tuple: (resolution, rows) with rows of (bucket, mean, min, max, count)
+    """
+    start_ms = to_epoch_ms(start)
+    end_ms = to_epoch_ms(end)
+    if resolution is None:
+        resolution = pick_resolution(start_ms, end_ms, max_points)
+    step_ms, model = RESOLUTIONS[resolution]
+
+    stmt = (
+        select(model.bucket, model.sum / model.count, model.min, model.max, model.count)
+        .where(model.sensor_id == sensor_id)
+        .where(model.metric == metric)
+        .where(model.bucket.between(start_ms - start_ms % step_ms, end_ms))
+        .order_by(model.bucket)
+    )
+
+    with (bind or db.read_engine).connect() as conn:
+        return resolution, [tuple(row) for row in conn.execute(stmt)]
@@ -0,0 +1,256 @@
+# Running statistics of every sensor metric, updated in O(1) per sample as
+# readings are ingested, so triggers, alerts and the copilot monitor read
+# smoothed values and trends from memory instead of querying history.
+#
+# Per (sensor_id, metric):
+#   ewma       exponentially weighted mean with time constant tau_s, weights
+#              follow the time between samples so irregular sweeps are fine
+#   mean, std  Welford's running mean and variance since the series started
+#   min, max   over the last window_s seconds, monotonic deques
+#   slope      units per second, exponentially weighted least squares over
+#              the same tau_s, the origin follows the newest sample so the
+#              sums never grow large
+# https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance#Welford's_online_algorithm
+#
+# State is checkpointed to data/stats.json every checkpoint_s seconds and
+# loaded on start. Several processes share the file: RQ work horses fork
+# from the worker with the state of the last load, and the ESPHome client
+# keeps its own series. refresh() merges the file series by series, the
+# state with the newer sample wins, so series another process keeps are
+# picked up and updates not yet checkpointed are never replaced. It runs at
+# most every checkpoint_s seconds on ingest and before every checkpoint.
+#
+# stats.registry().update_rows(rows)          # a datastore listener
+# stats.registry().get('soil_temp', 'temp')  # dict or None
+
+import json
+import math
+import os
+import tempfile
+import time
+from collections import deque
+from pathlib import Path
+
+from datastore.db import load_datastore_config
+from utils import base_dir, logger
+
+path_stats = Path(*[base_dir, 'data', 'stats.json'])
+
+DEFAULTS = {
+    "tau_s": 300,
+    "window_s": 3600,
+    "checkpoint_s": 60,
+}
+
+
+class SeriesStats:
+    """
+    Running statistics of one series.
+
+    Args:
+        tau_s (float): time constant of the EWMA and slope
+        window_s (float): span of the rolling min and max
+    """
+    def __init__(self, tau_s=DEFAULTS['tau_s'], window_s=DEFAULTS['window_s']):
+        self.tau_s = tau_s
+        self.window_s = window_s
+        self.count = 0
+        self.ts = None # epoch ms of the newest sample
+        self.value = None
+        self.ewma = None
+        # Welford
+        self.mean = 0.0
+        self.m2 = 0.0
+        # (ts, value), values increasing in mins and decreasing in maxs
+        self.mins = deque()
+        self.maxs = deque()
+        # decayed sums for the slope, times in seconds relative to self.ts
+        self.s0 = self.st = self.sv = self.stt = self.stv = 0.0
+
+    def update(self, ts, value):
+        if self.ts is not None and ts < self.ts:
+            # late sample, the running state only moves forward
+            return False
+        dt = 0.0 if self.ts is None else (ts - self.ts) / 1000
+        decay = math.exp(-dt / self.tau_s) if self.tau_s else 0.0
+
+        self.count += 1
+        self.ewma = value if self.ewma is None else value + decay * (self.ewma - value)
+
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+        horizon = ts - self.window_s * 1000
+        while self.mins and self.mins[-1][1] >= value:
+            self.mins.pop()
+        self.mins.append((ts, value))
+        while self.mins[0][0] < horizon:
+            self.mins.popleft()
+        while self.maxs and self.maxs[-1][1] <= value:
+            self.maxs.pop()
+        self.maxs.append((ts, value))
+        while self.maxs[0][0] < horizon:
+            self.maxs.popleft()
+
+        # move the origin to the new sample (t -> t - dt), then decay and add it at t = 0
+        self.stt = decay * (self.stt - 2 * dt * self.st + dt * dt * self.s0)
+        self.stv = decay * (self.stv - dt * self.sv)
+        self.st = decay * (self.st - dt * self.s0)
+        self.s0 = decay * self.s0 + 1
+        self.sv = decay * self.sv + value
+
+        self.ts = ts
+        self.value = value
+        return True
+
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def slope(self):
+        denominator = self.s0 * self.stt - self.st * self.st
+        if self.count < 2 or denominator <= 1e-12 * max(self.s0 * self.stt, 1e-12):
+            return 0.0
+        return (self.s0 * self.stv - self.st * self.sv) / denominator
+
+    def snapshot(self):
+        if self.count == 0:
+            return None
+        return {
+            "ts": self.ts,
+            "value": self.value,
+            "count": self.count,
+            "ewma": self.ewma,
+            "mean": self.mean,
+            "std": math.sqrt(self.variance),
+            "min": self.mins[0][1],
+            "max": self.maxs[0][1],
+            "slope": self.slope,
+        }
+
+    def to_dict(self):
+        return {
+            "count": self.count, "ts": self.ts, "value": self.value, "ewma": self.ewma,
+            "mean": self.mean, "m2": self.m2,
+            "mins": list(self.mins), "maxs": list(self.maxs),
+            "sums": [self.s0, self.st, self.sv, self.stt, self.stv],
+        }
+
+    @classmethod
+    def from_dict(cls, data, tau_s=DEFAULTS['tau_s'], window_s=DEFAULTS['window_s']):
+        stats = cls(tau_s, window_s)
+        stats.count, stats.ts, stats.value, stats.ewma = data['count'], data['ts'], data['value'], data['ewma']
+        stats.mean, stats.m2 = data['mean'], data['m2']
+        stats.mins = deque(tuple(sample) for sample in data['mins'])
+        stats.maxs = deque(tuple(sample) for sample in data['maxs'])
+        stats.s0, stats.st, stats.sv, stats.stt, stats.stv = data['sums']
+        return stats
+
+
+class StatsRegistry:
+    """
+    SeriesStats of every sensor metric, checkpointed to a JSON file.
+
+    Args:
+        path: checkpoint file, None keeps the state in memory only
+        tau_s (float): see SeriesStats
+        window_s (float): see SeriesStats
+        checkpoint_s (float): minimum seconds between checkpoints written by
+            update_rows(), 0 writes one per batch
+    """
+    def __init__(self, path=None, tau_s=DEFAULTS['tau_s'], window_s=DEFAULTS['window_s'], checkpoint_s=DEFAULTS['checkpoint_s']):
+        self.path = Path(path) if path else None
+        self.tau_s = tau_s
+        self.window_s = window_s
+        self.checkpoint_s = checkpoint_s
+        self.series = {}
+        self.loaded_mtime = None
+        self.last_checkpoint = time.monotonic()
+        self.last_refresh = time.monotonic()
+        self.refresh()
+
+    def _mtime(self):
+        try:
+            return self.path.stat().st_mtime_ns
+        except (AttributeError, FileNotFoundError):
+            return None
+
+    def refresh(self):
+        """
+        Merge the checkpoint if another process wrote a newer one: every
+        series of the file replaces ours if its newest sample is newer.
+        """
+        self.last_refresh = time.monotonic()
+        mtime = self._mtime()
+        if mtime is None or mtime == self.loaded_mtime:
+            return False
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f'stats checkpoint {self.path} not loaded: {e}')
+            return False
+        for key, state in data['series'].items():
+            sensor_id, metric = key.split('@', 1)
+            current = self.series.get((sensor_id, metric))
+            if current is None or current.ts is None or (state['ts'], state['count']) > (current.ts, current.count):
+                self.series[(sensor_id, metric)] = SeriesStats.from_dict(state, self.tau_s, self.window_s)
+        self.loaded_mtime = mtime
+        return True
+
+    def update(self, sensor_id, metric, ts, value):
+        key = (sensor_id, metric)
+        if key not in self.series:
+            self.series[key] = SeriesStats(self.tau_s, self.window_s)
+        return self.series[key].update(ts, value)
+
+    def update_rows(self, rows):
+        """Update with Reading rows (dicts with sensor_id, metric, ts and value), a datastore listener."""
+        if time.monotonic() - self.last_refresh >= self.checkpoint_s:
+            self.refresh()
+        for row in sorted(rows, key=lambda row: row['ts']):
+            self.update(row['sensor_id'], row['metric'], row['ts'], row['value'])
+        if self.path is not None and time.monotonic() - self.last_checkpoint >= self.checkpoint_s:
+            self.checkpoint()
+
+    def get(self, sensor_id, metric):
+        stats = self.series.get((sensor_id, metric))
+        return stats.snapshot() if stats else None
+
+    def snapshot(self):
+        """{(sensor_id, metric): stats dict} of every series."""
+        return {key: stats.snapshot() for key, stats in self.series.items() if stats.count}
+
+    def checkpoint(self):
+        """Write the state atomically, readers never see a partial file."""
+        if self.path is None:
+            return
+        # keep the series other processes checkpointed since our last refresh
+        self.refresh()
+        data = {"series": {f'{sensor_id}@{metric}': stats.to_dict() for (sensor_id, metric), stats in self.series.items()}}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.path.parent, prefix='.stats-')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self.loaded_mtime = self._mtime()
+        self.last_checkpoint = time.monotonic()
+
+
+_registry = None
+
+
+def registry():
+    """The process wide StatsRegistry, the stats section of config/datastore.yaml."""
+    global _registry
+    if _registry is None:
+        config = dict(DEFAULTS)
+        config.update(load_datastore_config().get('stats') or {})
+        _registry = StatsRegistry(path_stats, **config)
+    return _registry
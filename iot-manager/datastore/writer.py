@@ -0,0 +1,226 @@
+import atexit
+import queue
+import threading
+import time
+from collections import deque
+
+from sqlalchemy.exc import OperationalError
+
+from utils import logger
+
+# https://docs.sqlalchemy.org/en/20/tutorial/data_insert.html#insert-usually-generates-the-values-clause-automatically
+# passing a list of dicts to Connection.execute(insert(table), rows) runs a
+# single executemany() inside one transaction
+
+class BufferedWriter:
+    """
+    Buffer rows in a bounded in-memory queue and write them to `table` with one
+    bulk insert per flush instead of one committed transaction per row.
+
+    A background thread flushes when `max_rows` rows are pending or when the
+    oldest pending row is `max_age_s` seconds old. `add()` blocks once
+    `max_queue` rows are pending so a stalled database applies backpressure
+    instead of growing memory without bound.
+
+    A flush failing with OperationalError (database locked or busy, e.g.
+    during a VACUUM or a backup) keeps the whole batch for the next flush,
+    which waits twice as long after each failure, up to `max_backoff_s`.
+    Those rows are never rejected, only the `max_queue` bound drops the
+    oldest of them. Any other error is taken to be caused by some of the
+    rows, e.g. a NULL value: the batch is split in halves until the rows
+    that fail alone are found, those are moved to `rejected` and the rest
+    is written.
+
+    Args:
+        engine: SQLAlchemy engine to write to
+        table: SQLAlchemy Table the rows are inserted into
+        max_rows (int): flush as soon as this many rows are pending
+        max_age_s (float): flush once the oldest pending row is this old
+        max_queue (int): maximum number of rows held in memory
+        on_flush (callable): optional hook called as on_flush(connection, rows)
+            inside the flush transaction
+        max_backoff_s (float): longest wait before retrying a locked database
+    """
+    def __init__(self, engine, table, max_rows=500, max_age_s=5.0, max_queue=10000, on_flush=None, max_backoff_s=60.0):
+        self.engine = engine
+        self.table = table
+        self.max_rows = max_rows
+        self.max_age_s = max_age_s
+        self.on_flush = on_flush
+        self.max_backoff_s = max_backoff_s
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._retry = []
+        self._failures = 0
+        self._retry_at = None
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.rows_written = 0
+        self.flushes = 0
+        # the last rows that could not be written, for inspection
+        self.rejected = deque(maxlen=1000)
+        self.rows_rejected = 0
+
+    def start(self):
+        if self._thread is not None:
+            return self
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='datastore-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+        return self
+
+    def add(self, row, block=True, timeout=None):
+        self._queue.put(row, block=block, timeout=timeout)
+        with self._lock:
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+        if self._queue.qsize() >= self.max_rows:
+            self._wake.set()
+
+    def add_many(self, rows):
+        for row in rows:
+            self.add(row)
+
+    def pending(self):
+        return self._queue.qsize() + len(self._retry)
+
+    def flush(self):
+        """
+        Write every pending row in a single transaction.
+
+        Returns:
+            int: number of rows written
+        """
+        with self._flush_lock:
+            rows = self._retry
+            self._retry = []
+            while True:
+                try:
+                    rows.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            with self._lock:
+                self._oldest = None
+
+            if not rows:
+                return 0
+
+            try:
+                self._write(rows)
+                written = len(rows)
+            except OperationalError as e:
+                self._locked(rows, e)
+                return 0
+            except Exception as e:
+                logger.error(f'BufferedWriter flush of {len(rows)} rows failed, splitting the batch: {e}')
+                written, unwritten = self._write_split(rows)
+                if unwritten:
+                    # locked while splitting, the rest waits like a locked batch
+                    self._locked(unwritten, 'database locked while splitting')
+                    self.rows_written += written
+                    return written
+
+            self._failures = 0
+            self._retry_at = None
+            self.rows_written += written
+            self.flushes += 1
+            return written
+
+    def _write(self, rows):
+        with self.engine.begin() as conn:
+            conn.execute(self.table.insert(), rows)
+            if self.on_flush is not None:
+                self.on_flush(conn, rows)
+
+    def _locked(self, rows, error):
+        # keep the rows and back off, the lock is not the rows' fault
+        self._failures += 1
+        delay = min(self.max_age_s * 2 ** (self._failures - 1), self.max_backoff_s)
+        self._retry_at = time.monotonic() + delay
+        logger.error(f'BufferedWriter flush of {len(rows)} rows failed {self._failures} times, retrying in {delay:.1f}s: {error}')
+        self._keep_for_retry(rows)
+
+    def _write_split(self, rows):
+        """
+        Write rows in halves, recursively, rejecting the single rows that fail.
+        Stops at the first OperationalError, a locked database is no reason
+        to reject rows.
+
+        Returns:
+            tuple: (rows written, rows left unwritten in their original order)
+        """
+        written = 0
+        chunks = [rows]
+        while chunks:
+            chunk = chunks.pop()
+            try:
+                self._write(chunk)
+                written += len(chunk)
+            except OperationalError:
+                return written, [row for c in [chunk] + chunks[::-1] for row in c]
+            except Exception as e:
+                if len(chunk) > 1:
+                    middle = len(chunk) // 2
+                    # popped from the end, the first half is written first
+                    chunks.append(chunk[middle:])
+                    chunks.append(chunk[:middle])
+                    continue
+                logger.error(f'BufferedWriter rejected {chunk[0]}: {e}')
+                self.rejected.extend(chunk)
+                self.rows_rejected += 1
+        return written, []
+
+    def _keep_for_retry(self, rows):
+        # keep the rows for the next flush, dropping the oldest ones if the
+        # retry backlog would exceed the queue bound
+        overflow = len(rows) - self._queue.maxsize
+        if overflow > 0:
+            logger.warning(f'BufferedWriter dropping {overflow} rows')
+            rows = rows[overflow:]
+        self._retry = rows
+        with self._lock:
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+
+    def close(self):
+        """Stop the background thread and flush whatever is still pending."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+            atexit.unregister(self.close)
+        self.flush()
+
+    def _due(self):
+        if self._retry_at is not None and time.monotonic() < self._retry_at:
+            return False
+        if self.pending() >= self.max_rows:
+            return True
+        with self._lock:
+            oldest = self._oldest
+        return oldest is not None and time.monotonic() - oldest >= self.max_age_s
+
+    def _time_to_flush(self):
+        if self._retry_at is not None:
+            return max(0.0, self._retry_at - time.monotonic())
+        with self._lock:
+            oldest = self._oldest
+        if oldest is None:
+            return self.max_age_s
+        return max(0.0, oldest + self.max_age_s - time.monotonic())
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(timeout=self._time_to_flush())
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            if self._due():
+                self.flush()
@@ -3,7 +3,8 @@ from utils import load_yaml, logger, now_str
 import json
 import datetime
 
-from services.camera import CameraUSB
+from services.camera import CameraUSB, camera_registry
+from devices import bus
 
 # actuators
 class Actuator:
@@ -12,7 +13,7 @@ class Actuator:
     
 class LightCWWW(Actuator):
     def __init__(self, config_data):
-        super.__init__(config_data)
+        super().__init__(config_data)
         pass
     def on(self):
         logger.info('LightCWWW on')
@@ -30,7 +31,7 @@ class LightCWWW(Actuator):
 
 class LightRGB(Actuator):
     def __init__(self, config_data):
-        super.__init__(config_data)
+        super().__init__(config_data)
     def on(self):
         pass
     def off(self):
@@ -38,7 +39,7 @@ class LightRGB(Actuator):
 
 class Fan(Actuator):
     def __init__(self, config_data):
-        super.__init__(config_data)
+        super().__init__(config_data)
     def on(self):
         pass
     def off(self):
@@ -46,7 +47,7 @@ class Fan(Actuator):
     
 class HeatElement(Actuator):
     def __init__(self, config_data):
-        super.__init__(config_data)
+        super().__init__(config_data)
     def on(self):
         pass
     def off(self):
@@ -54,7 +55,7 @@ class HeatElement(Actuator):
     
 class WaterPump(Actuator):
     def __init__(self, config_data):
-        super.__init__(config_data)
+        super().__init__(config_data)
         pass
     def on(self):
         pass
@@ -63,6 +64,9 @@ class WaterPump(Actuator):
 
 # sensors
 class Sensor:
+    sensor_type = 'sensor'
+    device_path = {}
+
     def __init__(self, config_data):
         self.config_data = config_data
         self.last_reading = {}
@@ -70,12 +74,21 @@ class Sensor:
         
 class Camera(Sensor):
     def __init__(self, config_data):
-        super.__init__(config_data)
-        self.device = CameraUSB('/dev/video1','2592x1944')
+        super().__init__(config_data)
+        # sysfs lookup, formats are only probed when the config has no resolution
+        config_data = config_data or {}
+        registry = camera_registry()
+        camera = registry.find(usb_path=config_data.get('usb_device_path'), serial=config_data.get('serial'))
+        device_path = camera['device_path'] if camera else '/dev/video1'
+        if config_data.get('res_width') and config_data.get('res_height'):
+            resolution = f"{config_data['res_width']}x{config_data['res_height']}"
+        else:
+            resolution = (registry.best_resolution(camera) if camera else None) or '2592x1944'
+        self.device = CameraUSB(device_path, resolution)
         
     def photo(self):
         logger.info('Camera photo')
-        photo_filepath, device_path = self.device.photo()
+        photo_filepath, device_path, _ = self.device.photo()
         
         return {
             "type": "camera",
@@ -86,98 +99,139 @@ class Camera(Sensor):
         
     
 class LightSensor(Sensor):
+    sensor_type = 'light_fullspectrum'
+
     def __init__(self, config_data):
-        super.__init__(config_data)
+        super().__init__(config_data)
         self.device_path = {
+            # TSL2591 behind the TCA9548A mux
             "connection": "i2c",
+            "bus": 1,
             "multiplex": 0,
-            "address": "x01",
-            "chip": "xxx001"
+            "channel": 0,
+            "address": "0x29",
+            "chip": "tsl2591"
         }
         
     def measure(self):
         data = read_gpio(self.device_path)
+        self.last_reading = data
         return data
 
 class AirTempHumiditySensor(Sensor):
+    sensor_type = 'air_temp_humidity'
+
     def __init__(self, config_data):
-        super.__init__(config_data)
+        super().__init__(config_data)
         self.device_path = {
-            "connection": "i2c",
-            "multiplex": 0,
-            "address": "x01",
-            "chip": "xxx001"
+            # DHT single wire protocol on a GPIO pin
+            "connection": "gpio",
+            "pin": 4,
+            "chip": "dht22"
         }
         
     def measure(self):
         data = read_gpio(self.device_path)
+        self.last_reading = data
         return data
 
 class AirTempHumidityBarometerSensor(Sensor):
+    sensor_type = 'air_temp_humidity_barometer'
+
     def __init__(self, config_data):
-        super.__init__(config_data)
+        super().__init__(config_data)
         self.device_path = {
             "connection": "i2c",
+            "bus": 1,
             "multiplex": 0,
-            "address": "x01",
-            "chip": "xxx001"
+            "channel": 1,
+            "address": "0x76",
+            "chip": "bme280"
         }
         
     def measure(self):
         data = read_gpio(self.device_path)
+        self.last_reading = data
         return data
 
 class SoilTempSensor(Sensor):
+    sensor_type = 'soil_temp'
+
     def __init__(self, config_data):
-        super.__init__(config_data)
+        super().__init__(config_data)
         self.device_path = {
-            "connection": "i2c",
-            "multiplex": 0,
-            "address": "x01",
-            "chip": "xxx001"
+            # DS18B20, w1-gpio overlay
+            "connection": "onewire",
+            "bus": "w1_bus_master1",
+            "chip": "ds18b20"
         }
         
     def measure(self):
         data = read_gpio(self.device_path)
+        self.last_reading = data
         return data
 
 class SoilMoistureSensor(Sensor):
+    sensor_type = 'soil_moisture'
+
     def __init__(self, config_data):
-        super.__init__(config_data)
+        super().__init__(config_data)
         self.device_path = {
+            # capacitive probe read through an ADS1115 ADC
             "connection": "i2c",
+            "bus": 1,
             "multiplex": 0,
-            "address": "x01",
-            "chip": "xxx001"
+            "channel": 2,
+            "address": "0x48",
+            "chip": "ads1115"
         }
         
     def measure(self):
         data = read_gpio(self.device_path)
+        self.last_reading = data
         return data
 
 class WaterLevelSensor(Sensor):
+    sensor_type = 'water_level'
+
     def __init__(self, config_data):
-        super.__init__(config_data)
+        super().__init__(config_data)
         self.device_path = {
-            "connection": "i2c",
-            "multiplex": 0,
-            "address": "x01",
-            "chip": "xxx001"
+            # HC-SR04 trigger and echo pins
+            "connection": "gpio",
+            "pin": 23,
+            "echo_pin": 24,
+            "chip": "hcsr04"
         }
         
     def measure(self):
         data = read_gpio(self.device_path)
+        self.last_reading = data
         return data
     
     
+# set with use_backend(), e.g. a devices.simulator.Simulator. None reads the hardware
+backend = None
+
+def use_backend(new_backend):
+    global backend
+    backend = new_backend
+    return backend
+
 def read_gpio(device_path):
     # 
+    if backend is not None:
+        return backend.read(device_path)
+    if device_path.get('connection') == 'i2c' and device_path.get('chip') in bus.DRIVERS and bus.hardware_available():
+        return bus.read_i2c(device_path)
     return {
         "values":[0,1],
         "ts": now_str()
     }
 
 def write_gpio(device_path, data):
+    if backend is not None:
+        return backend.write(device_path, data)
     
     return {}
 
@@ -198,6 +252,8 @@ def bind_devices(config_devices):
             'soil_moisture':[],
             'soil_temp':[],
             'air_temp_humidity':[],
+            'air_temp_humidity_barometer':[],
+            'light_fullspectrum':[],
             'light':[],
         }
     }
@@ -211,42 +267,42 @@ def bind_devices(config_devices):
             
             # sensors
             if device_type == 'light_cwww':
-                light_cwww = LightCWWW()
+                light_cwww = LightCWWW(d)
                 system_devices['actuators'][device_type].append(light_cwww)
             elif device_type == 'pump_water':
-                water_pump = WaterPump()
+                water_pump = WaterPump(d)
                 system_devices['actuators'][device_type].append(water_pump)
             elif device_type == 'light_rgb':
-                light_rgb = LightRGB()
+                light_rgb = LightRGB(d)
                 system_devices['actuators'][device_type].append(light_rgb)
             elif device_type == 'fan':
-                fan = Fan()
+                fan = Fan(d)
                 system_devices['actuators'][device_type].append(fan)
             elif device_type == 'heat_wire':
-                heat_element = HeatElement()
+                heat_element = HeatElement(d)
                 system_devices['actuators'][device_type].append(heat_element)
             
             # sensors
             elif device_type == 'usb_camera':
-                sensor = CameraUSB()
-                system_devices['sensors'][device_type].append(sensor)
+                sensor = Camera(d)
+                system_devices['sensors']['cameras'].append(sensor)
             elif device_type == 'soil_moisture':
-                sensor = SoilMoistureSensor()
+                sensor = SoilMoistureSensor(d)
                 system_devices['sensors'][device_type].append(sensor) 
             elif device_type == 'soil_temp':
-                sensor = SoilTempSensor()
+                sensor = SoilTempSensor(d)
                 system_devices['sensors'][device_type].append(sensor)
             elif device_type == 'water_level':
-                sensor = WaterLevelSensor()
+                sensor = WaterLevelSensor(d)
                 system_devices['sensors'][device_type].append(sensor) 
             elif device_type == 'air_temp_humidity':
-                sensor = AirTempHumiditySensor()
+                sensor = AirTempHumiditySensor(d)
                 system_devices['sensors'][device_type].append(sensor) 
             elif device_type == 'air_temp_humidity_barometer':
-                sensor = AirTempHumidityBarometerSensor()
+                sensor = AirTempHumidityBarometerSensor(d)
                 system_devices['sensors'][device_type].append(sensor)   
             elif device_type == 'light_fullspectrum':
-                sensor = LightSensor()
+                sensor = LightSensor(d)
                 system_devices['sensors'][device_type].append(sensor) 
               
             
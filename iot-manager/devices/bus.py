@@ -0,0 +1,281 @@
+# I2C bus manager for sensors behind TCA9548A multiplexers.
+#
+# devices/tests/i2c_multiplex.py builds a new driver per channel per loop and
+# adafruit_tca9548a writes the channel select byte on every locked access.
+# Here driver objects are built once per (mux, channel, address) and a read
+# only writes the select byte when the channel actually changes. read_batch()
+# sorts reads by channel so every channel is selected once per batch.
+#
+# Channels of all muxes share the upstream SDA/SCL: only one mux may have a
+# channel enabled at a time, and one transaction runs on the bus at a time.
+# devices/sweep.py reads all devices of an upstream bus with one read_batch(),
+# other threads using the bus wait on the bus lock.
+# https://learn.adafruit.com/adafruit-tca9548a-1-to-8-i2c-multiplexer-breakout
+#
+# bus = get_bus(1)
+# bus.read({"connection": "i2c", "bus": 1, "multiplex": 0, "channel": 2, "address": "0x38", "chip": "ahtx0"})
+# bus.stats()
+
+import importlib
+import threading
+import time
+
+from utils import logger, now_str
+
+# TCA9548A address pins A0-A2 select 0x70-0x77, device_path['multiplex'] is the offset
+MUX_BASE_ADDRESS = 0x70
+
+
+def create_ahtx0(i2c, address):
+    import adafruit_ahtx0
+    return adafruit_ahtx0.AHTx0(i2c, address)
+
+
+def create_bme280(i2c, address):
+    from adafruit_bme280 import basic as adafruit_bme280
+    return adafruit_bme280.Adafruit_BME280_I2C(i2c, address)
+
+
+def create_tsl2591(i2c, address):
+    import adafruit_tsl2591
+    return adafruit_tsl2591.TSL2591(i2c, address)
+
+
+def create_ads1115(i2c, address):
+    import adafruit_ads1x15.ads1115 as ADS
+    return ADS.ADS1115(i2c, address=address)
+
+
+def create_seesaw(i2c, address):
+    from adafruit_seesaw.seesaw import Seesaw
+    return Seesaw(i2c, addr=address)
+
+
+def read_ads1115(driver):
+    from adafruit_ads1x15.analog_in import AnalogIn
+    import adafruit_ads1x15.ads1115 as ADS
+    return {"moisture": AnalogIn(driver, ADS.P0).value}
+
+
+# chip -> (driver factory, reader returning the values named in devices.yaml)
+DRIVERS = {
+    'ahtx0': (create_ahtx0, lambda d: {"temp": d.temperature, "humidity": d.relative_humidity}),
+    'bme280': (create_bme280, lambda d: {
+        "temp": d.temperature, "humidity": d.relative_humidity, "pressure": d.pressure, "altitude": d.altitude,
+    }),
+    'tsl2591': (create_tsl2591, lambda d: {
+        "light_total": d.lux, "light_ir": d.infrared, "light_visible": d.visible, "light_fullspectrum": d.full_spectrum,
+    }),
+    'ads1115': (create_ads1115, read_ads1115),
+    'seesaw': (create_seesaw, lambda d: {"moisture": d.moisture_read(), "temp": d.get_temp()}),
+}
+
+
+def parse_address(address):
+    if isinstance(address, str):
+        return int(address, 16)
+    return address
+
+
+def channel_of(device_path):
+    # (mux address, channel), (None, None) for devices wired to the bus directly
+    multiplex = device_path.get('multiplex')
+    if multiplex is None:
+        return (None, None)
+    return (MUX_BASE_ADDRESS + multiplex, device_path.get('channel', 0))
+
+
+class MuxChannel:
+    """
+    busio.I2C look-alike for one mux channel, handed to the drivers. Mux and
+    channel None stand for the devices wired to the bus directly.
+
+    Locking it takes the manager's bus lock and selects the channel only if
+    another one is selected. Unlocking leaves the channel selected so the
+    next transaction on it skips the select write.
+    """
+    def __init__(self, manager, mux, channel):
+        self.manager = manager
+        self.mux = mux
+        self.channel = channel
+
+    def try_lock(self):
+        # blocking: adafruit_bus_device spins on try_lock(), waiting here keeps
+        # threads off the CPU while another channel uses the bus
+        self.manager.lock.acquire()
+        if not self.manager.i2c.try_lock():
+            self.manager.lock.release()
+            return False
+        try:
+            self.manager.select(self.mux, self.channel)
+        except Exception:
+            self.unlock()
+            raise
+        return True
+
+    def unlock(self):
+        self.manager.i2c.unlock()
+        self.manager.lock.release()
+
+    def readfrom_into(self, address, buffer, **kwargs):
+        self.manager.transactions += 1
+        return self.manager.i2c.readfrom_into(address, buffer, **kwargs)
+
+    def writeto(self, address, buffer, **kwargs):
+        self.manager.transactions += 1
+        return self.manager.i2c.writeto(address, buffer, **kwargs)
+
+    def writeto_then_readfrom(self, address, buffer_out, buffer_in, **kwargs):
+        self.manager.transactions += 1
+        return self.manager.i2c.writeto_then_readfrom(address, buffer_out, buffer_in, **kwargs)
+
+    def scan(self):
+        return [address for address in self.manager.i2c.scan() if address != self.mux]
+
+
+class I2CBusManager:
+    """
+    Owns one upstream I2C bus, its muxes and the drivers behind them.
+
+    Args:
+        i2c: busio.I2C compatible bus, defaults to board.I2C()
+    """
+    def __init__(self, i2c=None):
+        if i2c is None:
+            import board
+            i2c = board.I2C()
+        self.i2c = i2c
+        self.lock = threading.RLock()
+        self.channels = {}
+        self.drivers = {}
+        self.selected = (None, None)
+        # utilization counters, see stats()
+        self.reads = 0
+        self.errors = 0
+        self.transactions = 0
+        self.channel_switches = 0
+        self.drivers_created = 0
+        self.busy_s = 0.0
+        self.since = time.monotonic()
+
+    def select(self, mux, channel):
+        # caller holds the bus lock
+        if (mux, channel) == self.selected:
+            return
+        previous_mux = self.selected[0]
+        if previous_mux is not None and previous_mux != mux:
+            # disconnect the other mux, its devices may share addresses with
+            # ours, or with a device wired directly (mux None)
+            self.i2c.writeto(previous_mux, bytes([0]))
+        if mux is not None:
+            self.i2c.writeto(mux, bytes([1 << channel]))
+        self.selected = (mux, channel)
+        self.channel_switches += 1
+
+    def channel(self, mux, channel):
+        key = (mux, channel)
+        if key not in self.channels:
+            self.channels[key] = MuxChannel(self, mux, channel)
+        return self.channels[key]
+
+    def driver(self, device_path):
+        mux, channel = channel_of(device_path)
+        address = parse_address(device_path['address'])
+        chip = device_path['chip']
+        key = (mux, channel, address, chip)
+        if key not in self.drivers:
+            create, _ = DRIVERS[chip]
+            with self.lock:
+                self.drivers[key] = create(self.channel(mux, channel), address)
+            self.drivers_created += 1
+        return self.drivers[key]
+
+    def read(self, device_path):
+        """
+        Read one device, returns its values and ts like Sensor.measure().
+        """
+        _, reader = DRIVERS[device_path['chip']]
+        with self.lock:
+            start = time.perf_counter()
+            try:
+                data = reader(self.driver(device_path))
+            except Exception:
+                self.errors += 1
+                raise
+            finally:
+                self.busy_s += time.perf_counter() - start
+                self.reads += 1
+        data['ts'] = now_str()
+        return data
+
+    def read_batch(self, device_paths):
+        """
+        Read many devices holding the bus once, grouped by channel starting
+        with the one already selected, so each channel is selected at most once.
+
+        Returns:
+            list: values per device in the order of device_paths, or the
+                exception raised by that device
+        """
+        order = sorted(range(len(device_paths)), key=lambda i: (
+            channel_of(device_paths[i]) != self.selected,
+            channel_of(device_paths[i])[0] or 0,
+            channel_of(device_paths[i])[1] or 0,
+        ))
+        results = [None] * len(device_paths)
+        with self.lock:
+            for i in order:
+                try:
+                    results[i] = self.read(device_paths[i])
+                except Exception as e:
+                    logger.error(f'I2CBusManager read {device_paths[i]} failed: {e}')
+                    results[i] = e
+        return results
+
+    def stats(self):
+        wall_s = time.monotonic() - self.since
+        return {
+            "reads": self.reads,
+            "errors": self.errors,
+            "transactions": self.transactions,
+            "channel_switches": self.channel_switches,
+            "drivers_created": self.drivers_created,
+            "busy_s": self.busy_s,
+            "utilization": self.busy_s / wall_s if wall_s > 0 else 0.0,
+        }
+
+
+# bus number -> I2CBusManager, one per process
+buses = {}
+buses_lock = threading.Lock()
+
+
+def get_bus(bus=1):
+    with buses_lock:
+        if bus not in buses:
+            if bus == 1:
+                buses[bus] = I2CBusManager()
+            else:
+                # extra buses from dtoverlay=i2c-gpio
+                from adafruit_extended_bus import ExtendedI2C
+                buses[bus] = I2CBusManager(ExtendedI2C(bus))
+        return buses[bus]
+
+
+hardware = None
+
+
+def hardware_available():
+    # board (Adafruit Blinka) only imports on supported single board computers
+    global hardware
+    if hardware is None:
+        try:
+            importlib.import_module('board')
+            hardware = True
+        except Exception:
+            hardware = False
+    return hardware
+
+
+def read_i2c(device_path):
+    return get_bus(device_path.get('bus', 1)).read(device_path)
@@ -0,0 +1,185 @@
+# Simulated device backend, no board, RPi.GPIO or sensors needed.
+#
+# Once installed with devices.use_backend(), read_gpio() and write_gpio()
+# go to the simulator instead of the hardware, so the Sensor and Actuator
+# classes, the sweep, the worker jobs and the datastore all run unchanged.
+# Every metric follows a diurnal cycle plus noise, the same shape as
+# tests/mock/sensors.generate_temperature_data, with a per device phase and
+# offset so a thousand sensors do not report identical values. Reads can be
+# given a latency and a failure rate to exercise the pipeline under load.
+#
+# simulator = load_simulator()
+# devices.use_backend(simulator)
+# sensors = make_virtual_sensors(1000)
+
+import math
+import random
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from pathlib import Path
+
+from devices import Sensor, read_gpio
+from utils import base_dir, load_yaml
+
+path_config_simulator = Path(*[base_dir, 'config', 'simulator.yaml'])
+
+# metric -> mean, diurnal amplitude, hour of the peak, noise std, min, max
+SIGNALS = {
+    'temp': (24.0, 3.0, 15, 0.3, -10.0, 50.0),
+    'humidity': (55.0, 10.0, 5, 1.0, 0.0, 100.0),
+    'pressure': (1013.25, 0.8, 10, 0.2, 950.0, 1050.0),
+    'altitude': (0.0, 0.0, 0, 0.5, -50.0, 50.0),
+    'moisture': (40.0, 2.0, 6, 0.5, 0.0, 100.0),
+    'distance': (20.0, 1.0, 18, 0.2, 2.0, 400.0),
+    # light is clipped at night, the negative part of the cycle is darkness
+    'light_total': (0.0, 20000.0, 13, 200.0, 0.0, 88000.0),
+    'light_visible': (0.0, 15000.0, 13, 150.0, 0.0, 65535.0),
+    'light_ir': (0.0, 5000.0, 13, 50.0, 0.0, 65535.0),
+    'light_fullspectrum': (0.0, 20000.0, 13, 200.0, 0.0, 65535.0),
+}
+
+# chip -> metrics it reports, names as in config/devices.yaml
+CHIPS = {
+    'dht22': ['temp', 'humidity'],
+    'ahtx0': ['temp', 'humidity'],
+    'bme280': ['temp', 'humidity', 'pressure', 'altitude'],
+    'ds18b20': ['temp'],
+    'ads1115': ['moisture'],
+    'seesaw': ['moisture', 'temp'],
+    'tsl2591': ['light_total', 'light_ir', 'light_visible', 'light_fullspectrum'],
+    'hcsr04': ['distance'],
+}
+
+# sensor_type -> chip, used by make_virtual_sensors()
+SENSOR_CHIPS = {
+    'air_temp_humidity': 'dht22',
+    'air_temp_humidity_barometer': 'bme280',
+    'soil_temp': 'ds18b20',
+    'soil_moisture': 'ads1115',
+    'light_fullspectrum': 'tsl2591',
+    'water_level': 'hcsr04',
+}
+
+
+class SimulatedReadError(IOError):
+    pass
+
+
+class Simulator:
+    """
+    Backend generating sensor values and recording actuator writes.
+
+    Args:
+        latency_s (float): mean read latency, 0 reads instantly
+        latency_jitter_s (float): latency is uniform in latency_s +/- jitter
+        failure_rate (float): probability that a read raises SimulatedReadError
+        time_scale (float): simulated seconds per real second, e.g. 3600 runs a
+            day in 24 seconds
+        seed (int): random seed for noise, latency and failures
+        signals (dict): overrides of SIGNALS
+    """
+    def __init__(self, latency_s=0.0, latency_jitter_s=0.0, failure_rate=0.0, time_scale=1.0, seed=None, signals=None):
+        self.latency_s = latency_s
+        self.latency_jitter_s = latency_jitter_s
+        self.failure_rate = failure_rate
+        self.time_scale = time_scale
+        self.signals = dict(SIGNALS)
+        self.signals.update(signals or {})
+        self.random = random.Random(seed)
+        self.started = time.time()
+        self.states = {} # actuator device key -> last written data
+        self.reads = 0
+        self.failures = 0
+        self.writes = 0
+        self._lock = threading.Lock()
+
+    def now(self):
+        # simulated epoch seconds
+        return self.started + (time.time() - self.started) * self.time_scale
+
+    def value(self, metric, t, key):
+        mean, amplitude, peak_hour, noise, low, high = self.signals[metric]
+        # stable per device offsets so identical sensors still differ
+        h = zlib.crc32(f'{key}:{metric}'.encode())
+        phase = (h % 60) / 60 - 0.5 # +/- 30 minutes
+        offset = ((h >> 8) % 1000 / 1000 - 0.5) * noise * 4
+        hour = (t % 86400) / 3600
+        cycle = math.cos((hour - peak_hour - phase) * math.pi / 12)
+        with self._lock:
+            value = mean + offset + amplitude * cycle + self.random.gauss(0, noise)
+        return min(max(value, low), high)
+
+    def read(self, device_path):
+        """Values for the chip in device_path, after the simulated latency."""
+        with self._lock:
+            self.reads += 1
+            latency = max(0.0, self.latency_s + self.random.uniform(-self.latency_jitter_s, self.latency_jitter_s))
+            failed = self.random.random() < self.failure_rate
+        if latency:
+            time.sleep(latency)
+        if failed:
+            with self._lock:
+                self.failures += 1
+            raise SimulatedReadError(f'simulated read failure {device_path}')
+
+        t = self.now()
+        key = device_key(device_path)
+        data = {metric: self.value(metric, t, key) for metric in CHIPS.get(device_path.get('chip'), ['temp'])}
+        data['ts'] = datetime.fromtimestamp(t, timezone.utc).strftime('%Y-%m-%d:%H:%M:%S.%fZ')
+        return data
+
+    def write(self, device_path, data):
+        with self._lock:
+            self.writes += 1
+            self.states[device_key(device_path)] = data
+        return data
+
+    def stats(self):
+        return {"reads": self.reads, "failures": self.failures, "writes": self.writes}
+
+
+def device_key(device_path):
+    return ':'.join(f'{k}={device_path[k]}' for k in sorted(device_path))
+
+
+def load_simulator(path_config=path_config_simulator, **kwargs):
+    """Simulator configured from config/simulator.yaml, kwargs take precedence."""
+    config = dict(load_yaml(path_config)['simulator'])
+    signals = config.pop('signals', None) or {}
+    config['signals'] = {metric: tuple(values) for metric, values in signals.items()}
+    config.update(kwargs)
+    return Simulator(**config)
+
+
+class VirtualSensor(Sensor):
+    """Sensor with an arbitrary type and device path, read from the backend."""
+    def __init__(self, sensor_type, device_path):
+        super().__init__({"type": sensor_type})
+        self.sensor_type = sensor_type
+        self.device_path = device_path
+
+    def measure(self):
+        data = read_gpio(self.device_path)
+        self.last_reading = data
+        return data
+
+
+def make_virtual_sensors(count, buses=None):
+    """
+    count sensors cycling through SENSOR_CHIPS, each on its own simulated
+    GPIO pin unless buses is given, in which case sensor i is on 1-Wire bus
+    i % buses (sensors on one bus are read one after another by the sweep).
+    """
+    sensors = []
+    types = list(SENSOR_CHIPS)
+    for i in range(count):
+        sensor_type = types[i % len(types)]
+        if buses:
+            device_path = {"connection": "onewire", "bus": f'sim{i % buses}', "index": i}
+        else:
+            device_path = {"connection": "gpio", "pin": i}
+        device_path['chip'] = SENSOR_CHIPS[sensor_type]
+        sensors.append(VirtualSensor(f'{sensor_type}_{i}', device_path))
+    return sensors
@@ -0,0 +1,125 @@
+# Concurrent sensor sweep.
+#
+# Most of a sweep is spent waiting: DHT bit timing, TSL2591 integration time,
+# HC-SR04 echo. Sensors on independent buses can wait at the same time, so
+# sensors are grouped by bus_key() and every group is read on its own thread.
+# Sensors sharing a bus stay sequential within their group. The sweep takes
+# roughly as long as its slowest group instead of the sum of every sensor.
+# The sensors of an upstream I2C bus, behind any of its mux channels, are one
+# group read with a single I2CBusManager.read_batch() so every channel is
+# selected once per sweep.
+#
+# readings = sweep(sensors)['readings']
+# add_sensor_readings(readings)
+
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import devices
+from devices import bus
+from utils import logger
+
+
+def bus_key(device_path):
+    """
+    Key of the bus a device is on. Devices with the same key are never read
+    concurrently.
+
+    i2c: the upstream bus number, every TCA9548A channel on it shares the
+        upstream SDA/SCL and its lock (see the I2C bus manager)
+    gpio: the pin, DHT and HC-SR04 each own their pins
+    onewire: the bus master, every probe on it shares one wire
+    """
+    connection = device_path.get('connection')
+    if connection == 'i2c':
+        return ('i2c', device_path.get('bus', 1))
+    if connection == 'gpio':
+        return ('gpio', device_path.get('pin'))
+    if connection == 'onewire':
+        return ('onewire', device_path.get('bus'))
+    # unknown connection types are serialized together
+    return (connection,)
+
+
+def group_by_bus(sensors):
+    groups = defaultdict(list)
+    for sensor in sensors:
+        groups[bus_key(sensor.device_path)].append(sensor)
+    return groups
+
+
+def batch_readable(sensors):
+    # I2C chips the bus manager has drivers for, on real hardware
+    return (
+        devices.backend is None
+        and all(s.device_path.get('connection') == 'i2c' and s.device_path.get('chip') in bus.DRIVERS for s in sensors)
+        and bus.hardware_available()
+    )
+
+
+def read_batch(sensors):
+    manager = bus.get_bus(sensors[0].device_path.get('bus', 1))
+    start = time.perf_counter()
+    values = manager.read_batch([sensor.device_path for sensor in sensors])
+    # the batch holds the bus throughout, share its time evenly
+    seconds = (time.perf_counter() - start) / len(sensors)
+    results = []
+    for sensor, data in zip(sensors, values):
+        if isinstance(data, Exception):
+            results.append((sensor, None, str(data), seconds))
+        else:
+            sensor.last_reading = data
+            results.append((sensor, data, None, seconds))
+    return results
+
+
+def read_group(sensors):
+    if batch_readable(sensors):
+        return read_batch(sensors)
+    results = []
+    for sensor in sensors:
+        start = time.perf_counter()
+        try:
+            data = sensor.measure()
+            error = None
+        except Exception as e:
+            logger.error(f'sweep: {sensor.sensor_type} failed: {e}')
+            data, error = None, str(e)
+        results.append((sensor, data, error, time.perf_counter() - start))
+    return results
+
+
+def sweep(sensors, max_workers=None):
+    """
+    Read sensors concurrently, one thread per bus.
+
+    A failing sensor does not stop the sweep, it is reported in 'errors'.
+
+    Args:
+        sensors (list): Sensor instances with device_path and measure()
+        max_workers (int): thread limit, defaults to one per bus
+
+    Returns:
+        dict: 'readings' as (sensor_type, data) tuples ready for
+            add_sensor_readings(), 'errors' (sensor_type -> message),
+            'timings' (sensor_type -> seconds) and 'seconds' for the sweep
+    """
+    start = time.perf_counter()
+    groups = group_by_bus(sensors)
+    report = {"readings": [], "errors": {}, "timings": {}, "seconds": 0.0}
+    if not groups:
+        return report
+
+    # created per sweep, RQ runs each job in a fresh work horse
+    with ThreadPoolExecutor(max_workers=max_workers or len(groups), thread_name_prefix='sweep') as executor:
+        for results in executor.map(read_group, groups.values()):
+            for sensor, data, error, seconds in results:
+                report['timings'][sensor.sensor_type] = seconds
+                if error is not None:
+                    report['errors'][sensor.sensor_type] = error
+                elif data:
+                    report['readings'].append((sensor.sensor_type, data))
+
+    report['seconds'] = time.perf_counter() - start
+    return report
@@ -0,0 +1,163 @@
+# Binary wire format for sensor readings sent by nodes to the manager.
+#
+# A reading as JSON, {"temp": 21.5, "humidity": 40.2, "ts": "2025-04-01:..."},
+# is about 80 bytes and a string timestamp to parse. As a record it is
+# 13 + 4 bytes per value, little endian:
+#
+#   magic u8 0xA7 | version u8 | count u8 | sensor u16 | ts int64 epoch ms | count x float32
+#
+# sensor is a number from SCHEMA (or the node's own table), which names the
+# sensor and its metrics, so no names travel with each reading. Missing
+# values are sent as NaN. Records can be concatenated, e.g. one sweep per
+# UDP datagram, and are read back with decode_batch().
+#
+# Only uses struct so the same file runs on CircuitPython: copy it to
+# CIRCUITPY/lib on the node, see nodes/mcu/firmware/circuitpython.
+#
+# buf = encode(SOIL_MOISTURE, ts_ms, [41.2])
+# sensor, ts_ms, values = decode(buf)
+# add_sensor_readings(to_readings(decode_batch(datagram)))
+
+import struct
+
+try:
+    Struct = struct.Struct
+except AttributeError:
+    # CircuitPython's struct only has the module functions
+    class Struct:
+        def __init__(self, format):
+            self.format = format
+            self.size = struct.calcsize(format)
+
+        def pack_into(self, buffer, offset, *values):
+            struct.pack_into(self.format, buffer, offset, *values)
+
+        def unpack_from(self, buffer, offset=0):
+            return struct.unpack_from(self.format, buffer, offset)
+
+
+MAGIC = 0xA7
+VERSION = 1
+HEADER = Struct('<BBBHq')
+HEADER_SIZE = HEADER.size # 13
+MAX_VALUES = 255
+
+# sensor number -> (sensor_id, metrics in the order of the values)
+AIR_TEMP_HUMIDITY = 1
+AIR_TEMP_HUMIDITY_BAROMETER = 2
+SOIL_TEMP = 3
+SOIL_MOISTURE = 4
+LIGHT_FULLSPECTRUM = 5
+WATER_LEVEL = 6
+
+SCHEMA = {
+    AIR_TEMP_HUMIDITY: ('air_temp_humidity', ('temp', 'humidity')),
+    AIR_TEMP_HUMIDITY_BAROMETER: ('air_temp_humidity_barometer', ('temp', 'humidity', 'pressure', 'altitude')),
+    SOIL_TEMP: ('soil_temp', ('temp',)),
+    SOIL_MOISTURE: ('soil_moisture', ('moisture',)),
+    LIGHT_FULLSPECTRUM: ('light_fullspectrum', ('light_total', 'light_ir', 'light_visible', 'light_fullspectrum')),
+    WATER_LEVEL: ('water_level', ('distance',)),
+}
+
+# count -> struct of the values, built once per count
+_values = {}
+
+
+def values_struct(count):
+    s = _values.get(count)
+    if s is None:
+        s = _values[count] = Struct('<%df' % count)
+    return s
+
+
+def record_size(count):
+    return HEADER_SIZE + 4 * count
+
+
+def encode_into(buffer, offset, sensor, ts_ms, values):
+    """
+    Write one record into a preallocated buffer, no allocation on the node.
+
+    Returns:
+        int: offset after the record
+    """
+    count = len(values)
+    if count > MAX_VALUES:
+        raise ValueError('at most %d values per record' % MAX_VALUES)
+    HEADER.pack_into(buffer, offset, MAGIC, VERSION, count, sensor, ts_ms)
+    values_struct(count).pack_into(buffer, offset + HEADER_SIZE, *values)
+    return offset + record_size(count)
+
+
+def encode(sensor, ts_ms, values):
+    """One record as bytes."""
+    buffer = bytearray(record_size(len(values)))
+    encode_into(buffer, 0, sensor, ts_ms, values)
+    return bytes(buffer)
+
+
+def encode_batch(records):
+    """Concatenate (sensor, ts_ms, values) records into one buffer."""
+    buffer = bytearray(sum(record_size(len(values)) for _, _, values in records))
+    offset = 0
+    for sensor, ts_ms, values in records:
+        offset = encode_into(buffer, offset, sensor, ts_ms, values)
+    return bytes(buffer)
+
+
+def decode_from(buffer, offset=0):
+    """
+    Read the record at offset.
+
+    Returns:
+        tuple: ((sensor, ts_ms, values tuple), offset after the record)
+    """
+    if len(buffer) - offset < HEADER_SIZE:
+        raise ValueError('truncated record header at %d' % offset)
+    magic, version, count, sensor, ts_ms = HEADER.unpack_from(buffer, offset)
+    if magic != MAGIC:
+        raise ValueError('bad magic 0x%02x at %d' % (magic, offset))
+    if version != VERSION:
+        raise ValueError('unsupported record version %d' % version)
+    end = offset + record_size(count)
+    if len(buffer) < end:
+        raise ValueError('truncated record at %d' % offset)
+    values = values_struct(count).unpack_from(buffer, offset + HEADER_SIZE)
+    return (sensor, ts_ms, values), end
+
+
+def decode(buffer):
+    record, _ = decode_from(buffer)
+    return record
+
+
+def decode_batch(buffer):
+    """All records of a buffer written by encode_batch() or concatenated encode()s."""
+    records = []
+    offset = 0
+    while offset < len(buffer):
+        record, offset = decode_from(buffer, offset)
+        records.append(record)
+    return records
+
+
+def to_readings(records, schema=None):
+    """
+    Decoded records as (sensor_id, raw_data) for datastore.add_sensor_readings(),
+    NaN values are dropped. Sensors not in the schema are named sensor_<n>
+    with metrics values.0, values.1, ... like read_gpio() data.
+    """
+    schema = SCHEMA if schema is None else schema
+    readings = []
+    for sensor, ts_ms, values in records:
+        if sensor in schema:
+            sensor_id, metrics = schema[sensor]
+        else:
+            sensor_id, metrics = 'sensor_%d' % sensor, ()
+        raw_data = {"ts": ts_ms}
+        for i, value in enumerate(values):
+            if value != value: # NaN
+                continue
+            raw_data[metrics[i] if i < len(metrics) else 'values.%d' % i] = value
+        readings.append((sensor_id, raw_data))
+    return readings
@@ -0,0 +1,36 @@
+# JPEG header and reduced decoding helpers, shared by datastore/photos.py and
+# copilot/vision/batch.py. Only the standard library and OpenCV, importing
+# this module sets up no engines or logging, so pool processes stay light.
+#
+# libjpeg scales by 1/2, 1/4 or 1/8 while decoding, several times cheaper
+# than a full decode followed by a resize.
+# https://docs.opencv.org/4.x/d8/d6a/group__imgcodecs__flags.html
+#
+# flag = reduced_flag(jpeg_size(path)[0], 640)
+# image = cv2.imread(path, flag)
+
+
+def jpeg_size(filepath):
+    # (width, height) from the SOF marker without decoding, None if not found
+    with open(filepath, 'rb') as f:
+        data = f.read(65536)
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            i += 1
+            continue
+        marker = data[i + 1]
+        length = int.from_bytes(data[i + 2:i + 4], 'big')
+        if marker in (0xC0, 0xC1, 0xC2):
+            return int.from_bytes(data[i + 7:i + 9], 'big'), int.from_bytes(data[i + 5:i + 7], 'big')
+        i += 2 + length
+    return None
+
+
+def reduced_flag(pixels, target):
+    # largest libjpeg reduction that still leaves at least `target` of `pixels`
+    import cv2
+    for factor, flag in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)):
+        if pixels // factor >= target:
+            return flag
+    return cv2.IMREAD_COLOR
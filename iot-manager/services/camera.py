@@ -1,6 +1,16 @@
+import argparse
+import json
+import os
 import subprocess
 import pathlib
-from datetime import datetime, timezone
+import tempfile
+import threading
+import time
+import uuid
+
+from redis.exceptions import RedisError
+
+from utils import base_dir, logger
 # v4l2-ctl list devices
 # Output: cedrus (platform:cedrus):
 # 	/dev/video0
@@ -15,7 +25,298 @@ from datetime import datetime, timezone
 # [video4linux2,v4l2 @ 0xaaaab2fa08c0] Compressed:       mjpeg :          Motion-JPEG : 640x480 320x240 352x288 640x480 800x600 1280x720 1920x1080 1600x1200 2048x1536 2592x1944
 # [video4linux2,v4l2 @ 0xaaaab2fa08c0] Raw       :     yuyv422 :           YUYV 4:2:2 : 640x480 320x240 352x288 640x480 800x600 1280x720 1920x1080 1600x1200 2048x1536 2592x1944
 
-path_store_photos = pathlib.Path('photos')
+# Capture without fswebcam: a CameraStream keeps the device open in MJPEG
+# mode, so format negotiation and auto exposure happen once per open instead
+# of once per photo. With CAP_PROP_CONVERT_RGB off OpenCV hands back the
+# compressed frame as delivered by the camera, which is written to disk
+# as is, no decode and re-encode.
+# https://docs.opencv.org/4.x/d4/d15/group__videoio__flags__base.html
+#
+# A stream only stays open as long as its process. RQ work horses exit after
+# every job, so the long lived capture service owns the streams:
+#
+# python -m services.camera /dev/video1 --resolution 2592x1944 --interval 10
+#
+# CameraUSB.photo() asks the service through Redis when it is running and
+# opens the device itself otherwise.
+
+# requests are JSON {id, device_path} on this list, replies go to reply_key + id
+requests_key = 'iot:camera:requests'
+reply_key = 'iot:camera:reply:'
+# refreshed by the service while it runs
+alive_key = 'iot:camera:alive'
+ALIVE_TTL_S = 5
+
+
+def parse_resolution(resolution):
+    width, height = str(resolution).lower().split('x')
+    return int(width), int(height)
+
+
+def open_v4l2(device_path, resolution, fps=None):
+    import cv2
+    capture = cv2.VideoCapture(device_path, cv2.CAP_V4L2)
+    if not capture.isOpened():
+        raise IOError(f'cannot open camera {device_path}')
+    width, height = parse_resolution(resolution)
+    # the fourcc goes first, the sizes the camera offers depend on it
+    capture.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+    capture.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+    capture.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+    if fps:
+        capture.set(cv2.CAP_PROP_FPS, fps)
+    # keep only the newest frame queued, a capture never gets a stale one
+    capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    capture.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+    return capture
+
+
+def to_jpeg(frame):
+    # raw MJPEG comes back as one row of bytes; backends that ignore
+    # CONVERT_RGB return a decoded image, which has to be encoded again
+    if frame.ndim == 1 or frame.shape[0] == 1:
+        data = frame.tobytes()
+        if data[:2] == b'\xff\xd8':
+            return data
+    import cv2
+    ok, encoded = cv2.imencode('.jpg', frame)
+    if not ok:
+        raise IOError('cannot encode frame')
+    return encoded.tobytes()
+
+
+class CameraStream:
+    """
+    An open V4L2 camera delivering JPEG frames.
+
+    Without start() every capture() grabs a frame itself. After start() a
+    thread keeps dequeuing frames so the sensor keeps exposing and the driver
+    queue stays fresh, and capture() returns the next frame it grabs.
+
+    Args:
+        device_path (str): e.g. '/dev/video1'
+        resolution (str): e.g. '2592x1944'
+        fps (int): requested frame rate, None keeps the camera's default
+        warmup_frames (int): frames dropped after opening while auto
+            exposure settles
+        open_capture: called with (device_path, resolution, fps), returns a
+            cv2.VideoCapture like object, defaults to open_v4l2
+    """
+    def __init__(self, device_path, resolution='2592x1944', fps=None, warmup_frames=5, open_capture=open_v4l2):
+        self.device_path = device_path
+        self.resolution = resolution
+        self.capture_device = open_capture(device_path, resolution, fps)
+        for _ in range(warmup_frames):
+            self.capture_device.grab()
+        self.frames = 0
+        self.captures = 0
+        self.errors = 0
+        self._condition = threading.Condition()
+        self._pending = 0
+        self._seq = 0
+        self._frame = None
+        self._thread = None
+        self._stopped = False
+
+    def _retrieve(self):
+        ok, frame = self.capture_device.retrieve()
+        if not ok or frame is None:
+            raise IOError(f'no frame from {self.device_path}')
+        return time.time(), to_jpeg(frame)
+
+    def _run(self):
+        while not self._stopped:
+            if not self.capture_device.grab():
+                self.errors += 1
+                time.sleep(0.1)
+                continue
+            with self._condition:
+                self.frames += 1
+                if self._pending:
+                    # only requested frames leave the driver's buffer
+                    try:
+                        self._frame = self._retrieve()
+                    except IOError as e:
+                        logger.error(f'CameraStream {e}')
+                        self._frame = e
+                    self._pending = 0
+                    self._seq += 1
+                    self._condition.notify_all()
+
+    def start(self):
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name=f'camera {self.device_path}', daemon=True)
+        self._thread.start()
+        return self
+
+    def capture(self, timeout_s=5.0):
+        """
+        A frame taken after the call.
+
+        Returns:
+            tuple: (epoch seconds, JPEG bytes)
+        """
+        self.captures += 1
+        if self._thread is None:
+            with self._condition:
+                if not self.capture_device.grab():
+                    raise IOError(f'no frame from {self.device_path}')
+                return self._retrieve()
+
+        with self._condition:
+            seq = self._seq
+            self._pending += 1
+            if not self._condition.wait_for(lambda: self._seq != seq, timeout_s):
+                raise TimeoutError(f'no frame from {self.device_path} in {timeout_s}s')
+            frame = self._frame
+        if isinstance(frame, Exception):
+            raise frame
+        return frame
+
+    def photo(self, photo_filepath=None, zone=None, store=None):
+        """
+        capture() written to photo_filepath, by default into the photo store
+        (datastore.photos.PhotoStore).
+
+        Returns:
+            str: path of the photo
+        """
+        ts, data = self.capture()
+        if photo_filepath is None:
+            if store is None:
+                from datastore.photos import photo_store
+                store = photo_store()
+            _, path, _ = store.put(data, device_path=self.device_path, zone=zone, ts=int(ts * 1000), resolution=self.resolution)
+            return path
+        photo_filepath = pathlib.Path(photo_filepath)
+        photo_filepath.parent.mkdir(parents=True, exist_ok=True)
+        photo_filepath.write_bytes(data)
+        return str(photo_filepath)
+
+    def stats(self):
+        return {"frames": self.frames, "captures": self.captures, "errors": self.errors}
+
+    def close(self):
+        self._stopped = True
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.capture_device.release()
+
+
+class CaptureService:
+    """
+    Owns one CameraStream per device, takes time-lapse photos every
+    interval_s and serves photo requests from other processes.
+
+    Args:
+        cameras (dict): device path -> resolution
+        interval_s (float): time-lapse period, None only serves requests
+        connection: Redis connection for requests, defaults to queues.r
+        store: datastore.photos.PhotoStore for the time-lapse photos,
+            defaults to photo_store()
+        pipeline: datastore.photos.PhotoPipeline for the time-lapse photos,
+            photos taken on request are recorded by the requester
+        zones (dict): device path -> zone of its photos
+    """
+    def __init__(self, cameras, interval_s=None, connection=None, store=None, pipeline=None, zones=None, **stream_kwargs):
+        self.streams = {device_path: CameraStream(device_path, resolution, **stream_kwargs).start()
+                        for device_path, resolution in cameras.items()}
+        self.interval_s = interval_s
+        self.connection = connection
+        if store is None and interval_s:
+            from datastore.photos import photo_store
+            store = photo_store()
+        self.store = store
+        self.pipeline = pipeline
+        self.zones = zones or {}
+        self._stopped = threading.Event()
+        self._threads = []
+
+    def _timelapse(self, stream):
+        # fixed schedule, a slow capture does not shift the following ones
+        next_time = time.monotonic()
+        while not self._stopped.is_set():
+            try:
+                ts, data = stream.capture()
+                _, photo_filepath, stored = self.store.put(
+                    data, device_path=stream.device_path, zone=self.zones.get(stream.device_path),
+                    ts=int(ts * 1000), resolution=stream.resolution,
+                )
+                # a frame identical to a stored one was processed already
+                if stored and self.pipeline is not None:
+                    self.pipeline.submit(photo_filepath)
+            except (IOError, TimeoutError) as e:
+                logger.error(f'timelapse {stream.device_path} failed: {e}')
+            next_time += self.interval_s
+            now = time.monotonic()
+            if next_time < now:
+                # skip the slots that were missed
+                next_time += (now - next_time) // self.interval_s * self.interval_s + self.interval_s
+            self._stopped.wait(next_time - now)
+
+    def start(self):
+        if self.interval_s:
+            for stream in self.streams.values():
+                thread = threading.Thread(target=self._timelapse, args=(stream,), daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        return self
+
+    def serve(self):
+        """Answer request_photo() calls until stop()."""
+        if self.connection is None:
+            import services.queues as queues
+            self.connection = queues.r
+        while not self._stopped.is_set():
+            self.connection.set(alive_key, json.dumps(list(self.streams)), ex=ALIVE_TTL_S)
+            request = self.connection.blpop([requests_key], timeout=1)
+            if request is None:
+                continue
+            request = json.loads(request[1])
+            stream = self.streams.get(request['device_path'])
+            try:
+                if stream is None:
+                    raise IOError(f'{request["device_path"]} is not served')
+                reply = {"filepath": stream.photo(request.get('filepath'), zone=self.zones.get(stream.device_path), store=self.store)}
+            except (IOError, TimeoutError) as e:
+                reply = {"error": str(e)}
+            with self.connection.pipeline() as pipe:
+                pipe.rpush(reply_key + request['id'], json.dumps(reply))
+                pipe.expire(reply_key + request['id'], 60)
+                pipe.execute()
+
+    def stop(self):
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join()
+        for stream in self.streams.values():
+            stream.close()
+
+
+def request_photo(device_path, filepath=None, timeout_s=10, connection=None):
+    """
+    Photo from the capture service.
+
+    Returns:
+        str: path of the photo, None if no service serves device_path
+    """
+    if connection is None:
+        import services.queues as queues
+        connection = queues.r
+    served = connection.get(alive_key)
+    if served is None or device_path not in json.loads(served):
+        return None
+    request_id = uuid.uuid4().hex
+    connection.rpush(requests_key, json.dumps({"id": request_id, "device_path": device_path, "filepath": filepath}))
+    reply = connection.blpop([reply_key + request_id], timeout=timeout_s)
+    if reply is None:
+        raise TimeoutError(f'capture service did not answer for {device_path} in {timeout_s}s')
+    reply = json.loads(reply[1])
+    if 'error' in reply:
+        raise IOError(reply['error'])
+    return reply['filepath']
+
 
 class CameraUSB:
     def __init__(self, device_path, format):
@@ -23,81 +324,268 @@ class CameraUSB:
         self.format = format # '2592x1944'
     
     def photo(self):
-        # fswebcam -r 1280x720 -d "/dev/video1" webcam.jpg
-        photo_filepath = get_photo_filepath(self)
-        result = subprocess.run(['fswebcam', '-r', self.format, '-d', self.device_path, photo_filepath ], capture_output=True, text=True)
-        print("Return code:", result.returncode)
-        print("Output:", result.stdout)
-        print("Error:", result.stderr)
+        # the capture service has the device open already, otherwise open it for this photo
+        try:
+            photo_filepath = request_photo(self.device_path) or self.photo_local()
+        except (ConnectionError, RedisError) as e:
+            # Redis down or refusing, the camera itself may still work
+            logger.error(f'capture service unreachable: {e}')
+            photo_filepath = self.photo_local()
 
         return photo_filepath, self.device_path, self.format
 
-def get_photo_filepath(camera:CameraUSB):
-    now = datetime.now(timezone.utc).strftime('%Y-%m-%d:%H:%M:%S.%fZ')
-    return f"{path_store_photos}/{camera.device_path.replace('/','-')}_{camera.format}_{now}.jpg"
+    def photo_local(self):
+        stream = CameraStream(self.device_path, self.format)
+        try:
+            return stream.photo()
+        finally:
+            stream.close()
 
 
-def find_cameras():
-    result = subprocess.run(['v4l2-ctl', '--list-devices'], capture_output=True, text=True)
-    print("Return code:", result.returncode)
-    print("Output:", result.stdout)
-    print("Error:", result.stderr)
-    
-    # """USB Cam: USB Cam (usb-5200000.usb-1.2): 
-    #  /dev/video1"""
+# Camera registry: which V4L2 devices are USB cameras, read from sysfs (a few
+# file reads, no subprocess), and the formats and resolutions each camera
+# offers, probed once per camera with v4l2-ctl and cached in
+# data/cameras.json under the camera's USB port path and serial. Device
+# numbers change between boots and hotplugs, port and serial do not, so a
+# re-plugged camera is not probed again. The cache is rebuilt when ttl_s
+# expires or, with pyudev installed and watch() called, on hotplug.
+# https://www.kernel.org/doc/html/latest/admin-guide/abi-stable.html#abi-sys-class-video4linux
 
-    device_paths = extract_usb_cam_device(result.stdout)
-    print(device_paths)  # Should print: /dev/video1
+path_sysfs_video = pathlib.Path('/sys/class/video4linux')
+path_camera_cache = pathlib.Path(*[base_dir, 'data', 'cameras.json'])
+CAMERA_TTL_S = 24 * 60 * 60
 
 
-def get_camera_formats():
-    result = subprocess.run(['ffmpeg', '-f', 'v4l2', '-list_formats', 'all', '-i', '/dev/video1'], capture_output=True, text=True)
-    print("Return code:", result.returncode)
-    print("Output:", result.stdout)
-    print("Error:", result.stderr)
-    
-    # Test with sample input
-    # sample_text = "[video4linux2,v4l2 @ 0xaaaab2fa08c0] Compressed:       mjpeg :          Motion-JPEG : 640x480 320x240 352x288 640x480 800x600 1280x720 1920x1080 1600x1200 2048x1536 2592x1944"
-    highest_resolution = extract_last_resolution(result.stdout)
-    print(highest_resolution)  # Should print: 2592x1944
-    
-    return highest_resolution
+def read_sysfs(path):
+    try:
+        return path.read_text().strip()
+    except OSError:
+        return None
+
+
+def scan_sysfs(root=path_sysfs_video):
+    """
+    USB capture devices under /sys/class/video4linux.
+
+    Returns:
+        list: dicts with device_path, name, usb_path (e.g. '1-1.2'), serial,
+            vendor and product ids
+    """
+    cameras = []
+    root = pathlib.Path(root)
+    if not root.exists():
+        return cameras
+    for node in sorted(root.iterdir(), key=lambda p: (len(p.name), p.name)):
+        # UVC cameras also register a metadata node with index 1
+        if read_sysfs(node / 'index') not in (None, '0'):
+            continue
+        # device -> the USB interface, its parent is the USB device
+        usb_device = (node / 'device').resolve().parent
+        vendor = read_sysfs(usb_device / 'idVendor')
+        if vendor is None:
+            continue
+        cameras.append({
+            "device_path": f'/dev/{node.name}',
+            "name": read_sysfs(node / 'name'),
+            "usb_path": usb_device.name,
+            "serial": read_sysfs(usb_device / 'serial'),
+            "vendor": vendor,
+            "product": read_sysfs(usb_device / 'idProduct'),
+        })
+    return cameras
+
 
+def probe_formats(device_path):
+    """{fourcc: [resolutions]} of a device, from v4l2-ctl --list-formats-ext, {} without v4l2-ctl."""
+    try:
+        result = subprocess.run(['v4l2-ctl', '-d', device_path, '--list-formats-ext'], capture_output=True, text=True, timeout=10)
+    except FileNotFoundError:
+        logger.error('probe_formats: v4l2-ctl not found, sudo apt install v4l-utils')
+        return {}
+    if result.returncode != 0:
+        logger.error(f'probe_formats {device_path}: {result.stderr.strip()}')
+    return parse_formats(result.stdout)
 
-def extract_last_resolution(text):
-    # Find all resolution patterns in the format NNNNxNNNN
+
+def parse_formats(text):
+    #   [0]: 'MJPG' (Motion-JPEG, compressed)
+    #           Size: Discrete 2592x1944
     import re
-    resolution_pattern = r'(\d+x\d+)'
-    resolutions = re.findall(resolution_pattern, text)
-    if resolutions:
-        return resolutions[-1]
-    else:
+    formats = {}
+    fourcc = None
+    for line in text.splitlines():
+        match = re.search(r"\[\d+\]: '(\w+)'", line)
+        if match:
+            fourcc = match.group(1)
+            formats[fourcc] = []
+            continue
+        match = re.search(r'Size: \w+ (\d+x\d+)', line)
+        if match and fourcc is not None and match.group(1) not in formats[fourcc]:
+            formats[fourcc].append(match.group(1))
+    return formats
+
+
+def camera_key(camera):
+    return f'{camera["usb_path"]}|{camera["serial"] or ""}'
+
+
+def largest_resolution(resolutions):
+    if not resolutions:
         return None
+    return max(resolutions, key=lambda r: parse_resolution(r)[0] * parse_resolution(r)[1])
 
 
-# USB Camera board from Aliepxress
-target_camera_devices = "USB Cam: USB Cam (usb-5200000.usb-1.2):"
+class CameraRegistry:
+    """
+    Cached USB cameras and their formats, shared by processes through a
+    JSON file.
 
-def extract_usb_cam_device(text):
-    device_paths = []
-    lines = text.splitlines()
-    for i in range(len(lines)):
-        if target_camera_devices in lines[i]:
-            # Look at subsequent lines for first non-whitespace line
-            if lines[i+1].strip():
-                    device_paths.append({
-                        "name": target_camera_devices,
-                        "path": lines[i+1].strip()
-                        })
-        
-    return device_paths
+    Args:
+        ttl_s (float): age after which the cache is rebuilt
+        path: cache file, None keeps it in memory only
+        sysfs: /sys/class/video4linux, for tests
+        probe: called with a device path, returns {fourcc: [resolutions]}
+    """
+    def __init__(self, ttl_s=CAMERA_TTL_S, path=path_camera_cache, sysfs=path_sysfs_video, probe=probe_formats):
+        self.ttl_s = ttl_s
+        self.path = pathlib.Path(path) if path else None
+        self.sysfs = sysfs
+        self.probe = probe
+        self.lock = threading.RLock()
+        self.cache = None
+        self.observer = None
 
+    def _load(self):
+        if self.path is None or not self.path.exists():
+            return None
+        try:
+            return json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            return None
+
+    def _save(self, cache):
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # a temporary file of our own, other processes may save at the same time
+        fd, tmp = tempfile.mkstemp(dir=self.path.parent, prefix='.cameras-')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(cache, f)
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def _fresh(self, cache):
+        return cache is not None and time.time() - cache['scanned_at'] < self.ttl_s
+
+    def _scan(self, cache):
+        cameras = scan_sysfs(self.sysfs)
+        # formats of cameras still plugged in are kept until their own TTL
+        now = time.time()
+        formats = (cache or {}).get('formats', {})
+        keys = {camera_key(c) for c in cameras}
+        return {
+            "scanned_at": now,
+            "cameras": cameras,
+            "formats": {k: v for k, v in formats.items() if k in keys and now - v['probed_at'] < self.ttl_s},
+        }
+
+    def _current(self, rescan=False):
+        with self.lock:
+            if rescan or not self._fresh(self.cache):
+                cache = self._load()
+                if rescan or not self._fresh(cache):
+                    cache = self._scan(cache or self.cache)
+                    self._save(cache)
+                self.cache = cache
+            return self.cache
+
+    def cameras(self):
+        """Connected USB cameras, see scan_sysfs()."""
+        return list(self._current()['cameras'])
+
+    def find(self, usb_path=None, serial=None, device_path=None):
+        """First camera matching the given keys, None if there is none."""
+        for camera in self.cameras():
+            if usb_path and camera['usb_path'] != usb_path:
+                continue
+            if serial and camera['serial'] != serial:
+                continue
+            if device_path and camera['device_path'] != device_path:
+                continue
+            return camera
+        return None
+
+    def formats(self, camera):
+        """{fourcc: [resolutions]} of a camera, probed on first use."""
+        key = camera_key(camera)
+        with self.lock:
+            cache = self._current()
+            if key not in cache['formats']:
+                cache['formats'][key] = {"probed_at": time.time(), "formats": self.probe(camera['device_path'])}
+                self._save(cache)
+            return cache['formats'][key]['formats']
+
+    def best_resolution(self, camera, fourcc='MJPG'):
+        return largest_resolution(self.formats(camera).get(fourcc))
+
+    def invalidate(self):
+        """Mark the device list stale, the next call scans sysfs again."""
+        with self.lock:
+            cache = self.cache or self._load()
+            if cache is not None:
+                cache['scanned_at'] = 0
+                self._save(cache)
+            self.cache = cache
+
+    def refresh(self):
+        return list(self._current(rescan=True)['cameras'])
+
+    def watch(self):
+        """Invalidate on video4linux hotplug events, needs pyudev. Returns False without it."""
+        try:
+            import pyudev
+        except ImportError:
+            logger.info('pyudev not installed, camera registry refreshes on its TTL only')
+            return False
+        if self.observer is None:
+            monitor = pyudev.Monitor.from_netlink(pyudev.Context())
+            monitor.filter_by(subsystem='video4linux')
+            self.observer = pyudev.MonitorObserver(monitor, callback=lambda device: self.invalidate(), name='camera hotplug')
+            self.observer.start()
+        return True
+
+
+_registry = None
+
+
+def camera_registry():
+    """The process wide CameraRegistry."""
+    global _registry
+    if _registry is None:
+        _registry = CameraRegistry()
+    return _registry
+
+
+def find_cameras():
+    cameras = camera_registry().cameras()
+    logger.info(f'find_cameras {cameras}')
+    return cameras
+
+
+def get_camera_formats(device_path='/dev/video1'):
+    # largest MJPEG resolution, probed once per camera
+    registry = camera_registry()
+    camera = registry.find(device_path=device_path)
+    if camera is None:
+        return None
+    return registry.best_resolution(camera)
 
-    
 
 def get_cameras():
-    print('get_cameras')
-    return []
+    return [CameraUSB(c['device_path'], get_camera_formats(c['device_path']) or '2592x1944') for c in find_cameras()]
 
 def take_photo(camera):
     print('photo taken by '+ camera)
@@ -106,4 +594,38 @@ def take_photo(camera):
 def test():
     # find_cameras()
     c = CameraUSB('/dev/video1','2592x1944')
-    c.photo()
\ No newline at end of file
+    c.photo()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Capture service: keeps cameras open, takes time-lapse photos and serves photo requests')
+    parser.add_argument('devices', nargs='+', help='V4L2 devices, e.g. /dev/video1')
+    parser.add_argument('--resolution', type=str, default='2592x1944', help='MJPEG resolution (default: 2592x1944)')
+    parser.add_argument('--fps', type=int, help='Stream frame rate (default: camera default)')
+    parser.add_argument('--interval', type=float, help='Time-lapse period in seconds (default: requests only)')
+    parser.add_argument('--zone', type=str, help='Zone of the photos of these cameras')
+    parser.add_argument('--no-pipeline', action='store_true', help='Do not make thumbnails and previews of time-lapse photos')
+    args = parser.parse_args()
+
+    pipeline = None
+    if not args.no_pipeline:
+        from datastore.photos import PhotoPipeline
+        pipeline = PhotoPipeline().start()
+    service = CaptureService(
+        {device: args.resolution for device in args.devices}, interval_s=args.interval, fps=args.fps,
+        pipeline=pipeline, zones={device: args.zone for device in args.devices},
+    )
+    service.start()
+    logger.info(f'capture service {args.devices} {args.resolution} interval {args.interval}')
+    try:
+        service.serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop()
+        if pipeline is not None:
+            pipeline.close()
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -1,6 +1,10 @@
 import aioesphomeapi
 import asyncio
 
+from datastore import add_listener, ring, stats
+from datastore.aio import AsyncStore
+from services import triggers
+
 async def main():
 
 	print("connect to api server")
@@ -21,16 +25,26 @@ async def main():
 	device_info = await api.device_info()
 	print(device_info)
 
-	
+	# writes run on a worker thread, the callback only queues the reading
+	store = await AsyncStore().start()
+	# live values for the API through shared memory
+	add_listener(ring.store().write_rows)
+	add_listener(stats.registry().update_rows)
+	add_listener(triggers.engine().evaluate_rows)
+	entities, services = await api.list_entities_services()
+	metrics = {e.key: e.object_id for e in entities}
 
 	def cb(state):
-		if type(state) == aioesphomeapi.CameraState:
+		if isinstance(state, aioesphomeapi.CameraState):
 			try:
 				with open('out/x.jpg','wb') as out:
 					out.write(state.image)
 				print('image written')
 			except Exception as e:
 				print(e)
+		elif isinstance(state, aioesphomeapi.SensorState):
+			if not state.missing_state:
+				store.add_nowait(f'esphome_{device_info.name}', {metrics.get(state.key, str(state.key)): state.state})
 		else:
 			print(state)
 
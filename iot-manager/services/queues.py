@@ -19,5 +19,12 @@ _cloud_sync = Queue(connection=r, name='cloud_sync')
 def get_queue(action_type=None):
     if action_type == 'light_cwww':
         return _lights
+    elif action_type == 'water_pump':
+        return _water
+    elif action_type == 'heat_wire':
+        return _heat
+    elif action_type == 'photo':
+        # CPU heavy photo processing, kept off the sensor and actuator workers
+        return _camera
     else:
         return q
\ No newline at end of file
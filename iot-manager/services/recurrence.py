@@ -0,0 +1,190 @@
+import json
+from dataclasses import dataclass, field, asdict
+from datetime import datetime, timedelta
+from typing import Optional
+
+from rq.job import Job
+from rq.registry import ScheduledJobRegistry
+from rq.utils import import_attribute
+
+import services.queues as queues
+from services import scheduler
+from utils import logger
+
+# Recurring protocol actions are stored as one rule each instead of one RQ job
+# per repetition. Only the next `window` occurrences of a rule exist as
+# scheduled jobs; when one fires it schedules the occurrence `window` steps
+# ahead. Redis keys and scheduled-registry entries grow with the number of
+# rules, not with the protocol horizon. Occurrences are written with
+# scheduler.schedule_actions(), reconcile() does every rule in one round trip.
+#
+# rules live in the hash below, field = rule id, value = Rule as JSON
+rules_key = 'iot:recurrence:rules'
+
+
+@dataclass
+class Rule:
+    rule_id: str # e.g. 'default.light_cwww.on'
+    action: str # import path of the job function, e.g. 'services.worker.job_lights_on'
+    start: str # isoformat of the first occurrence
+    interval_s: int
+    metadata: dict = field(default_factory=dict)
+    count: Optional[int] = None # total occurrences, None repeats forever
+    window: int = 1 # occurrences kept scheduled ahead of time
+
+    @property
+    def start_datetime(self):
+        return datetime.fromisoformat(self.start)
+
+    def occurrence(self, index):
+        return self.start_datetime + timedelta(seconds=self.interval_s * index)
+
+    def valid_index(self, index):
+        return index >= 0 and (self.count is None or index < self.count)
+
+    def next_index(self, now):
+        """Index of the first occurrence at or after now."""
+        elapsed = (now - self.start_datetime).total_seconds()
+        if elapsed <= 0:
+            return 0
+        index = int(elapsed // self.interval_s)
+        if self.occurrence(index) < now:
+            index += 1
+        return index
+
+    def index_of(self, when):
+        """Index of the occurrence at when, None if no occurrence falls on it."""
+        elapsed = (when - self.start_datetime).total_seconds()
+        index = round(elapsed / self.interval_s)
+        return index if self.occurrence(index) == when else None
+
+    def job_id(self, index):
+        # deterministic and named by the occurrence time, not the index, so
+        # re-adding the rule with a later start on the same grid, e.g. at
+        # every startup, maps to the occurrences already scheduled
+        return f'{job_prefix(self.rule_id)}{int(self.occurrence(index).timestamp())}'
+
+
+def job_prefix(rule_id):
+    return f'rule-{rule_id}-'
+
+
+def action_path(action):
+    if isinstance(action, str):
+        return action
+    return f'{action.__module__}.{action.__qualname__}'
+
+
+def make_rule(rule_id, action, start, interval_s, metadata={}, count=None, window=1):
+    return Rule(rule_id, action_path(action), start.isoformat(), int(interval_s), dict(metadata), count, window)
+
+
+def get_rule(rule_id, connection=None):
+    connection = connection or queues.r
+    data = connection.hget(rules_key, rule_id)
+    if data is None:
+        return None
+    return Rule(**json.loads(data))
+
+
+def get_rules(connection=None):
+    connection = connection or queues.r
+    return [Rule(**json.loads(data)) for data in connection.hvals(rules_key)]
+
+
+def materialize(rule, indexes, pipe):
+    """Add the occurrences at indexes to the scheduled registry on pipe."""
+    return scheduler.schedule_actions([
+        (rule.occurrence(index), fire_rule, rule.metadata, (rule.rule_id, rule.occurrence(index).isoformat()), rule.job_id(index))
+        for index in indexes if rule.valid_index(index)
+    ], pipeline=pipe)
+
+
+def pending_job_ids(rule, connection):
+    """Ids of the rule's occurrences in the scheduled registry."""
+    registry = ScheduledJobRegistry(queue=scheduler.get_queue(rule.metadata))
+    prefix = job_prefix(rule.rule_id)
+    return [
+        job_id for job_id in (j.decode() if isinstance(j, bytes) else j for j in connection.zrange(registry.key, 0, -1))
+        if job_id.startswith(prefix) and job_id[len(prefix):].isdigit()
+    ]
+
+
+def cancel_pending(rule, keep, pipe, connection):
+    """Remove the rule's scheduled occurrences other than the job ids in keep."""
+    registry = ScheduledJobRegistry(queue=scheduler.get_queue(rule.metadata))
+    for job_id in pending_job_ids(rule, connection):
+        if job_id not in keep:
+            pipe.zrem(registry.key, job_id)
+            pipe.delete(Job.key_for(job_id))
+
+
+def add_rule(rule, now=None, connection=None):
+    """
+    Store a rule, replacing one with the same id, and schedule its next
+    occurrences. Occurrences of the replaced rule that the new one does not
+    have are cancelled, so adding the same rule again, e.g. at every
+    startup, never schedules an occurrence twice.
+    """
+    logger.info(f'add_rule {rule}')
+    connection = connection or queues.r
+    first = rule.next_index(now or datetime.now())
+    indexes = [i for i in range(first, first + rule.window) if rule.valid_index(i)]
+    keep = {rule.job_id(i) for i in indexes}
+    previous = get_rule(rule.rule_id, connection)
+    with connection.pipeline() as pipe:
+        cancel_pending(rule, keep, pipe, connection)
+        if previous is not None and scheduler.get_queue(previous.metadata).name != scheduler.get_queue(rule.metadata).name:
+            cancel_pending(previous, keep, pipe, connection)
+        pipe.hset(rules_key, rule.rule_id, json.dumps(asdict(rule)))
+        materialize(rule, indexes, pipe)
+        pipe.execute()
+    return rule
+
+
+def remove_rule(rule_id, connection=None):
+    """Delete a rule, occurrences already scheduled fire as no-ops."""
+    logger.info(f'remove_rule {rule_id}')
+    connection = connection or queues.r
+    connection.hdel(rules_key, rule_id)
+
+
+def reconcile(now=None, connection=None):
+    """
+    Make sure every rule has its upcoming occurrences scheduled, e.g. after
+    the worker or Redis was down while an occurrence should have fired.
+    """
+    connection = connection or queues.r
+    now = now or datetime.now()
+    rules = get_rules(connection)
+    with connection.pipeline() as pipe:
+        for rule in rules:
+            first = rule.next_index(now)
+            materialize(rule, range(first, first + rule.window), pipe)
+        pipe.execute()
+    return rules
+
+
+def fire_rule(rule_id, occurrence):
+    """
+    RQ job for one occurrence of a rule: schedule the next one, then run the
+    action.
+
+    Args:
+        occurrence (str): isoformat of the occurrence time
+    """
+    rule = get_rule(rule_id)
+    index = rule.index_of(datetime.fromisoformat(occurrence)) if rule is not None else None
+    if index is None or not rule.valid_index(index):
+        logger.info(f'fire_rule {rule_id} {occurrence} skipped, rule removed, changed or finished')
+        return None
+
+    with queues.r.pipeline() as pipe:
+        materialize(rule, [index + rule.window], pipe)
+        pipe.execute()
+
+    metadata = dict(rule.metadata)
+    metadata['on_datetime'] = rule.occurrence(index).isoformat()
+    logger.info(f'fire_rule {rule_id} {index} {metadata}')
+    action = import_attribute(rule.action)
+    return action(metadata)
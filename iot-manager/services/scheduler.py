@@ -1,9 +1,13 @@
 from redis import Redis
 from rq import Queue, Worker
-from rq.job import Job
+from rq.job import Job, JobStatus
 from rq.repeat import Repeat
+from rq.registry import ScheduledJobRegistry
 
 from datetime import timedelta, datetime
+import calendar
+import threading
+import time
 import services.queues as queues
 from utils import logger
 # rq worker --with-scheduler
@@ -60,16 +64,63 @@ def set_job_metadata(job, metadata):
         # logger.info(key)
         # logger.info(metadata[key])
         job.meta[key] = metadata[key]
-        job.save_meta()
+    # one round trip for all keys
+    job.save_meta()
 
 def schedule_action(action_datetime, action, metadata={}):
     logger.info(f'schedule_action {action} {action_datetime} {metadata}')
     q = get_queue(metadata)
-    job = q.enqueue_at(action_datetime, action, metadata)
-    set_job_metadata(job, metadata)
+    # meta is saved with the job, no extra save_meta() round trip
+    job = q.enqueue_at(action_datetime, action, metadata, meta=dict(metadata))
     
     logger.info(f'Job id: {job.id} {job.meta}')
     return job
+
+def get_timestamp(action_datetime):
+    # same as rq's ScheduledJobRegistry.schedule: naive datetimes are local time
+    if not action_datetime.tzinfo:
+        action_datetime = action_datetime.astimezone()
+    return calendar.timegm(action_datetime.utctimetuple())
+
+def schedule_actions(actions, connection=None, pipeline=None):
+    """
+    Schedule many actions in a single Redis pipeline.
+
+    rq's enqueue_at() sends the scheduled registry ZADD outside the pipeline it
+    is given, so the jobs are created here and written with HSET/ZADD/SADD on
+    one pipeline: one round trip for the whole protocol instead of two or more
+    per job.
+
+    Args:
+        actions (list): (action_datetime, action, metadata) tuples, optionally
+            followed by the job args, (metadata,) by default, and the job id
+        connection: Redis connection, defaults to services.queues.r
+        pipeline: add the commands to this pipeline, the caller executes it
+
+    Returns:
+        list: the scheduled jobs, in the order of actions
+    """
+    if pipeline is None:
+        with (connection or queues.r).pipeline() as pipe:
+            jobs = schedule_actions(actions, pipeline=pipe)
+            pipe.execute()
+        return jobs
+
+    logger.info(f'schedule_actions {len(actions)} actions')
+    jobs = []
+    for action_datetime, action, metadata, *extra in actions:
+        args = extra[0] if extra else (metadata,)
+        job_id = extra[1] if len(extra) > 1 else None
+        q = get_queue(metadata)
+        job = q.create_job(action, args=args, job_id=job_id, meta=dict(metadata), status=JobStatus.SCHEDULED)
+        registry = ScheduledJobRegistry(queue=q)
+        
+        pipeline.sadd(q.redis_queues_keys, q.key)
+        job.save(pipeline=pipeline)
+        pipeline.zadd(registry.key, {job.id: get_timestamp(action_datetime)})
+        jobs.append(job)
+    
+    return jobs
     
 # def schedule_repeating_action(protocol_task, action_datetime, action, metadata={}):
 #     # default: repeat for 30 days
@@ -86,7 +137,203 @@ def schedule_action_now(action, metadata={}, delay_s=3):
     else:
         q = queues.get_queue()
     
-    job = q.enqueue_in(timedelta(seconds=delay_s), action, metadata)
-    set_job_metadata(job, metadata)
+    job = q.enqueue_in(timedelta(seconds=delay_s), action, metadata, meta=dict(metadata))
 
     return job
+
+
+# In-process timer wheel for short-horizon actions.
+#
+# RQ's scheduler polls the scheduled registry about once a second and every
+# poll is a Redis round trip, too coarse for "pump on for 30s" or fan duty
+# cycles. A hierarchical timer wheel fires callbacks in this process with
+# millisecond resolution: inserting and cancelling a timer is O(1), and a
+# tick only touches one slot. Timers in the upper levels are moved down
+# ("cascaded") when the level below wraps around.
+#
+# Timers are not durable, they are lost when the process exits. Only use
+# them in long-lived processes: services/worker.py work() enables them in the
+# actuator workers, which run jobs in a SimpleWorker. RQ's default Worker runs
+# each job in a work horse that exits right after the job. Everything else
+# goes through schedule_action().
+# https://www.cs.columbia.edu/~nahum/w6998/papers/sosp87-timing-wheels.pdf
+
+# slots per level, level 0 has tick_ms resolution and each level above
+# covers a full rotation of the one below: 256ms, 16.4s, 17.5min, 18.6h
+WHEEL_BITS = (8, 6, 6, 6)
+
+
+class Timer:
+    __slots__ = ('deadline', 'callback', 'args', 'cancelled')
+
+    def __init__(self, deadline, callback, args):
+        self.deadline = deadline # tick the timer is due
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerWheel:
+    """
+    Hierarchical timer wheel running callbacks on one background thread.
+
+    Callbacks run on the wheel thread and should be short (toggle a GPIO,
+    queue a job), a slow callback delays every timer behind it.
+
+    Args:
+        tick_ms (float): resolution of the lowest level
+    """
+    def __init__(self, tick_ms=1.0):
+        self.tick_s = tick_ms / 1000
+        self.shifts = []
+        shift = 0
+        for bits in WHEEL_BITS:
+            self.shifts.append(shift)
+            shift += bits
+        self.horizon = 1 << shift # ticks
+        self.levels = [[[] for _ in range(1 << bits)] for bits in WHEEL_BITS]
+        self.current = 0 # last tick processed
+        self.pending = 0
+        self.fired = 0
+        self.origin = time.monotonic()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def _tick_at(self, t):
+        return int((t - self.origin) / self.tick_s)
+
+    def _insert(self, timer):
+        # lowest level whose span covers the delay, call_later() checks the horizon
+        delta = timer.deadline - self.current
+        for level, bits in enumerate(WHEEL_BITS):
+            if delta < 1 << (self.shifts[level] + bits):
+                slot = (timer.deadline >> self.shifts[level]) & ((1 << bits) - 1)
+                self.levels[level][slot].append(timer)
+                return
+
+    def call_later(self, delay_s, callback, *args):
+        """
+        Run callback(*args) after delay_s seconds.
+
+        Returns:
+            Timer: call cancel() on it to drop the callback
+        """
+        with self._condition:
+            now = time.monotonic()
+            if self.pending == 0:
+                # the wheel is empty and the thread was idle, skip the ticks it slept through
+                self.current = max(self.current, self._tick_at(now))
+            # round up so a timer never fires early
+            deadline = max(self._tick_at(now + delay_s) + 1, self.current + 1)
+            if deadline - self.current >= self.horizon:
+                raise ValueError(f'delay {delay_s}s is beyond the wheel horizon, use schedule_action()')
+            timer = Timer(deadline, callback, args)
+            self._insert(timer)
+            self.pending += 1
+            self._condition.notify()
+        return timer
+
+    def _advance(self, tick):
+        """Process ticks up to tick, returns the timers due."""
+        due = []
+        while self.current < tick:
+            self.current += 1
+            # cascade higher levels whose slot boundary was just crossed
+            for level in range(1, len(WHEEL_BITS)):
+                if self.current & ((1 << self.shifts[level]) - 1):
+                    break
+                slot = (self.current >> self.shifts[level]) & ((1 << WHEEL_BITS[level]) - 1)
+                timers = self.levels[level][slot]
+                self.levels[level][slot] = []
+                for timer in timers:
+                    self._insert(timer)
+            slot = self.current & ((1 << WHEEL_BITS[0]) - 1)
+            timers = self.levels[0][slot]
+            if timers:
+                self.levels[0][slot] = []
+                due.extend(timers)
+        return due
+
+    def _next_wakeup(self):
+        # next occupied level 0 slot before the next cascade, else the cascade
+        size = 1 << WHEEL_BITS[0]
+        for i in range(1, size - (self.current & (size - 1)) + 1):
+            if self.levels[0][(self.current + i) & (size - 1)]:
+                return self.current + i
+        return self.current + size - (self.current & (size - 1))
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if self._stopped:
+                    return
+                if self.pending == 0:
+                    # nothing scheduled, sleep until call_later()
+                    self._condition.wait()
+                    continue
+                due = self._advance(self._tick_at(time.monotonic()))
+                if not due:
+                    wait = self.origin + self._next_wakeup() * self.tick_s - time.monotonic()
+                    if wait > 0:
+                        self._condition.wait(wait)
+                    continue
+                self.pending -= len(due)
+
+            for timer in due:
+                if timer.cancelled:
+                    continue
+                try:
+                    timer.callback(*timer.args)
+                except Exception as e:
+                    logger.error(f'TimerWheel callback {timer.callback} failed: {e}')
+                self.fired += 1
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='timer-wheel', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+# set with enable_local_timers() in processes that live long enough to fire them
+timer_wheel = None
+local_horizon_s = 60
+
+
+def enable_local_timers(horizon_s=60, tick_ms=1.0):
+    """
+    Start the process-wide timer wheel, schedule_action_in() runs actions due
+    within horizon_s seconds on it instead of going through RQ.
+    """
+    global timer_wheel, local_horizon_s
+    local_horizon_s = horizon_s
+    if timer_wheel is None:
+        timer_wheel = TimerWheel(tick_ms).start()
+    return timer_wheel
+
+
+def schedule_action_in(delay_s, action, metadata={}):
+    """
+    Run action(metadata) in delay_s seconds, in process with millisecond
+    precision if local timers are enabled and delay_s is within their horizon,
+    otherwise as a durable RQ job.
+
+    Returns:
+        Timer or Job
+    """
+    if timer_wheel is not None and delay_s <= local_horizon_s:
+        logger.info(f'schedule_action_in {action} {delay_s}s local {metadata}')
+        return timer_wheel.call_later(delay_s, action, metadata)
+    return schedule_action(datetime.now() + timedelta(seconds=delay_s), action, metadata)
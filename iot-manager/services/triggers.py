@@ -0,0 +1,318 @@
+import json
+import operator
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+from rq.utils import import_attribute
+
+from services import scheduler
+from utils import base_dir, load_yaml, logger
+
+# Threshold triggers of protocols.yaml, evaluated on every ingested reading.
+#
+# Triggers like "soil_moisture, lt, 80" are parsed once into TriggerRules and
+# indexed by (sensor, metric). A reading only looks up its own sensor and
+# metric in the index, so the work per reading is a few dict lookups plus the
+# rules that actually watch that series, however many rules there are.
+#
+# Each rule fires once when its condition has held for `debounce`, then stays
+# quiet until the value is back past the threshold by `hysteresis`, so a
+# reading hovering around the threshold does not toggle the pump on every
+# sweep. Firing enqueues the actuator's on job on its queue with `duration`,
+# the on job schedules the off job itself, so both run in the actuator worker
+# and not in the process that evaluated the rule.
+#
+# The engine runs as a datastore listener in the RQ work horses, which fork
+# per job, so rule state lives in a Redis hash: one HMGET and one HSET per
+# batch of readings that matched any rule.
+#
+#   actions:
+#     water_pump:
+#       trigger: soil_moisture, lt, 80   # sensor[.metric], op, threshold
+#       hysteresis: 5                    # re-arm at 85
+#       debounce: 30s                    # must stay below 80 for 30s
+#       action: on
+#       duration: 30s
+#
+# add_listener(triggers.engine().evaluate_rows)
+
+path_config_protocols = Path(*[base_dir, 'config', 'protocols.yaml'])
+
+# rule state, field = '<rule id>|<sensor id>', value = state as JSON
+state_key = 'iot:triggers:state'
+
+# op -> (comparison, direction the value moves to re-arm)
+OPS = {
+    'lt': (operator.lt, 1),
+    'le': (operator.le, 1),
+    'gt': (operator.gt, -1),
+    'ge': (operator.ge, -1),
+    'eq': (operator.eq, 0),
+    'ne': (operator.ne, 0),
+}
+
+# metric watched when a trigger only names the sensor
+DEFAULT_METRICS = {
+    'soil_moisture': 'moisture',
+    'soil_temp': 'temp',
+    'water_level': 'distance',
+    'light_fullspectrum': 'light_fullspectrum',
+}
+
+# actuator -> (on job, off job), import paths so the worker is only imported when firing
+ACTUATORS = {
+    'water_pump': ('services.worker.job_pump_on', 'services.worker.job_pump_off'),
+    'heat_wire': ('services.worker.job_heat_on', 'services.worker.job_heat_off'),
+    'light_cwww': ('services.worker.job_lights_on', 'services.worker.job_lights_off'),
+}
+
+UNITS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+
+def parse_duration_s(duration):
+    """'30s', '5m', '6h', '1d', seconds or {d, h, m, s} -> seconds, None stays None."""
+    if duration is None:
+        return None
+    if isinstance(duration, dict):
+        return scheduler.get_seconds(duration.get('d', 0), duration.get('h', 0), duration.get('m', 0), duration.get('s', 0))
+    if isinstance(duration, (int, float)):
+        return duration
+    match = re.fullmatch(r'\s*([\d.]+)\s*([smhd]?)\s*', str(duration))
+    if match is None:
+        raise ValueError(f'invalid duration {duration!r}')
+    return float(match.group(1)) * UNITS[match.group(2) or 's']
+
+
+@dataclass
+class TriggerRule:
+    rule_id: str # e.g. 'default.water_pump.0'
+    sensor: str # sensor type or sensor id, e.g. 'soil_moisture'
+    metric: str
+    op: str
+    threshold: float
+    actuator: str # e.g. 'water_pump'
+    action: str = 'on'
+    duration_s: Optional[float] = None
+    hysteresis: float = 0.0
+    debounce_s: float = 0.0
+    metadata: dict = field(default_factory=dict)
+
+    def test(self, value):
+        compare, _ = OPS[self.op]
+        return compare(value, self.threshold)
+
+    def rearmed(self, value):
+        # lt 80 with hysteresis 5 re-arms at 85, gt at threshold - 5
+        compare, direction = OPS[self.op]
+        return not compare(value - direction * self.hysteresis, self.threshold)
+
+    def step(self, state, value, ts):
+        """
+        Advance state with one reading, True when the rule fires.
+
+        state is a dict with armed (bool) and since (epoch ms the condition
+        started holding, or None), updated in place.
+        """
+        if not state['armed']:
+            if self.rearmed(value):
+                state['armed'] = True
+            return False
+
+        if not self.test(value):
+            state['since'] = None
+            return False
+        if state['since'] is None:
+            state['since'] = ts
+        if ts - state['since'] < self.debounce_s * 1000:
+            return False
+        state.update(armed=False, since=None, fired_at=ts)
+        return True
+
+
+def parse_trigger(trigger):
+    # "soil_moisture, lt, 80" or "air_temp_humidity.temp, gt, 30"
+    parts = [part.strip() for part in str(trigger).split(',')]
+    if len(parts) != 3:
+        raise ValueError(f'trigger {trigger!r} is not "sensor, op, threshold"')
+    sensor, op, threshold = parts
+    if op not in OPS:
+        raise ValueError(f'trigger {trigger!r}: op must be one of {list(OPS)}')
+    sensor, _, metric = sensor.partition('.')
+    if not metric:
+        if sensor not in DEFAULT_METRICS:
+            raise ValueError(f'trigger {trigger!r}: name the metric, e.g. {sensor}.temp')
+        metric = DEFAULT_METRICS[sensor]
+    return sensor, metric, op, float(threshold)
+
+
+def parse_action(action):
+    # YAML 1.1 reads a bare on/off as a boolean
+    if isinstance(action, bool):
+        return 'on' if action else 'off'
+    return str(action).strip()
+
+
+def compile_rules(protocol, protocol_name='default'):
+    """TriggerRules of every action with a trigger in a protocol of protocols.yaml."""
+    rules = []
+    for activity in protocol.get('activities') or []:
+        for actuator, task in (activity.get('actions') or {}).items():
+            if not isinstance(task, dict) or 'trigger' not in task:
+                continue
+            sensor, metric, op, threshold = parse_trigger(task['trigger'])
+            rules.append(TriggerRule(
+                rule_id=f'{protocol_name}.{actuator}.{len(rules)}',
+                sensor=sensor,
+                metric=metric,
+                op=op,
+                threshold=threshold,
+                actuator=actuator,
+                action=parse_action(task.get('action', 'on')),
+                duration_s=parse_duration_s(task.get('duration')),
+                hysteresis=float(task.get('hysteresis', 0)),
+                debounce_s=parse_duration_s(task.get('debounce')) or 0.0,
+                metadata={"description": activity.get('description', '')},
+            ))
+    return rules
+
+
+class MemoryState:
+    """Rule state in a dict, for tests and long running single processes."""
+    def __init__(self):
+        self.states = {}
+
+    def get_many(self, keys):
+        return {key: dict(self.states[key]) for key in keys if key in self.states}
+
+    def set_many(self, states):
+        self.states.update({key: dict(state) for key, state in states.items()})
+
+
+class RedisState:
+    """Rule state shared by all processes through the state_key hash."""
+    def __init__(self, connection=None, key=state_key):
+        if connection is None:
+            import services.queues as queues
+            connection = queues.r
+        self.connection = connection
+        self.key = key
+
+    def get_many(self, keys):
+        keys = list(keys)
+        values = self.connection.hmget(self.key, keys) if keys else []
+        return {key: json.loads(value) for key, value in zip(keys, values) if value is not None}
+
+    def set_many(self, states):
+        if states:
+            self.connection.hset(self.key, mapping={key: json.dumps(state) for key, state in states.items()})
+
+
+def base_sensor(sensor_id):
+    # readings of soil_moisture_2 match triggers on soil_moisture
+    match = re.fullmatch(r'(.+)_\d+', sensor_id)
+    return match.group(1) if match else None
+
+
+class TriggerEngine:
+    """
+    Evaluates TriggerRules against readings.
+
+    Args:
+        rules (list): TriggerRules, see compile_rules()
+        state: MemoryState or RedisState, defaults to MemoryState
+        fire: called with (rule, row) when a rule fires, defaults to
+            enqueueing the actuator jobs, see fire_rule()
+    """
+    def __init__(self, rules=(), state=None, fire=None):
+        self.rules = []
+        self.index = {} # (sensor, metric) -> rules
+        self.state = state or MemoryState()
+        self.fire = fire or fire_rule
+        self._base = {}
+        for rule in rules:
+            self.add_rule(rule)
+
+    def add_rule(self, rule):
+        self.rules.append(rule)
+        self.index.setdefault((rule.sensor, rule.metric), []).append(rule)
+
+    def matching(self, sensor_id, metric):
+        if sensor_id not in self._base:
+            self._base[sensor_id] = base_sensor(sensor_id)
+        rules = self.index.get((sensor_id, metric), [])
+        base = self._base[sensor_id]
+        if base is not None:
+            rules = rules + self.index.get((base, metric), [])
+        return rules
+
+    def evaluate_rows(self, rows):
+        """
+        Evaluate Reading rows (dicts with sensor_id, metric, ts and value),
+        a datastore listener.
+
+        Returns:
+            list: (rule, row) of the rules that fired
+        """
+        matches = []
+        for row in rows:
+            for rule in self.matching(row['sensor_id'], row['metric']):
+                matches.append((f'{rule.rule_id}|{row["sensor_id"]}', rule, row))
+        if not matches:
+            return []
+
+        matches.sort(key=lambda match: match[2]['ts'])
+        states = self.state.get_many({key for key, _, _ in matches})
+        fired = []
+        for key, rule, row in matches:
+            state = states.setdefault(key, {"armed": True, "since": None, "fired_at": None})
+            if rule.step(state, row['value'], row['ts']):
+                fired.append((rule, row))
+        self.state.set_many(states)
+
+        for rule, row in fired:
+            try:
+                self.fire(rule, row)
+            except Exception as e:
+                logger.error(f'trigger {rule.rule_id} failed to fire: {e}')
+        return fired
+
+
+def fire_rule(rule, row):
+    """Enqueue the actuator's on job, it runs the off job after rule.duration_s."""
+    on_action, _ = ACTUATORS[rule.actuator]
+    metadata = dict(rule.metadata)
+    metadata.update({
+        "type": rule.actuator,
+        "action": rule.action,
+        "rule_id": rule.rule_id,
+        "sensor_id": row['sensor_id'],
+        "metric": row['metric'],
+        "value": row['value'],
+        "ts": row['ts'],
+    })
+    logger.info(f'trigger {rule.rule_id} fired {metadata}')
+    if rule.duration_s:
+        metadata["duration_s"] = rule.duration_s
+    q = scheduler.get_queue(metadata)
+    q.enqueue(import_attribute(on_action), metadata, meta=dict(metadata))
+
+
+def load_rules(path_config=path_config_protocols):
+    protocols = load_yaml(path_config).get('protocols') or {}
+    rules = []
+    for name, protocol in protocols.items():
+        rules.extend(compile_rules(protocol, name))
+    return rules
+
+
+_engine = None
+
+
+def engine():
+    """The process wide TriggerEngine, rules from config/protocols.yaml, state in Redis."""
+    global _engine
+    if _engine is None:
+        _engine = TriggerEngine(load_rules(), state=RedisState())
+    return _engine
@@ -1,5 +1,5 @@
 from redis import Redis
-from rq import Queue, Worker
+from rq import Queue, SimpleWorker, Worker
 from rq.job import Job
 from rq.repeat import Repeat
 
@@ -9,7 +9,10 @@ from datetime import timedelta, datetime
 from devices import Sensor, system_devices
 from utils import logger
 
-from datastore import add_sensor_reading
+from devices.sweep import sweep
+from datastore import add_sensor_reading, add_sensor_readings, add_listener, ring, stats
+from datastore.retention import apply_retention
+from datastore.photos import ingest_photo
 
 # rq worker --with-scheduler
 
@@ -24,16 +27,41 @@ from datastore import add_sensor_reading
 # q = Queue(connection=r)
 
 import services.queues as queues
+from services import scheduler, triggers
+
+# latest values and short windows for the API and monitors, without a DB query
+add_listener(ring.store().write_rows)
+# smoothed values, rolling min/max and trends per sensor metric
+add_listener(stats.registry().update_rows)
+# protocol triggers, e.g. the water pump when soil moisture drops
+add_listener(triggers.engine().evaluate_rows)
+
+# queues of jobs that switch actuators
+ACTUATOR_QUEUES = (queues._lights, queues._water, queues._heat)
 
 def work(queue, redis=queues.r):
-    worker = Worker(queues=[queue], connection=redis)
+    if queue in ACTUATOR_QUEUES:
+        # jobs run in this long-lived process instead of a forked work horse,
+        # so the timers they set, e.g. pump off in 30s, fire on the wheel
+        scheduler.enable_local_timers()
+        worker = SimpleWorker(queues=[queue], connection=redis)
+    else:
+        worker = Worker(queues=[queue], connection=redis)
     worker.work(with_scheduler=True)
 
+def off_after(target, off_action):
+    # triggered actions carry their duration: the off action runs on the
+    # timer wheel of this actuator worker, or as an RQ job on its queue
+    duration_s = target.get('duration_s') if isinstance(target, dict) else None
+    if duration_s:
+        scheduler.schedule_action_in(duration_s, off_action, {k: v for k, v in target.items() if k != 'duration_s'})
+
 def job_lights_on(target):
     logger.info(f'job_lights_on {target}')
     
     light = system_devices['light_cwww'][0]
     light.on()
+    off_after(target, job_lights_off)
     
     return target
 
@@ -47,51 +75,61 @@ def job_lights_off(target):
 
 def job_camera_photo(target):
     logger.info(f'job_camera_photo {target}')
-    camera = system_devices['sensors']['camera'][0]
-    camera.photo()
+    camera = system_devices['sensors']['cameras'][0]
+    photo = camera.photo()
+    # thumbnail, preview and hash on the photo queue, not on this worker:
+    # rq worker camera
+    queues.get_queue('photo').enqueue(job_process_photo, {"filepath": photo['filepath'], "devicepath": photo['devicepath']})
+    logger.info(f'job_camera_photo {photo["filepath"]}')
     
     return target
 
+def job_process_photo(target):
+    logger.info(f'job_process_photo {target}')
+    # thumbnail, preview and Photo row
+    photo_id = ingest_photo(target['filepath'], device_path=target['devicepath'])
+    logger.info(f'job_process_photo {target["filepath"]} photo {photo_id}')
+    
+    return photo_id
+
 def job_read_sensor(target:Sensor):
     logger.info(f'job_read_sensor {target}')
     
-    target.measure()
-    add_sensor_reading(target.last_reading)
+    data = target.measure()
+    add_sensor_reading(target.sensor_type, data)
     
     return target
 
+# sensor types read by one sweep
+SWEEP_SENSORS = [
+    'water_level',
+    'soil_moisture',
+    'soil_temp',
+    'air_temp_humidity',
+    'air_temp_humidity_barometer',
+    'light_fullspectrum',
+]
+
 def job_read_sensors(target):
     logger.info(f'job_read_sensors {target}')
     
     # for each available sensor
-    if len(system_devices['sensors']['water_level']) > 0:
-        sensor = system_devices['sensors']['water_level'][0]
-        job_read_sensor(sensor)
-        
-    if len(system_devices['sensors']['soil_moisture']) > 0:
-        sensor = system_devices['sensors']['soil_moisture'][0]
-        job_read_sensor(sensor)
+    sensors = []
+    for sensor_type in SWEEP_SENSORS:
+        sensors.extend(system_devices.get('sensors', {}).get(sensor_type, [])[:1])
+    
+    # independent buses are read concurrently, the sweep is written in one transaction
+    report = sweep(sensors)
+    rows = add_sensor_readings(report['readings'])
+    # the work horse exits after the job, keep its stats for the next one
+    stats.registry().checkpoint()
+    logger.info(f'job_read_sensors {len(sensors)} sensors {rows} rows in {report["seconds"]:.3f}s errors {report["errors"]}')
     
-    if len(system_devices['sensors']['soil_temp']) > 0:
-        sensor = system_devices['sensors']['soil_temp'][0]
-        job_read_sensor(sensor)
-        
-    if len(system_devices['sensors']['air_temp_humidity']) > 0:
-        sensor = system_devices['sensors']['air_temp_humidity'][0]
-        job_read_sensor(sensor)
-        
-    if len(system_devices['sensors']['air_temp_humidity_barometer']) > 0:
-        sensor = system_devices['sensors']['air_temp_humidity_barometer'][0]
-        job_read_sensor(sensor)
-
-    if len(system_devices['sensors']['light_fullspectrum']) > 0:
-        sensor = system_devices['sensors']['light_fullspectrum'][0]
-        job_read_sensor(sensor)
-        
     return target
 
 def job_pump_on(target):
     logger.info(target)
+    off_after(target, job_pump_off)
     return target
 
 def job_pump_off(target):
@@ -100,12 +138,22 @@ def job_pump_off(target):
 
 def job_heat_on(target):
     logger.info(target)
+    off_after(target, job_heat_off)
     return target
 
 def job_heat_off(target):
     logger.info(target)
     return target
 
+def job_apply_retention(target):
+    logger.info(f'job_apply_retention {target}')
+    # deletes expired rows in batches and runs incremental vacuum,
+    # the report is kept as the job result
+    report = apply_retention()
+    return report
+
 
 if __name__ == "__main__":
-    work(queues._lights) 
\ No newline at end of file
+    import sys
+    # python -m services.worker water_pump
+    work(queues.get_queue(sys.argv[1]) if len(sys.argv) > 1 else queues._lights) 
\ No newline at end of file
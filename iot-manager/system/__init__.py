@@ -3,8 +3,9 @@ import yaml
 import pathlib
 from datetime import datetime, timedelta
 
-from services import scheduler, sensors, actuators, camera
-from services.worker import job_lights_off, job_lights_on, job_camera_photo, job_read_sensors
+from services import scheduler, recurrence, sensors, actuators, camera
+from services.worker import job_lights_off, job_lights_on, job_camera_photo, job_read_sensors, job_apply_retention
+from datastore.db import load_datastore_config
 # import devices
 
 from pathlib import Path
@@ -21,7 +22,6 @@ config = {
 }
 print(config)
 
-repeat_limit = 3
 system_devices = {}
 config_protocols = {}
 config_devices = {}
@@ -44,7 +44,6 @@ def schedule_water_pump(timing, action):
     # pump off
     
 def schedule_lights(protocol_task, devices):
-    global repeat_limit
     
     print('schedule_lights')
     print(protocol_task)
@@ -67,29 +66,18 @@ def schedule_lights(protocol_task, devices):
     }
     scheduler.schedule_action_now(job_lights_on, metadata)
     
-    # default: repeat for 30 times (~30 days)
-    # repeat_limit = 3
-    repeat_iter = 0
+    # one recurrence rule per action, only the next occurrence is an RQ job
     if 'repeat' in protocol_task:
         r = protocol_task['repeat']
-        while repeat_iter < repeat_limit:
-            
-            metadata = {
-                "type": "light_cwww",
-                "on_datetime": on_datetime.isoformat(),
-                "off_datetime": off_datetime.isoformat()
-            }
-            
-            scheduler.schedule_action(on_datetime, job_lights_on, metadata)
-            scheduler.schedule_action(off_datetime, job_lights_off, metadata)
-            
-            on_datetime += timedelta(days=r['d'], hours=r['h'], minutes=r['m'], seconds=r['s'])
-            off_datetime += timedelta(days=r['d'], hours=r['h'], minutes=r['m'], seconds=r['s'])
-            
-            repeat_iter += 1
+        interval_s = scheduler.get_seconds(r['d'], r['h'], r['m'], r['s'])
+        metadata = {
+            "type": "light_cwww",
+        }
+        
+        recurrence.add_rule(recurrence.make_rule('light_cwww.on', job_lights_on, on_datetime, interval_s, metadata))
+        recurrence.add_rule(recurrence.make_rule('light_cwww.off', job_lights_off, off_datetime, interval_s, metadata))
 
 def schedule_cameras(protocol_task, devices):
-    global repeat_limit
     print('schedule_cameras')
     print(protocol_task)
     print(devices)
@@ -104,26 +92,16 @@ def schedule_cameras(protocol_task, devices):
     }
     scheduler.schedule_action_now(job_camera_photo, metadata)
 
-    # default: repeat for 30 times (~30 days)
-    # repeat_limit = 3
-    repeat_iter = 0
     if 'repeat' in protocol_task:
         r = protocol_task['repeat']
-        while repeat_iter < repeat_limit:
-            
-            metadata = {
-                "type": "camera",
-                "on_datetime": on_datetime.isoformat(),
-            }
-            
-            scheduler.schedule_action(on_datetime, job_camera_photo, metadata)
-
-            on_datetime += timedelta(days=r['d'], hours=r['h'], minutes=r['m'], seconds=r['s'])
-      
-            repeat_iter += 1
+        interval_s = scheduler.get_seconds(r['d'], r['h'], r['m'], r['s'])
+        metadata = {
+            "type": "camera",
+        }
+        
+        recurrence.add_rule(recurrence.make_rule('camera.photo', job_camera_photo, on_datetime, interval_s, metadata))
             
 def schedule_sensors(protocol_task, devices):
-    global repeat_limit
     print('schedule_sensors')
     print(protocol_task)
     print(devices)
@@ -138,24 +116,26 @@ def schedule_sensors(protocol_task, devices):
     }
     scheduler.schedule_action_now(job_read_sensors, metadata)
 
-    # default: repeat for 30 times (~30 days)
-    # repeat_limit = 3
-    repeat_iter = 0
     if 'repeat' in protocol_task:
         r = protocol_task['repeat']
-        while repeat_iter < repeat_limit:
-            
-            metadata = {
-                "type": "sensors",
-                "on_datetime": on_datetime.isoformat(),
-            }
-            
-            scheduler.schedule_action(on_datetime, job_camera_photo, metadata)
-
-            on_datetime += timedelta(days=r['d'], hours=r['h'], minutes=r['m'], seconds=r['s'])
-      
-            repeat_iter += 1       
+        interval_s = scheduler.get_seconds(r['d'], r['h'], r['m'], r['s'])
+        metadata = {
+            "type": "sensors",
+        }
+        
+        recurrence.add_rule(recurrence.make_rule('sensors.read', job_read_sensors, on_datetime, interval_s, metadata))
     
+def schedule_retention():
+    print('schedule_retention')
+    
+    maintenance_time = load_datastore_config()['maintenance_time']
+    run_datetime = scheduler.get_date_start().replace(hour=maintenance_time['h'], minute=maintenance_time['m'], second=maintenance_time['s'], microsecond=0)
+    metadata = {
+        "type": "retention",
+    }
+    
+    recurrence.add_rule(recurrence.make_rule('datastore.retention', job_apply_retention, run_datetime, scheduler.get_seconds(1, 0, 0, 0), metadata))
+
 def schedule_heat(timing, action):
     print(timing)
     print(action)
@@ -195,6 +175,10 @@ def schedule_jobs(protocols, devices):
         # elif key == 'fan':
         #     schedule_fan(protocol_task)
     
+    schedule_retention()
+    # reschedule rules whose next occurrence was lost while redis or the worker was down
+    recurrence.reconcile()
+    
     # scheduler.work()
 
 # expose configuration to any module importing this module
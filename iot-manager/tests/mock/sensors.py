@@ -1,6 +1,6 @@
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
+from datetime import datetime, timezone
 import os
 import argparse
 from sqlalchemy import create_engine
@@ -43,14 +43,14 @@ def generate_temperature_data(start_date=None, num_days=None, num_readings=None,
     if num_days is not None:
         num_readings = int((num_days * 24 * 60 * 60) / interval_seconds)
     
-    # Generate timestamps
-    delta = timedelta(seconds=interval_seconds)
-    timestamps = [start_time + i * delta for i in range(num_readings)]
-    timestamps_ms = [int(t.timestamp() * 1000) for t in timestamps]
+    # Generate timestamps, vectorized: one datetime64 array instead of a datetime per reading
+    offsets = np.arange(num_readings, dtype='int64') * interval_seconds
+    times = np.datetime64(start_time, 'ms') + offsets.astype('timedelta64[s]')
+    timestamps_ms = int(start_time.timestamp() * 1000) + offsets * 1000
     
     # Generate base temperature pattern with daily cycle
-    hours_of_day = [(start_time + i * delta).hour for i in range(num_readings)]
-    base_temp = np.array([mean_temp_celsius + 3 * np.sin(hour * np.pi / 12) for hour in hours_of_day])
+    hours_of_day = (times - times.astype('datetime64[D]')).astype('timedelta64[h]').astype('int64')
+    base_temp = mean_temp_celsius + 3 * np.sin(hours_of_day * np.pi / 12)
     
     # Add random variations
     if add_noise:
@@ -125,6 +125,128 @@ def save_dataframe_to_sqlite(df, database_path='temperature_data.db',
     df.to_sql(table_name, engine, if_exists=if_exists, index=False)
     return database_path
 
+def generate_chunks(sensors, metrics, start_date=None, num_days=None, num_readings=None,
+                    interval_seconds=1, chunk_rows=1000000, seed=None):
+    """
+    Generate readings for many sensors and metrics as a stream of chunks.
+    
+    Every value follows the diurnal cycle and noise of devices.simulator.SIGNALS.
+    Each chunk covers consecutive timestamps for all sensors and metrics and
+    is built with array operations only, memory is bounded by chunk_rows no
+    matter how many rows are generated in total.
+    
+    Args:
+        sensors (list): sensor ids, e.g. ['soil_temp_0', 'soil_temp_1']
+        metrics (list): metric names, keys of devices.simulator.SIGNALS
+        start_date (str): Start date in 'YYYY-MM-DD HH:MM:SS' format, UTC. Defaults to now if None.
+        num_days (float): Number of days to generate. Must provide either this or num_readings.
+        num_readings (int): Readings per sensor and metric. Must provide either this or num_days.
+        interval_seconds (int): Time interval between readings in seconds.
+        chunk_rows (int): Approximate rows per chunk.
+        seed (int): Random seed for the noise.
+        
+    Yields:
+        pandas.DataFrame: long format chunk with sensor_id, metric, ts (epoch ms) and value
+    """
+    from devices.simulator import SIGNALS
+    
+    if (num_days is None) == (num_readings is None):
+        raise ValueError("Must provide exactly one of num_days or num_readings")
+    if num_days is not None:
+        num_readings = int((num_days * 24 * 60 * 60) / interval_seconds)
+    
+    if start_date is None:
+        start = np.datetime64(datetime.now(timezone.utc).replace(tzinfo=None), 'ms')
+    else:
+        start = np.datetime64(datetime.strptime(start_date, '%Y-%m-%d %H:%M:%S'), 'ms')
+    start_ms = start.astype('int64')
+    interval_ms = int(interval_seconds * 1000)
+    
+    # one row per (sensor, metric) series, parameters as column vectors
+    series = [(sensor, metric) for sensor in sensors for metric in metrics]
+    params = np.array([SIGNALS[metric] for _, metric in series], dtype='float64')
+    mean, amplitude, peak_hour, noise, low, high = (params[:, i:i + 1] for i in range(6))
+    rng = np.random.default_rng(seed)
+    # stable per series offsets so identical sensors still differ
+    phase = rng.uniform(-0.5, 0.5, (len(series), 1))
+    offset = rng.uniform(-2, 2, (len(series), 1)) * noise
+    
+    sensor_ids = pd.Categorical([sensor for sensor, _ in series], categories=list(sensors))
+    metric_ids = pd.Categorical([metric for _, metric in series], categories=list(metrics))
+    steps = max(1, chunk_rows // len(series))
+    
+    for first in range(0, num_readings, steps):
+        n = min(steps, num_readings - first)
+        ts = start_ms + (first + np.arange(n, dtype='int64')) * interval_ms
+        hours = (ts % 86400000) / 3600000
+        values = mean + offset + amplitude * np.cos((hours - peak_hour - phase) * np.pi / 12)
+        values += rng.standard_normal((len(series), n)) * noise
+        np.clip(values, low, high, out=values)
+        
+        yield pd.DataFrame({
+            'sensor_id': sensor_ids.take(np.repeat(np.arange(len(series)), n)),
+            'metric': metric_ids.take(np.repeat(np.arange(len(series)), n)),
+            'ts': np.tile(ts, len(series)),
+            'value': values.ravel(),
+        })
+
+def stream_to_csv(chunks, filepath):
+    """
+    Append chunks to one CSV file.
+    
+    Returns:
+        int: rows written
+    """
+    rows = 0
+    for i, df in enumerate(chunks):
+        df.to_csv(filepath, mode='w' if i == 0 else 'a', header=i == 0, index=False)
+        rows += len(df)
+    return rows
+
+def stream_to_parquet(chunks, filepath):
+    """
+    Write chunks as row groups of one Parquet file, needs pyarrow.
+    
+    Returns:
+        int: rows written
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    
+    rows = 0
+    writer = None
+    try:
+        for df in chunks:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(filepath, table.schema, compression='zstd')
+            writer.write_table(table)
+            rows += len(df)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+def stream_to_datastore(chunks, engine):
+    """
+    Insert chunks into the readings table, one transaction per chunk.
+    Rollups are not updated, run datastore.rebuild_rollups() afterwards.
+    
+    Returns:
+        int: rows written
+    """
+    from datastore import Base
+    
+    Base.metadata.create_all(engine)
+    rows = 0
+    for df in chunks:
+        # plain tuples through the driver's executemany, no per row dicts
+        records = list(zip(df['sensor_id'].astype(str), df['metric'].astype(str), df['ts'].tolist(), df['value'].tolist()))
+        with engine.begin() as conn:
+            conn.exec_driver_sql('INSERT INTO readings (sensor_id, metric, ts, value) VALUES (?, ?, ?, ?)', records)
+        rows += len(records)
+    return rows
+
 def main():
     parser = argparse.ArgumentParser(description='Generate synthetic temperature sensor data')
     
@@ -151,8 +273,41 @@ def main():
     parser.add_argument('--table', type=str, default='temperature_readings', 
                       help='Table name for database (default: temperature_readings)')
     
+    # Multi sensor streaming output
+    parser.add_argument('--sensors', type=int,
+                      help='Generate this many sensors per metric as a stream of chunks instead')
+    parser.add_argument('--metrics', type=str, default='temp',
+                      help='Comma separated metrics for --sensors (default: temp)')
+    parser.add_argument('--format', choices=['csv', 'parquet', 'db'], default='csv',
+                      help='Output for --sensors, db writes the readings table (default: csv)')
+    parser.add_argument('--out', type=str,
+                      help='Output file for --sensors (default: tests/data/readings.<format>)')
+    parser.add_argument('--chunk-rows', type=int, default=1000000,
+                      help='Rows per chunk for --sensors (default: 1000000)')
+    
     args = parser.parse_args()
     
+    if args.sensors:
+        metrics = args.metrics.split(',')
+        chunks = generate_chunks(
+            [f'sensor_{i}' for i in range(args.sensors)],
+            metrics,
+            start_date=args.start_date,
+            num_days=None if args.readings else args.days,
+            num_readings=args.readings,
+            interval_seconds=args.interval,
+            chunk_rows=args.chunk_rows,
+        )
+        out = args.out or Path(*[base_dir, 'tests', 'data', f'readings.{args.format}'])
+        if args.format == 'csv':
+            rows = stream_to_csv(chunks, out)
+        elif args.format == 'parquet':
+            rows = stream_to_parquet(chunks, out)
+        else:
+            rows = stream_to_datastore(chunks, create_engine(f'sqlite:///{out}'))
+        print(f"{rows} rows saved to {args.format}: {out}")
+        return
+    
     # Generate data
     df = generate_temperature_data(
         start_date=args.start_date,
@@ -0,0 +1,92 @@
+import pytest
+
+from devices import bus
+from devices.bus import I2CBusManager
+
+
+class FakeI2C:
+    def __init__(self):
+        self.writes = []
+        self.locked = False
+
+    def try_lock(self):
+        if self.locked:
+            return False
+        self.locked = True
+        return True
+
+    def unlock(self):
+        self.locked = False
+
+    def writeto(self, address, buffer, **kwargs):
+        self.writes.append((address, bytes(buffer)))
+
+    def readfrom_into(self, address, buffer, **kwargs):
+        buffer[0] = address
+
+
+class FakeDriver:
+    # stands in for an adafruit driver: every property access is one locked transaction
+    def __init__(self, i2c, address):
+        self.i2c = i2c
+        self.address = address
+
+    @property
+    def temperature(self):
+        buffer = bytearray(1)
+        while not self.i2c.try_lock():
+            pass
+        try:
+            self.i2c.readfrom_into(self.address, buffer)
+        finally:
+            self.i2c.unlock()
+        return float(buffer[0])
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    monkeypatch.setitem(bus.DRIVERS, 'fake', (FakeDriver, lambda d: {"temp": d.temperature}))
+    return I2CBusManager(FakeI2C())
+
+
+def device(multiplex, channel, address=0x38):
+    return {"connection": "i2c", "bus": 1, "multiplex": multiplex, "channel": channel, "address": hex(address), "chip": "fake"}
+
+
+def test_drivers_are_cached(manager):
+    for _ in range(3):
+        assert manager.read(device(0, 1))['temp'] == 0x38
+    assert manager.stats()['drivers_created'] == 1
+    assert manager.stats()['channel_switches'] == 1
+
+
+def test_batch_selects_each_channel_once(manager):
+    paths = [device(0, 0), device(1, 0), device(0, 0, 0x29), device(1, 0, 0x29), device(0, 1)]
+    results = manager.read_batch(paths)
+    assert [r['temp'] for r in results] == [0x38, 0x38, 0x29, 0x29, 0x38]
+    assert manager.stats()['channel_switches'] == 3
+    # switching to the other mux disables the previous one first
+    assert (0x70, b'\x00') in manager.i2c.writes
+    assert manager.stats()['reads'] == 5
+
+
+def test_batch_reports_failures(manager, monkeypatch):
+    def broken(i2c, address):
+        raise OSError('no ack')
+    monkeypatch.setitem(bus.DRIVERS, 'broken', (broken, lambda d: {}))
+    results = manager.read_batch([dict(device(0, 0), chip='broken'), device(0, 0)])
+    assert isinstance(results[0], OSError)
+    assert results[1]['temp'] == 0x38
+    assert manager.stats()['errors'] == 1
+
+
+def test_direct_device_disables_the_selected_mux(manager):
+    direct = device(None, None)
+    manager.read(direct)
+    # nothing selected yet, nothing to disable
+    assert manager.i2c.writes == []
+
+    manager.read(device(0, 1))
+    assert manager.read(direct)['temp'] == 0x38
+    assert manager.i2c.writes == [(0x70, b'\x02'), (0x70, b'\x00')]
+    assert manager.selected == (None, None)
@@ -0,0 +1,147 @@
+import shutil
+import threading
+
+import cv2
+import numpy as np
+import pytest
+from redis import Redis
+
+from services import camera
+from services.camera import CameraRegistry, CameraStream, CameraUSB, parse_formats, parse_resolution, probe_formats, to_jpeg
+
+
+class FakeCapture:
+    # cv2.VideoCapture with CONVERT_RGB off: retrieve() returns the JPEG as one row of bytes
+    def __init__(self, device_path, resolution, fps):
+        width, height = parse_resolution(resolution)
+        ok, self.jpeg = cv2.imencode('.jpg', np.zeros((height, width, 3), dtype=np.uint8))
+        self.grabs = 0
+        self.retrieves = 0
+        self.released = False
+        self.lock = threading.Lock()
+
+    def grab(self):
+        with self.lock:
+            self.grabs += 1
+        return True
+
+    def retrieve(self):
+        self.retrieves += 1
+        return True, self.jpeg.reshape(1, -1)
+
+    def release(self):
+        self.released = True
+
+
+def test_photo_writes_camera_jpeg(tmp_path):
+    stream = CameraStream('/dev/video9', '64x48', warmup_frames=3, open_capture=FakeCapture)
+    path = stream.photo(tmp_path / 'photos' / 'a.jpg')
+    data = open(path, 'rb').read()
+    # the camera's bytes, not re-encoded
+    assert data == stream.capture_device.jpeg.tobytes()
+    assert cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR).shape == (48, 64, 3)
+    assert stream.capture_device.grabs == 4
+    stream.close()
+    assert stream.capture_device.released
+
+
+def test_started_stream_only_retrieves_requested_frames():
+    stream = CameraStream('/dev/video9', '64x48', warmup_frames=0, open_capture=FakeCapture).start()
+    try:
+        for _ in range(3):
+            ts, data = stream.capture()
+            assert data[:2] == b'\xff\xd8'
+        assert stream.capture_device.retrieves == 3
+        assert stream.frames >= 3
+    finally:
+        stream.close()
+
+
+def test_decoded_frames_are_encoded():
+    image = np.full((8, 8, 3), 128, dtype=np.uint8)
+    assert to_jpeg(image)[:2] == b'\xff\xd8'
+    with pytest.raises(ValueError):
+        parse_resolution('2592')
+
+
+V4L2_FORMATS = """ioctl: VIDIOC_ENUM_FMT
+	Type: Video Capture
+
+	[0]: 'MJPG' (Motion-JPEG, compressed)
+		Size: Discrete 640x480
+			Interval: Discrete 0.033s (30.000 fps)
+		Size: Discrete 2592x1944
+			Interval: Discrete 0.067s (15.000 fps)
+		Size: Discrete 1920x1080
+	[1]: 'YUYV' (YUYV 4:2:2)
+		Size: Discrete 640x480
+"""
+
+
+def make_sysfs(root):
+    video = root / 'class' / 'video4linux'
+    video.mkdir(parents=True)
+    usb = root / 'devices' / 'usb1' / '1-1.2'
+    (usb / '1-1.2:1.0').mkdir(parents=True)
+    (usb / 'idVendor').write_text('0c45\n')
+    (usb / 'idProduct').write_text('6366\n')
+    (usb / 'serial').write_text('SN0001\n')
+    platform = root / 'devices' / 'platform' / 'cedrus'
+    platform.mkdir(parents=True)
+    for name, index, device in [('video0', '0', platform), ('video1', '0', usb / '1-1.2:1.0'), ('video2', '1', usb / '1-1.2:1.0')]:
+        (video / name).mkdir()
+        (video / name / 'index').write_text(index)
+        (video / name / 'name').write_text('USB Cam')
+        (video / name / 'device').symlink_to(device)
+    return video
+
+
+def test_registry_caches_scan_and_formats(tmp_path):
+    sysfs = make_sysfs(tmp_path / 'sys')
+    probes = []
+    def probe(device_path):
+        probes.append(device_path)
+        return parse_formats(V4L2_FORMATS)
+
+    registry = CameraRegistry(path=tmp_path / 'cameras.json', sysfs=sysfs, probe=probe)
+    # the platform decoder and the metadata node are skipped
+    assert [c['device_path'] for c in registry.cameras()] == ['/dev/video1']
+    camera = registry.find(usb_path='1-1.2', serial='SN0001')
+    assert registry.formats(camera)['YUYV'] == ['640x480']
+    assert registry.best_resolution(camera) == '2592x1944'
+    assert registry.find(serial='other') is None
+
+    # another process reads the cache file, no probe and no scan
+    other = CameraRegistry(path=tmp_path / 'cameras.json', sysfs=tmp_path / 'missing', probe=probe)
+    assert other.best_resolution(other.find(usb_path='1-1.2')) == '2592x1944'
+    assert probes == ['/dev/video1']
+    # saved through a temporary file of its own, nothing left behind
+    assert [p.name for p in tmp_path.iterdir() if p.is_file()] == ['cameras.json']
+
+    # hotplug: the camera comes back as video3, its formats are not probed again
+    (sysfs / 'video1').rename(sysfs / 'video3')
+    registry.invalidate()
+    assert registry.find(usb_path='1-1.2')['device_path'] == '/dev/video3'
+    registry.formats(registry.find(usb_path='1-1.2'))
+    assert probes == ['/dev/video1']
+
+
+def test_registry_ttl(tmp_path):
+    sysfs = make_sysfs(tmp_path / 'sys')
+    registry = CameraRegistry(ttl_s=0, path=None, sysfs=sysfs, probe=lambda d: {})
+    assert len(registry.cameras()) == 1
+    shutil.rmtree(sysfs / 'video1')
+    assert registry.cameras() == []
+
+
+def test_probe_without_v4l2_ctl(tmp_path, monkeypatch):
+    monkeypatch.setenv('PATH', str(tmp_path))
+    assert probe_formats('/dev/video1') == {}
+
+
+def test_photo_without_redis_falls_back_to_local(monkeypatch):
+    # nothing listens on port 1, the request raises redis' ConnectionError
+    request_photo = camera.request_photo
+    monkeypatch.setattr(camera, 'request_photo', lambda device_path: request_photo(device_path, connection=Redis(port=1)))
+    monkeypatch.setattr(CameraUSB, 'photo_local', lambda self: '/tmp/local.jpg')
+    assert CameraUSB('/dev/video1', '640x480').photo() == ('/tmp/local.jpg', '/dev/video1', '640x480')
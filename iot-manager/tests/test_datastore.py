@@ -0,0 +1,451 @@
+import json
+import sqlite3
+import time
+from datetime import datetime, timezone
+
+import pytest
+from sqlalchemy import create_engine, func, select, text
+from sqlalchemy.exc import OperationalError
+
+from datastore import Base, SensorReading, Reading, BufferedWriter, to_reading_rows, query_readings, query_series, update_rollups
+from datastore.rollups import pick_resolution
+from datastore.migrate import enable_incremental_vacuum, migrate
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "sensordata.db"}')
+    Base.metadata.create_all(engine)
+    return engine
+
+
+def count_rows(engine, table=Reading.__table__):
+    with engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(table)).scalar()
+
+
+def test_to_reading_rows():
+    rows = to_reading_rows('air_temp_humidity', {
+        "temp_c": 21.5,
+        "humidity": 40,
+        "values": [0, 1],
+        "model": "dht22",
+        "ts": "2025-04-06:03:06:47.000000Z",
+    })
+    ts = int(datetime(2025, 4, 6, 3, 6, 47, tzinfo=timezone.utc).timestamp() * 1000)
+    assert rows == [
+        {"sensor_id": "air_temp_humidity", "metric": "temp_c", "ts": ts, "value": 21.5},
+        {"sensor_id": "air_temp_humidity", "metric": "humidity", "ts": ts, "value": 40.0},
+        {"sensor_id": "air_temp_humidity", "metric": "values.0", "ts": ts, "value": 0.0},
+        {"sensor_id": "air_temp_humidity", "metric": "values.1", "ts": ts, "value": 1.0},
+    ]
+
+
+def test_to_reading_rows_skips_non_finite():
+    rows = to_reading_rows('soil_temp', {"temp_c": float('nan'), "values": [float('inf'), 1]}, ts=0)
+    assert rows == [{"sensor_id": "soil_temp", "metric": "values.1", "ts": 0, "value": 1.0}]
+
+
+def test_buffered_writer_flush(engine):
+    writer = BufferedWriter(engine, Reading.__table__, max_rows=100, max_age_s=60)
+    for i in range(10):
+        writer.add_many(to_reading_rows('soil_temp', {'temp_c': i}, ts=i))
+
+    assert count_rows(engine) == 0
+    assert writer.flush() == 10
+    assert count_rows(engine) == 10
+    assert writer.flush() == 0
+    assert query_readings('soil_temp', 'temp_c', 0, 9, bind=engine) == [(i, float(i)) for i in range(10)]
+
+
+def test_buffered_writer_size_threshold(engine):
+    writer = BufferedWriter(engine, Reading.__table__, max_rows=5, max_age_s=60).start()
+    for i in range(5):
+        writer.add_many(to_reading_rows('soil_temp', {'temp_c': i}))
+
+    deadline = time.monotonic() + 5
+    while writer.rows_written < 5 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert count_rows(engine) == 5
+    writer.close()
+
+
+def test_buffered_writer_age_threshold(engine):
+    writer = BufferedWriter(engine, Reading.__table__, max_rows=1000, max_age_s=0.05).start()
+    writer.add_many(to_reading_rows('soil_temp', {'temp_c': 1}))
+
+    deadline = time.monotonic() + 5
+    while writer.rows_written < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert count_rows(engine) == 1
+    writer.close()
+
+
+def test_buffered_writer_close_flushes(engine):
+    writer = BufferedWriter(engine, Reading.__table__, max_rows=1000, max_age_s=60).start()
+    for i in range(3):
+        writer.add_many(to_reading_rows('soil_temp', {'temp_c': i}))
+    writer.close()
+    assert count_rows(engine) == 3
+
+
+def test_buffered_writer_rejects_bad_rows(engine):
+    writer = BufferedWriter(engine, Reading.__table__, max_rows=1000, max_age_s=60)
+    rows = [{"sensor_id": "soil_temp", "metric": "temp_c", "ts": i, "value": float(i)} for i in range(10)]
+    # NOT NULL value, fails the whole batch
+    rows[3]["value"] = None
+    writer.add_many(rows)
+    assert writer.flush() == 9
+    assert writer.rows_rejected == 1 and list(writer.rejected) == [rows[3]]
+    assert writer.pending() == 0 and count_rows(engine) == 9
+
+
+def test_buffered_writer_retries_locked_database(engine, monkeypatch):
+    writer = BufferedWriter(engine, Reading.__table__, max_rows=1000, max_age_s=60)
+    writer.add_many(to_reading_rows('soil_temp', {'temp_c': 1}))
+    write = writer._write
+
+    def locked(rows):
+        raise OperationalError('INSERT', {}, Exception('database is locked'))
+    monkeypatch.setattr(writer, '_write', locked)
+    assert writer.flush() == 0 and writer.flush() == 0
+    assert writer.pending() == 1 and not writer._due()
+
+    monkeypatch.setattr(writer, '_write', write)
+    assert writer.flush() == 1 and writer.rows_rejected == 0
+
+
+def test_buffered_writer_keeps_rows_while_locked(tmp_path):
+    path = tmp_path / 'sensordata.db'
+    # fail at once instead of waiting for the lock
+    engine = create_engine(f'sqlite:///{path}', connect_args={'timeout': 0})
+    Base.metadata.create_all(engine)
+    writer = BufferedWriter(engine, Reading.__table__, max_rows=1000, max_age_s=60, max_queue=100)
+    for i in range(10):
+        writer.add_many(to_reading_rows('soil_temp', {'temp_c': i}, ts=i))
+
+    # e.g. a VACUUM or a backup holding the write lock
+    lock = sqlite3.connect(path, isolation_level=None)
+    lock.execute('BEGIN IMMEDIATE')
+    for _ in range(20):
+        assert writer.flush() == 0
+    assert writer.rows_rejected == 0 and writer.pending() == 10
+    lock.execute('ROLLBACK')
+    lock.close()
+
+    assert writer.flush() == 10
+    assert writer.rows_rejected == 0 and count_rows(engine) == 10
+
+
+def test_range_query_uses_index(engine):
+    with engine.connect() as conn:
+        plan = conn.execute(text(
+            "EXPLAIN QUERY PLAN SELECT ts, value FROM readings "
+            "WHERE sensor_id = 'soil_temp' AND metric = 'temp_c' AND ts BETWEEN 0 AND 10 ORDER BY ts"
+        )).all()
+    assert 'ix_readings_sensor_metric_ts' in ' '.join(str(row) for row in plan)
+
+
+def test_migrate_legacy_rows(engine):
+    created_at = datetime(2025, 4, 6, 3, 6, 47)
+    with engine.begin() as conn:
+        conn.execute(SensorReading.__table__.insert(), [
+            {"sensor_type": "soil_temp", "raw_data": json.dumps({"temp_c": 20 + i}), "created_at": created_at}
+            for i in range(7)
+        ] + [{"sensor_type": "soil_temp", "raw_data": "not json", "created_at": created_at}])
+
+    report = migrate(engine, chunk_size=3)
+    assert report["rows"] == 8
+    assert report["readings"] == 7
+    assert report["last_id"] == 8
+
+    ts = int(created_at.replace(tzinfo=timezone.utc).timestamp() * 1000)
+    values = query_readings('soil_temp', 'temp_c', ts, ts, bind=engine)
+    assert sorted(v for _, v in values) == [20.0 + i for i in range(7)]
+
+    # nothing left to migrate past the last id
+    assert migrate(engine, resume_from=report["last_id"])["rows"] == 0
+    # running again continues from the stored id instead of copying twice
+    assert migrate(engine)["rows"] == 0
+    assert count_rows(engine) == 7
+
+
+def test_rollups_incremental(engine):
+    from datastore import Rollup1m, Rollup1h, rebuild_rollups
+    minute = 60 * 1000
+    writer = BufferedWriter(engine, Reading.__table__, max_rows=1000, max_age_s=60, on_flush=update_rollups)
+    # two flushes touching the same buckets must merge, not overwrite
+    for chunk in (range(0, 90), range(90, 180)):
+        for i in chunk:
+            writer.add_many(to_reading_rows('soil_temp', {'temp_c': i}, ts=i * 1000))
+        writer.flush()
+
+    resolution, rows = query_series('soil_temp', 'temp_c', 0, 179 * 1000, max_points=10, bind=engine)
+    assert resolution == '1m'
+    assert rows == [
+        (0, 29.5, 0.0, 59.0, 60),
+        (minute, 89.5, 60.0, 119.0, 60),
+        (2 * minute, 149.5, 120.0, 179.0, 60),
+    ]
+
+    resolution, rows = query_series('soil_temp', 'temp_c', 0, 179 * 1000, resolution='1h', bind=engine)
+    assert rows == [(0, 89.5, 0.0, 179.0, 180)]
+
+    with engine.begin() as conn:
+        before = conn.execute(select(Rollup1m.__table__)).all()
+        rebuild_rollups(conn, 0, 179 * 1000)
+        assert conn.execute(select(Rollup1m.__table__)).all() == before
+        assert conn.execute(select(func.count()).select_from(Rollup1h.__table__)).scalar() == 1
+
+
+def test_pick_resolution():
+    day = 24 * 60 * 60 * 1000
+    assert pick_resolution(0, 60 * 60 * 1000, 500) == '1m'
+    assert pick_resolution(0, 7 * day, 500) == '1h'
+    assert pick_resolution(0, 90 * day, 500) == '1d'
+    assert pick_resolution(0, 5000 * day, 500) == '1d'
+
+
+def test_apply_retention(engine):
+    from datastore.retention import apply_retention, load_policy
+    day = 24 * 60 * 60 * 1000
+    now = 100 * day
+    with engine.begin() as conn:
+        rows = [
+            {"sensor_id": "soil_temp", "metric": "temp_c", "ts": ts, "value": 20.0}
+            for ts in range(80 * day, now, 60 * 1000)
+        ]
+        conn.execute(Reading.__table__.insert(), rows)
+        update_rollups(conn, rows)
+
+    policy = load_policy()
+    policy['batch_size'] = 1000
+    report = apply_retention(policy, engine=engine, now=now)
+
+    # 14 days of raw readings and 30 days of 1m rollups survive, 1h/1d are kept
+    assert report['deleted']['readings'] == 6 * 24 * 60
+    assert report['deleted']['rollup_1m'] == 0
+    assert report['deleted']['rollup_1h'] == 0
+    assert 'rollup_1d' not in report['deleted']
+    assert count_rows(engine) == 14 * 24 * 60
+    assert report['seconds'] >= 0
+    assert report['bytes_reclaimed'] == report['bytes_before'] - report['bytes_after']
+
+    # retention never converts the database itself, that is a full VACUUM
+    with engine.connect() as conn:
+        assert conn.execute(text('PRAGMA auto_vacuum')).scalar() == 0
+
+    # once converted, a run releases pages in place
+    assert enable_incremental_vacuum(engine) and not enable_incremental_vacuum(engine)
+    with engine.begin() as conn:
+        conn.execute(Reading.__table__.delete())
+    report = apply_retention(policy, engine=engine, now=now)
+    assert report['bytes_reclaimed'] > 0
+
+
+def test_production_engine_profile(tmp_path):
+    from datastore.db import create_sqlite_engine
+    path = tmp_path / 'profile.db'
+    writer = create_sqlite_engine(path, 'production')
+    reader = create_sqlite_engine(path, 'production', readonly=True)
+    Base.metadata.create_all(writer)
+
+    with writer.connect() as conn:
+        assert conn.exec_driver_sql('PRAGMA journal_mode').scalar() == 'wal'
+        assert conn.exec_driver_sql('PRAGMA synchronous').scalar() == 1 # NORMAL
+        assert conn.exec_driver_sql('PRAGMA busy_timeout').scalar() == 10000
+    assert writer.pool.size() == 1
+
+    with writer.begin() as conn:
+        conn.execute(Reading.__table__.insert(), to_reading_rows('soil_temp', {'temp_c': 1}, ts=1))
+    assert query_readings('soil_temp', 'temp_c', 0, 1, bind=reader) == [(1, 1.0)]
+
+    with reader.connect() as conn:
+        assert conn.exec_driver_sql('PRAGMA query_only').scalar() == 1
+        with pytest.raises(Exception):
+            conn.execute(Reading.__table__.delete())
+
+
+def test_async_store(engine):
+    import asyncio
+    from datastore.aio import AsyncStore
+
+    async def run():
+        store = await AsyncStore(engine=engine, read_engine=engine, max_rows=50).start()
+        for i in range(120):
+            await store.add('esphome_bin1', {'moisture': i}, ts=i)
+        store.add_nowait('esphome_bin1', {'moisture': 120}, ts=120)
+        await store.flush()
+
+        values = [value async for _, value in store.iter_readings('esphome_bin1', 'moisture', 0, 200, chunk=25)]
+        rows = await store.query_readings('esphome_bin1', 'moisture', 100, 200)
+        await store.close()
+        return values, rows
+
+    values, rows = asyncio.run(run())
+    assert values == [float(i) for i in range(121)]
+    assert len(rows) == 21
+
+
+def test_async_store_listeners_run_off_the_loop(engine):
+    import asyncio
+    import threading
+    from datastore import add_listener, remove_listener
+    from datastore.aio import AsyncStore
+
+    seen = []
+
+    def listener(rows):
+        seen.append((threading.current_thread().name, [row['value'] for row in rows]))
+
+    async def run():
+        store = await AsyncStore(engine=engine, read_engine=engine, max_queue=1).start()
+        store.add_nowait('esphome_bin1', {'moisture': 1}, ts=1)
+        # the queue is full, the rejected reading is never seen
+        with pytest.raises(asyncio.QueueFull):
+            store.add_nowait('esphome_bin1', {'moisture': 2}, ts=2)
+        await store.close()
+
+    add_listener(listener)
+    try:
+        asyncio.run(run())
+    finally:
+        remove_listener(listener)
+    assert [values for _, values in seen] == [[1.0]]
+    assert seen[0][0].startswith('datastore-aio-write')
+
+
+def test_iter_readings(engine):
+    from datastore import iter_readings
+    with engine.begin() as conn:
+        # duplicate timestamps must not be skipped or repeated across chunks
+        conn.execute(Reading.__table__.insert(), [
+            {"sensor_id": "soil_temp", "metric": "temp_c", "ts": i // 2, "value": float(i)}
+            for i in range(1000)
+        ])
+
+    chunks = list(iter_readings('soil_temp', 'temp_c', 0, 10 ** 6, chunk=64, bind=engine))
+    assert all(len(c) == 64 for c in chunks[:-1])
+    assert [value for c in chunks for _, value in c] == [float(i) for i in range(1000)]
+
+    arrays = list(iter_readings('soil_temp', 'temp_c', 100, 199, chunk=64, as_numpy=True, bind=engine))
+    ts = [t for t_array, _ in arrays for t in t_array.tolist()]
+    assert ts == [i // 2 for i in range(200, 400)]
+    assert arrays[0][0].dtype.name == 'int64' and arrays[0][1].dtype.name == 'float64'
+
+
+def test_add_sensor_readings_single_batch(engine):
+    from datastore import add_sensor_readings
+
+    ts = "2025-04-06:03:06:47.000000Z"
+    rows = add_sensor_readings([
+        ('soil_temp', {"temp_c": 19.5, "ts": ts}),
+        ('air_temp_humidity', {"temp_c": 22.0, "humidity": 41, "ts": ts}),
+    ], bind=engine)
+    assert rows == 3
+    assert count_rows(engine) == 3
+
+
+def test_bulk_load_wide_csv(engine, tmp_path):
+    from sqlalchemy import inspect
+    from datastore.bulk import load_csv
+    from datastore import Rollup1h
+
+    path = tmp_path / 'history.csv'
+    path.write_text(
+        'timestamp_ms,temperature_celsius,temperature_fahrenheit\n'
+        '1744518653000,19.5,67.1\n'
+        '1744518713000,22.5,72.5\n'
+        '1744518773000,21.0,69.8\n'
+    )
+    report = load_csv(engine, path, chunk_rows=2, sensor_id='soil_temp', ts_column='timestamp_ms', drop_indexes=True)
+    assert report['rows'] == 6
+    assert query_readings('soil_temp', 'temperature_celsius', 0, 1744518773000, bind=engine) == [
+        (1744518653000, 19.5), (1744518713000, 22.5), (1744518773000, 21.0),
+    ]
+    # indexes are back and rollups cover the load
+    names = {index['name'] for index in inspect(engine).get_indexes('readings')}
+    assert {'ix_readings_sensor_metric_ts', 'ix_readings_ts'} <= names
+    assert count_rows(engine, Rollup1h.__table__) >= 2
+
+
+def test_bulk_load_long_dataframe(engine):
+    import pandas as pd
+    from datastore.bulk import load_dataframe
+
+    df = pd.DataFrame({
+        'sensor_id': ['a', 'a', 'b'],
+        'metric': ['temp', 'temp', 'temp'],
+        'ts': ['2025-04-06 03:06:47', '2025-04-06 03:06:48', '2025-04-06 03:06:47'],
+        'value': [1.0, 2.0, 3.0],
+    })
+    assert load_dataframe(engine, df)['rows'] == 3
+    ts = int(datetime(2025, 4, 6, 3, 6, 47, tzinfo=timezone.utc).timestamp() * 1000)
+    assert query_readings('b', 'temp', ts, ts, bind=engine) == [(ts, 3.0)]
+
+
+def test_bulk_load_keeps_rollups_past_retention(engine):
+    import pandas as pd
+    from datastore.bulk import load_dataframe
+
+    day = 24 * 60 * 60 * 1000
+    # a day whose raw readings retention already deleted, only its rollups are left
+    with engine.begin() as conn:
+        update_rollups(conn, [{"sensor_id": "a", "metric": "temp", "ts": 10 * 60 * 1000 * i, "value": 10.0} for i in range(144)])
+
+    df = pd.DataFrame({'sensor_id': ['a'] * 2, 'metric': ['temp'] * 2, 'ts': [30 * 1000, 2 * day], 'value': [40.0, 1.0]})
+    load_dataframe(engine, df, chunk_rows=1)
+    resolution, rows = query_series('a', 'temp', 0, 3 * day - 1, resolution='1d', bind=engine)
+    assert rows == [(0, 1480.0 / 145, 10.0, 40.0, 145), (2 * day, 1.0, 1.0, 1.0, 1)]
+
+
+def test_archive_union_and_watermark(engine, tmp_path):
+    pytest.importorskip('pyarrow')
+    from datastore.archive import export_closed_days, query_history, scan_history, watermark, archived_days
+
+    day = 24 * 60 * 60 * 1000
+    base = int(datetime(2025, 4, 1, tzinfo=timezone.utc).timestamp() * 1000)
+    rows = []
+    for d in range(3):
+        for h in range(0, 24, 6):
+            ts = base + d * day + h * 60 * 60 * 1000
+            rows.append({"sensor_id": "soil_temp", "metric": "temp_c", "ts": ts, "value": float(d * 100 + h)})
+            rows.append({"sensor_id": "light_fullspectrum", "metric": "lux", "ts": ts, "value": 1.0})
+    with engine.begin() as conn:
+        conn.execute(Reading.__table__.insert(), rows)
+
+    root = tmp_path / 'archive'
+    zones = {"soil_temp": "1"}
+    # the third day is still open
+    report = export_closed_days(engine=engine, root=root, now=base + 2 * day + 1000, zones=zones)
+    assert report == {"days": 2, "rows": 16, "late_rows": 0, "seconds": report['seconds']}
+    assert archived_days(root) == ['2025-04-01', '2025-04-02']
+    assert (root / 'date=2025-04-01' / 'zone=1' / 'readings.parquet').exists()
+    assert (root / 'date=2025-04-01' / 'zone=0' / 'readings.parquet').exists()
+    assert watermark(root) == base + 2 * day
+
+    # archived rows may still be in SQLite, they are served once
+    history = query_history('soil_temp', 'temp_c', base, base + 3 * day, bind=engine, root=root)
+    assert [v for _, v in history] == [0, 6, 12, 18, 100, 106, 112, 118, 200, 206, 212, 218]
+    assert [ts for ts, _ in history] == sorted(ts for ts, _ in history)
+
+    # archived days deleted from SQLite are still served
+    with engine.begin() as conn:
+        conn.execute(Reading.__table__.delete().where(Reading.ts < base + 2 * day))
+    df = scan_history(base + day, base + 3 * day, sensor_ids=['soil_temp'], bind=engine, root=root)
+    assert sorted(df['value']) == [100, 106, 112, 118, 200, 206, 212, 218]
+
+    # nothing new to archive on the same day
+    assert export_closed_days(engine=engine, root=root, now=base + 2 * day + 2000, zones=zones)['days'] == 0
+
+    # a late row for an archived day is appended to the day, once
+    late = base + day + 30 * 60 * 1000
+    with engine.begin() as conn:
+        conn.execute(Reading.__table__.insert(), [{"sensor_id": "soil_temp", "metric": "temp_c", "ts": late, "value": 130.0}])
+    report = export_closed_days(engine=engine, root=root, now=base + 2 * day + 3000, zones=zones)
+    assert (report['days'], report['late_rows']) == (0, 1)
+    assert export_closed_days(engine=engine, root=root, now=base + 2 * day + 4000, zones=zones)['late_rows'] == 0
+    with engine.begin() as conn:
+        conn.execute(Reading.__table__.delete().where(Reading.ts < base + 2 * day))
+    history = query_history('soil_temp', 'temp_c', base + day, base + 2 * day - 1, bind=engine, root=root)
+    assert [v for _, v in history] == [100, 130, 106, 112, 118]
@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+from tests.mock.sensors import generate_temperature_data, generate_chunks, stream_to_csv, stream_to_datastore
+
+
+def test_generate_temperature_data_daily_cycle():
+    df = generate_temperature_data(start_date='2025-04-01 00:00:00', num_days=1, interval_seconds=3600, add_noise=False)
+    assert len(df) == 24
+    assert df['timestamp_ms'].diff().dropna().eq(3600 * 1000).all()
+    # hour 6 is the peak of 25 + 3 sin(h pi / 12)
+    assert df['temperature_celsius'].iloc[6] == 28
+
+
+def test_generate_chunks_bounded():
+    chunks = list(generate_chunks(['a', 'b', 'c'], ['temp', 'humidity'], start_date='2025-04-01 00:00:00',
+                                  num_readings=1000, interval_seconds=60, chunk_rows=600, seed=1))
+    assert all(len(df) <= 600 for df in chunks)
+    df = pd.concat(chunks)
+    assert len(df) == 3 * 2 * 1000
+    assert df.groupby(['sensor_id', 'metric'], observed=True).size().eq(1000).all()
+    series = df[(df['sensor_id'] == 'a') & (df['metric'] == 'temp')]
+    assert series['ts'].is_monotonic_increasing
+    assert series['ts'].iloc[0] == np.datetime64('2025-04-01T00:00:00', 'ms').astype('int64')
+    assert df[df['metric'] == 'humidity']['value'].between(0, 100).all()
+
+
+def test_stream_outputs(tmp_path):
+    def chunks():
+        return generate_chunks(['a', 'b'], ['temp'], num_readings=500, chunk_rows=300, seed=1)
+
+    assert stream_to_csv(chunks(), tmp_path / 'readings.csv') == 1000
+    assert len(pd.read_csv(tmp_path / 'readings.csv')) == 1000
+
+    engine = create_engine(f'sqlite:///{tmp_path / "readings.db"}')
+    assert stream_to_datastore(chunks(), engine) == 1000
+    with engine.connect() as conn:
+        assert conn.execute(text('SELECT count(*) FROM readings')).scalar() == 1000
@@ -0,0 +1,121 @@
+import hashlib
+
+import cv2
+import numpy as np
+import pytest
+from sqlalchemy import create_engine, inspect, text
+
+from datastore.photos import PhotoPipeline, PhotoStore, hamming, ingest_photo, jpeg_size, list_photos, setup
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "sensordata.db"}')
+    setup(engine)
+    return engine
+
+
+def write_jpeg(path, seed, width=2592, height=1944):
+    # smooth random scene, like a photo it survives downscaling
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 255, (6, 8, 3), dtype=np.uint8)
+    image = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+    cv2.imwrite(str(path), image)
+    return path
+
+
+def test_ingest_writes_sizes_and_row(engine, tmp_path):
+    path = write_jpeg(tmp_path / 'a.jpg', 0)
+    assert jpeg_size(path) == (2592, 1944)
+
+    photo_id = ingest_photo(path, device_path='/dev/video1', zone='1', ts=1000, engine=engine, root=tmp_path / 'derived')
+    [row] = list_photos(bind=engine)
+    assert row.id == photo_id and row.resolution == '2592x1944' and row.zone == '1'
+    assert cv2.imread(row.thumbnail_path).shape == (240, 320, 3)
+    assert cv2.imread(row.preview_path).shape == (960, 1280, 3)
+
+
+def test_pipeline_marks_duplicates(engine, tmp_path):
+    paths = [write_jpeg(tmp_path / f'{i}.jpg', seed) for i, seed in enumerate([0, 0, 1])]
+    pipeline = PhotoPipeline(engine, workers=2, root=tmp_path / 'derived').start()
+    for ts, path in enumerate(paths):
+        # in order, each is compared with the previous photo of the camera
+        pipeline.submit(path, device_path='/dev/video1', ts=ts).result()
+    pipeline.close()
+    assert pipeline.processed == 3 and pipeline.errors == 0
+
+    assert [row.ts for row in list_photos(bind=engine)] == [2, 0]
+    assert len(list_photos(bind=engine, duplicates=True)) == 3
+    assert hamming('00000000000000ff', '0000000000000000') == 8
+
+
+def test_store_layout_dedup_and_nearest(engine, tmp_path):
+    store = PhotoStore(tmp_path / 'store', engine)
+    data = write_jpeg(tmp_path / 'a.jpg', 0, 64, 48).read_bytes()
+    day = 1743897600000 # 2025-04-06 UTC
+
+    photo_id, path, stored = store.put(data, device_path='/dev/video1', zone='1', ts=day + 1000)
+    assert stored
+    sha256 = hashlib.sha256(data).hexdigest()
+    assert path == str(tmp_path / 'store' / '2025-04-06' / 'video1' / f'{sha256}.jpg')
+    assert store.get(sha256).id == photo_id
+    # the same frame again is not written twice
+    assert store.put(data, device_path='/dev/video1', zone='1', ts=day + 2000) == (photo_id, path, False)
+
+    for i, ts in enumerate([day + 60000, day + 120000]):
+        store.put(write_jpeg(tmp_path / f'{i}.jpg', i + 1, 64, 48).read_bytes(), device_path='/dev/video2', zone='2', ts=ts)
+    assert store.nearest(day + 80000, zone='2').ts == day + 60000
+    assert store.nearest(day + 100000, zone='2').ts == day + 120000
+    assert store.nearest(day, zone='2').ts == day + 60000
+    assert store.nearest(day, zone='1').id == photo_id
+    assert store.nearest(day, zone='3') is None
+
+    # processing fills in the row written by put()
+    ingest_photo(path, engine=engine)
+    [row] = list_photos(device_path='/dev/video1', bind=engine)
+    assert row.id == photo_id and row.thumbnail_path.startswith(str(tmp_path / 'store' / '2025-04-06'))
+
+
+def test_setup_upgrades_old_table(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "old.db"}')
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TABLE photos (id INTEGER PRIMARY KEY, filepath VARCHAR, resolution VARCHAR, zone VARCHAR, device_path VARCHAR)'))
+        conn.execute(text("INSERT INTO photos (filepath) VALUES ('photos/old.jpg')"))
+    setup(engine)
+    assert {'sha256', 'dhash', 'ts'} <= {c['name'] for c in inspect(engine).get_columns('photos')}
+    assert 'ix_photos_zone_ts' in {i['name'] for i in inspect(engine).get_indexes('photos')}
+    assert len(list_photos(bind=engine)) == 1
+
+
+def test_setup_makes_sha256_unique(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "old.db"}')
+    setup(engine)
+    with engine.begin() as conn:
+        conn.execute(text('DROP INDEX ix_photos_sha256'))
+        conn.execute(text('CREATE INDEX ix_photos_sha256 ON photos (sha256)'))
+        conn.execute(text("INSERT INTO photos (filepath, sha256) VALUES ('a.jpg', 'ab'), ('b.jpg', 'ab'), ('c.jpg', NULL), ('d.jpg', NULL)"))
+    setup(engine)
+    [index] = [i for i in inspect(engine).get_indexes('photos') if i['name'] == 'ix_photos_sha256']
+    assert index['unique']
+    # the oldest row keeps the hash
+    with engine.connect() as conn:
+        rows = conn.execute(text('SELECT filepath, sha256 FROM photos ORDER BY id')).all()
+    assert [tuple(row) for row in rows] == [('a.jpg', 'ab'), ('b.jpg', None), ('c.jpg', None), ('d.jpg', None)]
+
+
+def test_put_returns_the_row_of_a_concurrent_writer(engine, tmp_path):
+    store = PhotoStore(tmp_path / 'store', engine)
+    data = write_jpeg(tmp_path / 'a.jpg', 0, 64, 48).read_bytes()
+    day = 1743897600000 # 2025-04-06 UTC
+
+    def path_for(sha256, device_path, ts_ms):
+        # the other writer inserts between our check and our insert
+        with engine.begin() as conn:
+            conn.execute(text("INSERT INTO photos (id, filepath, sha256) VALUES (7, '/store/other.jpg', :sha256)"), {"sha256": sha256})
+        return PhotoStore.path_for(store, sha256, device_path, ts_ms)
+
+    store.path_for = path_for
+    assert store.put(data, device_path='/dev/video1', ts=day) == (7, '/store/other.jpg', False)
+    assert len(list_photos(bind=engine)) == 1
+    # our copy is not left behind
+    assert not list((tmp_path / 'store').rglob('*.jpg'))
@@ -0,0 +1,37 @@
+import pytest
+from sqlalchemy import create_engine
+
+from datastore import photos, plants
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "sensordata.db"}')
+    photos.setup(engine)
+    plants.setup(engine)
+    return engine
+
+
+def shape(filepath, area, **kwargs):
+    return {
+        "filepath": filepath, "area": area, "perimeter": 40.0, "x": 1, "y": 2, "width": 10, "height": 5,
+        "aspect_ratio": 2.0, "roi": '0,0,100,100', "working_width": 100, **kwargs,
+    }
+
+
+def test_record_links_photos_and_replaces(engine):
+    with engine.begin() as conn:
+        photo_id = conn.execute(photos.Photo.__table__.insert().values(
+            filepath='/store/a.jpg', zone='1', device_path='/dev/video1', ts=5000,
+        )).inserted_primary_key[0]
+
+    assert plants.record_shapes([shape('/store/a.jpg', 50.0), shape('/other/b.jpg', 0.0, ts=1000, zone='2')], engine) == 2
+    [a] = plants.query_shapes(zone='1', bind=engine)
+    assert (a.photo_id, a.ts, a.device_path, a.area) == (photo_id, 5000, '/dev/video1', 50.0)
+    [b] = plants.query_shapes(zone='2', bind=engine)
+    assert (b.photo_id, b.ts) == (None, 1000)
+
+    # analysing again replaces the row
+    plants.record_shapes([shape('/store/a.jpg', 80.0)], engine)
+    assert [row.area for row in plants.query_shapes(bind=engine)] == [0.0, 80.0]
+    assert plants.analysed(['/store/a.jpg', '/store/c.jpg'], bind=engine) == {'/store/a.jpg'}
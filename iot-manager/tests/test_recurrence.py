@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta
+
+from services.recurrence import Rule, make_rule, action_path
+
+
+def job(metadata):
+    return metadata
+
+
+def test_next_index():
+    start = datetime(2025, 4, 1, 8, 0, 0)
+    rule = make_rule('light_cwww.on', job, start, 24 * 60 * 60, {"type": "light_cwww"})
+    assert rule.action.endswith('test_recurrence.job')
+
+    assert rule.next_index(start - timedelta(days=3)) == 0
+    assert rule.next_index(start) == 0
+    assert rule.next_index(start + timedelta(seconds=1)) == 1
+    assert rule.next_index(start + timedelta(days=30)) == 30
+    assert rule.occurrence(30) == datetime(2025, 5, 1, 8, 0, 0)
+
+
+def test_count_limits_occurrences():
+    rule = Rule('camera.photo', 'services.worker.job_camera_photo', '2025-04-01T10:00:00', 12 * 60 * 60, count=4)
+    assert [i for i in range(6) if rule.valid_index(i)] == [0, 1, 2, 3]
+    assert not rule.valid_index(-1)
+
+
+def test_job_id_is_deterministic():
+    rule = Rule('sensors.read', 'services.worker.job_read_sensors', '2025-04-01T00:00:00', 60)
+    assert rule.job_id(7) == rule.job_id(7)
+    assert ':' not in rule.job_id(7)
+    assert action_path('services.worker.job_read_sensors') == 'services.worker.job_read_sensors'
+
+
+def test_restarted_rule_maps_to_the_same_occurrences():
+    # the same daily rule added at two startups, each starting that day
+    first = make_rule('light_cwww.on', job, datetime(2025, 4, 1, 8, 0, 0), 24 * 60 * 60)
+    restarted = make_rule('light_cwww.on', job, datetime(2025, 4, 5, 8, 0, 0), 24 * 60 * 60)
+    assert first.job_id(5) == restarted.job_id(1)
+
+    assert restarted.index_of(datetime(2025, 4, 7, 8, 0, 0)) == 2
+    # an occurrence of a rule whose time changed is not one of the new rule's
+    assert restarted.index_of(datetime(2025, 4, 7, 9, 0, 0)) is None
@@ -0,0 +1,52 @@
+import multiprocessing
+
+import numpy as np
+
+from datastore.ring import Ring, RingStore
+
+
+def test_latest_and_window(tmp_path):
+    ring = Ring(tmp_path / 'soil_temp@temp', capacity=4, create=True)
+    assert ring.latest() is None
+    assert len(ring.window()[0]) == 0
+
+    for i in range(6):
+        ring.append(1000 + i, float(i))
+    assert ring.latest() == (1005, 5.0)
+    ts, values = ring.window()
+    # oldest samples were overwritten
+    assert ts.tolist() == [1002, 1003, 1004, 1005]
+    assert values.tolist() == [2.0, 3.0, 4.0, 5.0]
+    assert ring.window(n=2)[0].tolist() == [1004, 1005]
+    assert ring.window(since=1004)[1].tolist() == [4.0, 5.0]
+    assert ring.written() == 6
+
+
+def test_existing_ring_keeps_capacity(tmp_path):
+    Ring(tmp_path / 'r', capacity=8, create=True).append(1, 1.0)
+    ring = Ring(tmp_path / 'r', capacity=100, create=True)
+    assert ring.capacity == 8
+    assert ring.latest() == (1, 1.0)
+
+
+def writer(root, count):
+    store = RingStore(root, capacity=64)
+    for i in range(count):
+        store.write_rows([{"sensor_id": "soil_temp", "metric": "temp", "ts": i, "value": float(i)}])
+
+
+def test_reader_in_other_process(tmp_path):
+    store = RingStore(tmp_path, capacity=64)
+    assert store.latest('soil_temp', 'temp') is None
+
+    process = multiprocessing.get_context('fork').Process(target=writer, args=(tmp_path, 5000))
+    process.start()
+    while process.is_alive():
+        ts, values = store.window('soil_temp', 'temp')
+        # every window is consistent: consecutive samples, value == ts
+        assert np.array_equal(ts.astype('float64'), values)
+        assert np.all(np.diff(ts) == 1)
+    process.join()
+
+    assert store.latest('soil_temp', 'temp') == (4999, 4999.0)
+    assert store.series() == [('soil_temp', 'temp')]
@@ -0,0 +1,47 @@
+import pytest
+
+import devices
+from devices.simulator import Simulator, SimulatedReadError, load_simulator, make_virtual_sensors
+from devices.sweep import sweep
+
+
+@pytest.fixture
+def simulator():
+    simulator = devices.use_backend(Simulator(seed=1))
+    yield simulator
+    devices.use_backend(None)
+
+
+def test_sensor_classes_read_the_backend(simulator):
+    data = devices.SoilTempSensor({}).measure()
+    assert set(data) == {'temp', 'ts'}
+    assert -10 <= data['temp'] <= 50
+    data = devices.LightSensor({}).measure()
+    assert {'light_total', 'light_ir', 'light_visible', 'light_fullspectrum'} <= set(data)
+    assert simulator.stats()['reads'] == 2
+
+
+def test_diurnal_cycle():
+    simulator = Simulator(seed=1, signals={'temp': (24.0, 3.0, 15, 0.0, -10.0, 50.0)})
+    afternoon = simulator.value('temp', 15 * 3600, 'probe')
+    night = simulator.value('temp', 3 * 3600, 'probe')
+    assert afternoon - night == pytest.approx(6.0, abs=0.1)
+    # light is zero at night
+    assert simulator.value('light_total', 1 * 3600, 'probe') == 0.0
+
+
+def test_failures_and_sweep(simulator):
+    simulator.failure_rate = 0.5
+    sensors = make_virtual_sensors(60)
+    report = sweep(sensors, max_workers=8)
+    assert len(report['readings']) + len(report['errors']) == 60
+    assert 0 < len(report['errors']) < 60
+    assert simulator.stats()['failures'] == len(report['errors'])
+    with pytest.raises(SimulatedReadError):
+        Simulator(failure_rate=1.0).read({"chip": "ds18b20"})
+
+
+def test_load_config():
+    simulator = load_simulator(latency_s=0)
+    assert simulator.latency_s == 0
+    assert simulator.signals['temp'][0] == 24.0
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from datastore.stats import SeriesStats, StatsRegistry
+
+
+def test_matches_batch_statistics():
+    rng = np.random.default_rng(0)
+    ts = np.arange(500) * 10000 # every 10s
+    values = 20 + rng.normal(0, 2, len(ts))
+    stats = SeriesStats(tau_s=300, window_s=600)
+    for t, v in zip(ts.tolist(), values.tolist()):
+        stats.update(t, v)
+
+    snapshot = stats.snapshot()
+    assert snapshot['count'] == 500
+    assert snapshot['mean'] == pytest.approx(values.mean())
+    assert snapshot['std'] == pytest.approx(values.std(ddof=1))
+    # the window covers the last 61 samples, 600s inclusive
+    assert snapshot['min'] == pytest.approx(values[-61:].min())
+    assert snapshot['max'] == pytest.approx(values[-61:].max())
+
+    weights = np.exp(-(ts[-1] - ts) / 1000 / 300)
+    weights[1:] *= 1 - np.exp(-10 / 300)
+    assert snapshot['ewma'] == pytest.approx((weights * values).sum() / weights.sum(), rel=1e-3)
+
+
+def test_slope():
+    stats = SeriesStats(tau_s=600)
+    # 0.5 units per minute over a day, sampled irregularly
+    rng = np.random.default_rng(1)
+    ts = np.cumsum(rng.integers(5000, 60000, 2000))
+    for t in ts.tolist():
+        stats.update(t, 10 + 0.5 * t / 60000)
+    assert stats.slope * 60 == pytest.approx(0.5)
+    assert SeriesStats().slope == 0.0
+
+
+def test_late_samples_are_ignored():
+    stats = SeriesStats()
+    assert stats.update(2000, 1.0)
+    assert not stats.update(1000, 100.0)
+    assert stats.snapshot()['max'] == 1.0
+
+
+def test_checkpoint_round_trip(tmp_path):
+    path = tmp_path / 'stats.json'
+    registry = StatsRegistry(path, checkpoint_s=0)
+    registry.update_rows([
+        {"sensor_id": "soil_temp", "metric": "temp", "ts": i * 1000, "value": float(i % 7)} for i in range(100)
+    ])
+    assert path.exists()
+
+    restored = StatsRegistry(path)
+    assert restored.get('soil_temp', 'temp') == registry.get('soil_temp', 'temp')
+    assert restored.get('soil_temp', 'humidity') is None
+
+    # both continue identically from the checkpoint
+    for r in (registry, restored):
+        r.update('soil_temp', 'temp', 200000, 3.0)
+    assert restored.get('soil_temp', 'temp') == registry.get('soil_temp', 'temp')
+
+
+def test_processes_sharing_a_checkpoint_keep_their_updates(tmp_path):
+    path = tmp_path / 'stats.json'
+    # e.g. the worker and the ESPHome client
+    worker = StatsRegistry(path, checkpoint_s=0)
+    client = StatsRegistry(path, checkpoint_s=3600)
+    client.update('esphome_bin1', 'moisture', 1000, 40.0)
+
+    worker.update_rows([{"sensor_id": "soil_temp", "metric": "temp", "ts": 2000, "value": 20.0}])
+    client.update('esphome_bin1', 'moisture', 3000, 42.0)
+    client.checkpoint()
+    assert client.get('soil_temp', 'temp')['value'] == 20.0
+    assert client.get('esphome_bin1', 'moisture')['count'] == 2
+
+    # the worker writes again, the client's series survive in the file
+    worker.update_rows([{"sensor_id": "soil_temp", "metric": "temp", "ts": 4000, "value": 21.0}])
+    restored = StatsRegistry(path)
+    assert restored.get('esphome_bin1', 'moisture')['value'] == 42.0
+    assert restored.get('soil_temp', 'temp')['count'] == 2
@@ -0,0 +1,92 @@
+import threading
+import time
+
+import devices
+from devices import Sensor, bus
+from devices.sweep import bus_key, sweep
+
+
+class SlowSensor(Sensor):
+    active = {}
+    lock = threading.Lock()
+
+    def __init__(self, sensor_type, device_path, seconds=0.1, fail=False):
+        super().__init__({})
+        self.sensor_type = sensor_type
+        self.device_path = device_path
+        self.seconds = seconds
+        self.fail = fail
+        self.overlapped = False
+
+    def measure(self):
+        key = bus_key(self.device_path)
+        with self.lock:
+            self.overlapped = self.active.get(key, 0) > 0
+            self.active[key] = self.active.get(key, 0) + 1
+        time.sleep(self.seconds)
+        with self.lock:
+            self.active[key] -= 1
+        if self.fail:
+            raise IOError('no ack')
+        return {"value": 1, "ts": "2025-04-06:03:06:47.000000Z"}
+
+
+def test_bus_key():
+    # every mux channel shares the upstream bus
+    assert bus_key({"connection": "i2c", "bus": 1, "multiplex": 0, "channel": 2}) == ('i2c', 1)
+    assert bus_key({"connection": "i2c", "bus": 1, "multiplex": 1, "channel": 0}) == ('i2c', 1)
+    assert bus_key({"connection": "i2c", "bus": 3}) != ('i2c', 1)
+    assert bus_key({"connection": "gpio", "pin": 4}) != bus_key({"connection": "gpio", "pin": 23})
+
+
+def test_independent_buses_run_concurrently():
+    sensors = [
+        SlowSensor('air_temp_humidity', {"connection": "gpio", "pin": 4}),
+        SlowSensor('water_level', {"connection": "gpio", "pin": 23}),
+        SlowSensor('light_fullspectrum', {"connection": "i2c", "bus": 1, "multiplex": 0, "channel": 0}),
+        SlowSensor('soil_temp', {"connection": "onewire", "bus": "w1_bus_master1"}),
+    ]
+    report = sweep(sensors)
+    assert len(report['readings']) == 4
+    # about the slowest sensor, not the 0.4s sum
+    assert report['seconds'] < 0.3
+
+
+def test_shared_bus_is_serialized():
+    path = {"connection": "onewire", "bus": "w1_bus_master1"}
+    sensors = [SlowSensor(f'soil_temp_{i}', path, seconds=0.02) for i in range(3)]
+    report = sweep(sensors)
+    assert not any(sensor.overlapped for sensor in sensors)
+    assert report['seconds'] >= 0.06
+
+
+def test_failure_does_not_stop_sweep():
+    sensors = [
+        SlowSensor('water_level', {"connection": "gpio", "pin": 23}, seconds=0, fail=True),
+        SlowSensor('soil_temp', {"connection": "onewire", "bus": "w1_bus_master1"}, seconds=0),
+    ]
+    report = sweep(sensors)
+    assert report['readings'] == [('soil_temp', {"value": 1, "ts": "2025-04-06:03:06:47.000000Z"})]
+    assert report['errors'] == {'water_level': 'no ack'}
+
+
+def test_i2c_bus_is_read_as_one_batch(monkeypatch):
+    batches = []
+
+    class Manager:
+        def read_batch(self, device_paths):
+            batches.append([p['channel'] for p in device_paths])
+            return [{"value": p['channel']} if p['channel'] else IOError('no ack') for p in device_paths]
+
+    monkeypatch.setattr(devices, 'backend', None)
+    monkeypatch.setattr(bus, 'hardware_available', lambda: True)
+    monkeypatch.setattr(bus, 'get_bus', lambda number: Manager())
+    monkeypatch.setitem(bus.DRIVERS, 'fake', None)
+    sensors = [
+        SlowSensor(f'sensor_{channel}', {"connection": "i2c", "bus": 1, "multiplex": 0, "channel": channel, "chip": "fake"})
+        for channel in (2, 0, 1)
+    ]
+    report = sweep(sensors)
+    assert batches == [[2, 0, 1]]
+    assert sorted(report['readings']) == [('sensor_1', {"value": 1}), ('sensor_2', {"value": 2})]
+    assert report['errors'] == {'sensor_0': 'no ack'}
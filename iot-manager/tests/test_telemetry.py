@@ -0,0 +1,44 @@
+import math
+
+import pytest
+
+from datastore import to_reading_rows
+from devices import telemetry
+
+
+def test_round_trip():
+    buffer = telemetry.encode(telemetry.AIR_TEMP_HUMIDITY, 1743465600123, [21.5, 40.25])
+    assert len(buffer) == telemetry.HEADER_SIZE + 8 == 21
+    assert telemetry.decode(buffer) == (telemetry.AIR_TEMP_HUMIDITY, 1743465600123, (21.5, 40.25))
+
+
+def test_batch_to_readings():
+    records = [
+        (telemetry.SOIL_MOISTURE, 1000, [41.0]),
+        (telemetry.AIR_TEMP_HUMIDITY_BAROMETER, 2000, [20.0, float('nan'), 1013.25, 12.0]),
+        (900, 3000, [1.0, 2.0]),
+    ]
+    readings = telemetry.to_readings(telemetry.decode_batch(telemetry.encode_batch(records)))
+    assert readings[0] == ('soil_moisture', {"ts": 1000, "moisture": 41.0})
+    # NaN means not measured
+    assert 'humidity' not in readings[1][1]
+    assert readings[2] == ('sensor_900', {"ts": 3000, "values.0": 1.0, "values.1": 2.0})
+
+    rows = to_reading_rows(*readings[1])
+    assert {row['metric'] for row in rows} == {'temp', 'pressure', 'altitude'}
+    assert all(row['ts'] == 2000 for row in rows)
+
+
+def test_float32_precision():
+    (_, _, (value,)) = telemetry.decode(telemetry.encode(telemetry.SOIL_TEMP, 0, [21.37]))
+    assert math.isclose(value, 21.37, rel_tol=1e-6)
+
+
+def test_rejects_bad_buffers():
+    buffer = telemetry.encode(telemetry.SOIL_TEMP, 0, [1.0])
+    with pytest.raises(ValueError):
+        telemetry.decode(buffer[:-1])
+    with pytest.raises(ValueError):
+        telemetry.decode(b'\x00' + buffer[1:])
+    with pytest.raises(ValueError):
+        telemetry.decode(buffer[:1] + bytes([telemetry.VERSION + 1]) + buffer[2:])
@@ -0,0 +1,42 @@
+import threading
+import time
+
+from services.scheduler import TimerWheel
+
+
+def test_timers_fire_in_order():
+    wheel = TimerWheel().start()
+    fired = []
+    done = threading.Event()
+    for delay_ms in (40, 5, 20, 300, 1):
+        wheel.call_later(delay_ms / 1000, fired.append, delay_ms)
+    wheel.call_later(0.35, done.set)
+    assert done.wait(2)
+    wheel.stop()
+    # 300ms sits in the second level and is cascaded down before firing
+    assert fired == [1, 5, 20, 40, 300]
+    assert wheel.pending == 0
+
+
+def test_timer_never_fires_early():
+    wheel = TimerWheel().start()
+    fired_at = []
+    done = threading.Event()
+    start = time.monotonic()
+    wheel.call_later(0.05, lambda: (fired_at.append(time.monotonic()), done.set()))
+    assert done.wait(2)
+    wheel.stop()
+    assert fired_at[0] - start >= 0.05
+
+
+def test_cancel():
+    wheel = TimerWheel().start()
+    fired = []
+    done = threading.Event()
+    timer = wheel.call_later(0.01, fired.append, 'cancelled')
+    wheel.call_later(0.02, fired.append, 'kept')
+    wheel.call_later(0.03, done.set)
+    timer.cancel()
+    assert done.wait(2)
+    wheel.stop()
+    assert fired == ['kept']
@@ -0,0 +1,99 @@
+import threading
+
+import pytest
+
+from services.triggers import TriggerEngine, TriggerRule, compile_rules, parse_duration_s, parse_trigger
+
+
+def row(value, ts, sensor_id='soil_moisture', metric='moisture'):
+    return {"sensor_id": sensor_id, "metric": metric, "ts": ts, "value": value}
+
+
+def make_engine(**kwargs):
+    fired = []
+    rule = TriggerRule('default.water_pump.0', 'soil_moisture', 'moisture', 'lt', 80.0, 'water_pump', **kwargs)
+    engine = TriggerEngine([rule], fire=lambda rule, row: fired.append(row['ts']))
+    return engine, fired
+
+
+def test_compile_protocol():
+    protocol = {"activities": [
+        {"description": "grow light schedule", "actions": {"light_cwww": {"repeat": "1d", "action": "on"}}},
+        {"description": "watering triggered", "actions": {"water_pump": {
+            "trigger": "soil_moisture, lt, 80", "action": True, "duration": "30s", "hysteresis": 5, "debounce": "1m",
+        }}},
+        {"description": "fan", "actions": {"fan": {"trigger": "air_temp_humidity.temp, gt, 30", "duration": "3m"}}},
+    ]}
+    rules = compile_rules(protocol)
+    assert [r.rule_id for r in rules] == ['default.water_pump.0', 'default.fan.1']
+    pump = rules[0]
+    assert (pump.sensor, pump.metric, pump.op, pump.threshold) == ('soil_moisture', 'moisture', 'lt', 80.0)
+    assert (pump.duration_s, pump.hysteresis, pump.debounce_s) == (30, 5.0, 60)
+    assert pump.action == 'on'
+    assert rules[1].metric == 'temp'
+
+
+def test_parse():
+    assert parse_duration_s('5m') == 300
+    assert parse_duration_s({"h": 1, "m": 0, "s": 30}) == 3630
+    assert parse_duration_s(None) is None
+    with pytest.raises(ValueError):
+        parse_trigger('soil_moisture, below, 80')
+    with pytest.raises(ValueError):
+        parse_trigger('air_temp_humidity, gt, 30')
+
+
+def test_hysteresis():
+    engine, fired = make_engine(hysteresis=5)
+    for ts, value in enumerate([90, 79, 78, 81, 79, 84, 85, 79]):
+        engine.evaluate_rows([row(value, ts)])
+    # 81 and 84 are within the hysteresis band, 85 re-arms
+    assert fired == [1, 7]
+
+
+def test_debounce():
+    engine, fired = make_engine(debounce_s=60)
+    engine.evaluate_rows([row(70, 0), row(70, 30000)])
+    assert fired == []
+    # a recovery resets the debounce window
+    engine.evaluate_rows([row(90, 40000), row(70, 50000), row(70, 100000)])
+    assert fired == []
+    engine.evaluate_rows([row(70, 110000)])
+    assert fired == [110000]
+
+
+def test_only_matching_series():
+    engine, fired = make_engine()
+    engine.evaluate_rows([row(10, 0, metric='temp'), row(10, 0, sensor_id='soil_temp')])
+    assert fired == []
+    # numbered sensors match their type, each with its own state
+    engine.evaluate_rows([row(10, 1, sensor_id='soil_moisture_1'), row(10, 2, sensor_id='soil_moisture_2')])
+    assert fired == [1, 2]
+    assert engine.matching('light_fullspectrum', 'light_total') == []
+
+
+def test_fire_runs_on_and_off_in_the_actuator_worker(monkeypatch):
+    from services import scheduler, triggers, worker
+
+    enqueued = []
+
+    class FakeQueue:
+        def enqueue(self, action, target, meta=None):
+            enqueued.append((action, target))
+
+    monkeypatch.setattr(scheduler, 'get_queue', lambda metadata: FakeQueue())
+    rule = TriggerRule('default.water_pump.0', 'soil_moisture', 'moisture', 'lt', 80.0, 'water_pump', duration_s=0.05)
+    triggers.fire_rule(rule, row(70, 0))
+    # only the on job leaves the evaluating process
+    [(action, target)] = enqueued
+    assert action is worker.job_pump_on and target['duration_s'] == 0.05
+
+    # the actuator worker runs it and turns the pump off on its timer wheel
+    offs = []
+    done = threading.Event()
+    monkeypatch.setattr(worker, 'job_pump_off', lambda target: (offs.append(target), done.set()))
+    monkeypatch.setattr(scheduler, 'timer_wheel', scheduler.TimerWheel().start())
+    action(target)
+    assert done.wait(2)
+    scheduler.timer_wheel.stop()
+    assert offs[0]['rule_id'] == 'default.water_pump.0' and 'duration_s' not in offs[0]
@@ -11,6 +11,21 @@ def load_yaml(path_yaml):
 def now_str():
     return datetime.now(timezone.utc).strftime('%Y-%m-%d:%H:%M:%S.%fZ')
 
+def to_epoch_ms(ts=None):
+    """
+    Convert a datetime, a now_str() string or epoch milliseconds to epoch
+    milliseconds. Naive datetimes are taken as UTC, None means now.
+    """
+    if ts is None:
+        return int(datetime.now(timezone.utc).timestamp() * 1000)
+    if isinstance(ts, (int, float)):
+        return int(ts)
+    if isinstance(ts, str):
+        ts = datetime.strptime(ts, '%Y-%m-%d:%H:%M:%S.%fZ')
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return int(ts.timestamp() * 1000)
+
 import logging
 # from test_div import test_division 
 